@@ -0,0 +1,60 @@
+# noqa: INP001
+"""Add notification outbox.
+
+Revision ID: 5b2f8c1d9e7a
+Revises: c6d237b3de6a
+Create Date: 2026-10-19 09:00:12.418230
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5b2f8c1d9e7a"
+down_revision: str | None = "c6d237b3de6a"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:  # noqa: D103
+    op.create_table(
+        "notification_outbox",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column(
+            "vehicle_key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=False
+        ),
+        sa.Column("make", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("model", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("available_since", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("vehicle_key_hash", "available_since"),
+    )
+    op.create_index(
+        "ix_notification_outbox_pending",
+        "notification_outbox",
+        ["created_at"],
+        unique=False,
+        postgresql_where=sa.text("processed_at IS NULL"),
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.drop_index(
+        "ix_notification_outbox_pending",
+        table_name="notification_outbox",
+        postgresql_where=sa.text("processed_at IS NULL"),
+    )
+    op.drop_table("notification_outbox")
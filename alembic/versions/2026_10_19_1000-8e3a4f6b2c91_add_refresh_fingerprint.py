@@ -0,0 +1,35 @@
+# noqa: INP001
+"""Add refresh fingerprint.
+
+Revision ID: 8e3a4f6b2c91
+Revises: 5b2f8c1d9e7a
+Create Date: 2026-10-19 10:00:41.902114
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8e3a4f6b2c91"
+down_revision: str | None = "5b2f8c1d9e7a"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:  # noqa: D103
+    op.create_table(
+        "refresh_fingerprint",
+        sa.Column("key", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("fingerprint", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.drop_table("refresh_fingerprint")
@@ -0,0 +1,72 @@
+# noqa: INP001
+"""Add indexes on active rows.
+
+Revision ID: 3c7d9a2e4f18
+Revises: 8e3a4f6b2c91
+Create Date: 2026-10-19 11:00:27.551093
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c7d9a2e4f18"
+down_revision: str | None = "8e3a4f6b2c91"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = ["vehicle_cluster", "vehicle", "option", "notification"]
+
+
+def upgrade() -> None:  # noqa: D103
+    for table in TABLES:
+        op.create_index(
+            f"ix_{table}_active_key_hash",
+            table,
+            ["key_hash"],
+            unique=False,
+            postgresql_where=sa.text("active_to IS NULL"),
+            postgresql_include=["attribute_hash_scd1", "attribute_hash_scd2"],
+        )
+        op.create_index(f"ix_{table}_active_to", table, ["active_to"], unique=False)
+    op.create_index(
+        op.f("ix_vehicle_vehicle_cluster_id"),
+        "vehicle",
+        ["vehicle_cluster_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_vehicle_key_hash_active_from",
+        "vehicle",
+        ["key_hash", "active_from"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_option_vehicle_id"), "option", ["vehicle_id"], unique=False
+    )
+    op.create_index(
+        "ix_notification_vehicle_key_hash_available_since",
+        "notification",
+        ["vehicle_key_hash", "available_since"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.drop_index(
+        "ix_notification_vehicle_key_hash_available_since", table_name="notification"
+    )
+    op.drop_index(op.f("ix_option_vehicle_id"), table_name="option")
+    op.drop_index("ix_vehicle_key_hash_active_from", table_name="vehicle")
+    op.drop_index(op.f("ix_vehicle_vehicle_cluster_id"), table_name="vehicle")
+    for table in reversed(TABLES):
+        op.drop_index(f"ix_{table}_active_to", table_name=table)
+        op.drop_index(
+            f"ix_{table}_active_key_hash",
+            table_name=table,
+            postgresql_where=sa.text("active_to IS NULL"),
+        )
@@ -0,0 +1,163 @@
+# noqa: INP001
+"""Partition vehicle and option by active_to.
+
+Current rows (active_to IS NULL) are stored in the default partition
+<table>_current, closed rows in monthly partitions <table>_y<year>m<month>. Future
+partitions are created by the HistoryPartitioner.
+
+A partitioned table can not have a primary key on id alone, and a foreign key must
+refer to a primary key. The primary key on id is therefor replaced by an index, and
+the foreign key option.vehicle_id -> vehicle.id is dropped: the database no longer
+enforces that options refer to an existing vehicle. The models declare id as
+primary key of the mapper only, see PartitionedTable.
+
+Revision ID: 7d1e5b9a3f62
+Revises: 3c7d9a2e4f18
+Create Date: 2026-10-19 12:00:41.208314
+
+"""
+
+from collections.abc import Sequence
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7d1e5b9a3f62"
+down_revision: str | None = "3c7d9a2e4f18"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = ["vehicle", "option"]
+VIEW = "public.vw_vehicle_availability"
+INDEXES = {
+    "vehicle": [
+        ("ix_vehicle_id", ["id"]),
+        ("ix_vehicle_key_hash", ["key_hash"]),
+        ("ix_vehicle_active_to", ["active_to"]),
+        ("ix_vehicle_vehicle_cluster_id", ["vehicle_cluster_id"]),
+        ("ix_vehicle_key_hash_active_from", ["key_hash", "active_from"]),
+    ],
+    "option": [
+        ("ix_option_id", ["id"]),
+        ("ix_option_key_hash", ["key_hash"]),
+        ("ix_option_active_to", ["active_to"]),
+        ("ix_option_vehicle_id", ["vehicle_id"]),
+    ],
+}
+
+
+def upgrade() -> None:  # noqa: D103
+    view = _drop_view()
+    op.drop_constraint("option_vehicle_id_fkey", "option", type_="foreignkey")
+    for table in TABLES:
+        op.rename_table(table, f"{table}_unpartitioned")
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (active_to)"
+        )
+        op.execute(f"CREATE TABLE {table}_current PARTITION OF {table} DEFAULT")
+        for start, end in _months(f"{table}_unpartitioned"):
+            op.execute(
+                f"CREATE TABLE {table}_y{start:%Y}m{start:%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")  # noqa: S608
+        op.drop_table(f"{table}_unpartitioned")
+        _create_indexes(table, primary_key=False)
+    op.create_foreign_key(
+        "vehicle_vehicle_cluster_id_fkey",
+        "vehicle",
+        "vehicle_cluster",
+        ["vehicle_cluster_id"],
+        ["id"],
+    )
+    _create_view(view)
+
+
+def downgrade() -> None:  # noqa: D103
+    view = _drop_view()
+    for table in TABLES:
+        op.rename_table(table, f"{table}_partitioned")
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS)"
+        )
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_partitioned")  # noqa: S608
+        # Drops all attached partitions. Archived partitions are not restored.
+        op.drop_table(f"{table}_partitioned")
+        _create_indexes(table, primary_key=True)
+    op.create_foreign_key(
+        "vehicle_vehicle_cluster_id_fkey",
+        "vehicle",
+        "vehicle_cluster",
+        ["vehicle_cluster_id"],
+        ["id"],
+    )
+    op.create_foreign_key(
+        "option_vehicle_id_fkey", "option", "vehicle", ["vehicle_id"], ["id"]
+    )
+    _create_view(view)
+
+
+def _create_indexes(table: str, *, primary_key: bool) -> None:
+    if primary_key:
+        op.create_primary_key(f"{table}_pkey", table, ["id"])
+    for name, columns in INDEXES[table]:
+        if name == f"ix_{table}_id" and primary_key:
+            continue
+        op.create_index(name, table, columns, unique=False)
+    op.create_index(
+        f"ix_{table}_active_key_hash",
+        table,
+        ["key_hash"],
+        unique=False,
+        postgresql_where=sa.text("active_to IS NULL"),
+        postgresql_include=["attribute_hash_scd1", "attribute_hash_scd2"],
+    )
+
+
+def _months(table: str) -> list[tuple[datetime, datetime]]:
+    """Get the bounds of each month that contains an active_to of a table."""
+    first, last = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT date_trunc('month', min(active_to), 'UTC'), "  # noqa: S608
+                f"date_trunc('month', max(active_to), 'UTC') FROM {table}"
+            )
+        )
+        .one()
+    )
+    months = []
+    while first is not None and first <= last:
+        start = first.astimezone(timezone.utc)
+        first = start.replace(
+            year=start.year + start.month // 12, month=start.month % 12 + 1
+        )
+        months.append((start, first))
+    return months
+
+
+def _drop_view() -> str | None:
+    """Drop vw_vehicle_availability if it exists, since it depends on vehicle.
+
+    Returns
+    -------
+    str | None, the definition of the view, or None if it does not exist
+
+    """
+    bind = op.get_bind()
+    if bind.execute(sa.text(f"SELECT to_regclass('{VIEW}')")).scalar() is None:
+        return None
+    definition = bind.execute(
+        sa.text(f"SELECT pg_get_viewdef('{VIEW}'::regclass, true)")
+    ).scalar_one()
+    op.execute(f"DROP VIEW {VIEW}")
+    return definition
+
+
+def _create_view(definition: str | None) -> None:
+    if definition is not None:
+        op.execute(f"CREATE VIEW {VIEW} AS {definition}")
@@ -0,0 +1,263 @@
+# noqa: INP001
+"""Move the prices of vehicle to vehicle_pricing.
+
+vehicle_pricing is filled from the history of vehicle: contiguous versions of a
+vehicle with equal prices become one pricing version. Since the prices are no longer
+scd2 attributes of vehicle, the attribute_hash_scd2 of the current vehicles is
+recomputed. Vehicle versions that only differed in price can be merged afterwards by
+the HistoryCompactor.
+
+Like vehicle, vehicle_pricing is partitioned by active_to.
+
+Revision ID: 4f8b2d6e1a97
+Revises: 7d1e5b9a3f62
+Create Date: 2026-10-19 13:00:12.640175
+
+"""
+
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from hashlib import sha256
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4f8b2d6e1a97"
+down_revision: str | None = "7d1e5b9a3f62"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+PRICES = [
+    "base_price_in_euro_per_month",
+    "calculated_price_in_euro_per_month",
+    "contribution_in_euro",
+    "expected_fuel_cost_in_euro_per_month",
+    "fuel_price_per_km",
+    "net_cost_in_euro_per_month",
+    "price_per_km",
+]
+# Sorted scd2 attributes of vehicle without the prices, see BaseTable
+VEHICLE_SCD2_ATTRIBUTES = [
+    "addition_percentage",
+    "avg_fuel_consumption",
+    "body_type",
+    "color",
+    "emission",
+    "external_fuel_type_id",
+    "external_paint_id",
+    "external_type_id",
+    "fiscal_value_in_euro",
+    "image_uri",
+    "is_electric",
+    "license_plate",
+    "make",
+    "model",
+    "model_year",
+    "official_color",
+    "paint_id",
+    "range_in_km",
+    "registered_mileage",
+    "registration_date",
+    "transmission_type",
+    "type",
+    "type_spare_wheel",
+    "uri",
+]
+HASH_SEPARATOR = "-"
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:  # noqa: D103
+    op.create_table(
+        "vehicle_pricing",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column(
+            "attribute_hash_scd1", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        sa.Column(
+            "attribute_hash_scd2", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        sa.Column("active_from", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("active_to", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("is_current", sa.Boolean(), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column(
+            "vehicle_key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        *[sa.Column(price, sa.Float(), nullable=True) for price in PRICES],
+        postgresql_partition_by="RANGE (active_to)",
+    )
+    op.execute(
+        "CREATE TABLE vehicle_pricing_current PARTITION OF vehicle_pricing DEFAULT"
+    )
+    for start, end in _months("vehicle"):
+        op.execute(
+            f"CREATE TABLE vehicle_pricing_y{start:%Y}m{start:%m} "
+            "PARTITION OF vehicle_pricing "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    _fill_pricing()
+    _update_hashes(
+        "vehicle_pricing",
+        PRICES,
+        "vehicle_pricing.attribute_hash_scd2 IS NULL",
+    )
+    _update_hashes("vehicle", VEHICLE_SCD2_ATTRIBUTES, "vehicle.active_to IS NULL")
+    for price in PRICES:
+        op.drop_column("vehicle", price)
+    op.create_index("ix_vehicle_pricing_id", "vehicle_pricing", ["id"], unique=False)
+    op.create_index(
+        op.f("ix_vehicle_pricing_key_hash"),
+        "vehicle_pricing",
+        ["key_hash"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_vehicle_pricing_vehicle_key_hash"),
+        "vehicle_pricing",
+        ["vehicle_key_hash"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_vehicle_pricing_active_key_hash",
+        "vehicle_pricing",
+        ["key_hash"],
+        unique=False,
+        postgresql_where=sa.text("active_to IS NULL"),
+        postgresql_include=["attribute_hash_scd1", "attribute_hash_scd2"],
+    )
+    op.create_index(
+        "ix_vehicle_pricing_active_to",
+        "vehicle_pricing",
+        ["active_to"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    for price in PRICES:
+        op.add_column("vehicle", sa.Column(price, sa.Float(), nullable=True))
+    # Each vehicle version gets the pricing that was active when it started
+    op.execute(
+        f"UPDATE vehicle SET {', '.join(f'{p} = pricing.{p}' for p in PRICES)} "  # noqa: S608
+        "FROM vehicle_pricing pricing "
+        "WHERE pricing.vehicle_key_hash = vehicle.key_hash "
+        "AND pricing.active_from <= vehicle.active_from "
+        "AND (pricing.active_to IS NULL OR pricing.active_to > vehicle.active_from)"
+    )
+    # The attribute_hash_scd2 of vehicle is stale: the next refresh creates a new
+    # version of each current vehicle.
+    op.drop_table("vehicle_pricing")
+
+
+def _fill_pricing() -> None:
+    """Create a pricing version for each run of vehicle versions with equal prices.
+
+    A run is a sequence of versions, of which each starts at the active_to of the
+    previous one, and has the same prices. Runs without prices are skipped, since
+    no pricing is created for a vehicle without pricing.
+    """
+    prices = ", ".join(PRICES)
+    op.execute(
+        f"""
+        INSERT INTO vehicle_pricing (
+            id, key_hash, attribute_hash_scd1, active_from, active_to, is_current,
+            vehicle_key_hash, {prices}
+        )
+        WITH versions AS (
+            SELECT
+                *,
+                COALESCE(
+                    LAG(active_to) OVER w = active_from
+                    AND LAG(ROW({prices})::text) OVER w = ROW({prices})::text,
+                    false
+                ) AS continues_previous
+            FROM vehicle
+            WINDOW w AS (PARTITION BY key_hash ORDER BY active_from)
+        ),
+        runs AS (
+            SELECT
+                *,
+                SUM((NOT continues_previous)::int) OVER (
+                    PARTITION BY key_hash ORDER BY active_from
+                ) AS run
+            FROM versions
+        )
+        SELECT
+            gen_random_uuid(),
+            encode(sha256(convert_to(key_hash, 'UTF8')), 'hex'),
+            encode(sha256(''::bytea), 'hex'),
+            MIN(active_from),
+            (array_agg(active_to ORDER BY active_from DESC))[1],
+            (array_agg(is_current ORDER BY active_from DESC))[1],
+            key_hash,
+            {", ".join(f"MIN({price})" for price in PRICES)}
+        FROM runs
+        GROUP BY key_hash, run
+        HAVING COALESCE({", ".join(f"MIN({price})" for price in PRICES)}) IS NOT NULL
+        """
+    )
+
+
+def _update_hashes(table: str, attributes: list[str], condition: str) -> None:
+    """Compute attribute_hash_scd2 of rows like BaseTable, in batches."""
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.text(
+            f"SELECT id, {', '.join(attributes)} FROM {table} WHERE {condition}"  # noqa: S608
+        )
+    ).all()
+    statement = sa.text(
+        f"UPDATE {table} SET attribute_hash_scd2 = :hash WHERE id = :id"  # noqa: S608
+    )
+    for start in range(0, len(rows), BATCH_SIZE):
+        bind.execute(
+            statement,
+            [
+                {"id": row[0], "hash": _hash(row[1:])}
+                for row in rows[start : start + BATCH_SIZE]
+            ],
+        )
+
+
+def _hash(values: Sequence) -> str:
+    return sha256(
+        HASH_SEPARATOR.join(str(value) for value in values).encode()
+    ).hexdigest()
+
+
+def _months(table: str) -> list[tuple[datetime, datetime]]:
+    """Get the bounds of each month that contains an active_to of a table."""
+    first, last = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT date_trunc('month', min(active_to), 'UTC'), "  # noqa: S608
+                f"date_trunc('month', max(active_to), 'UTC') FROM {table}"
+            )
+        )
+        .one()
+    )
+    months = []
+    while first is not None and first <= last:
+        start = first.astimezone(timezone.utc)
+        first = start.replace(
+            year=start.year + start.month // 12, month=start.month % 12 + 1
+        )
+        months.append((start, first))
+    return months
@@ -0,0 +1,328 @@
+# noqa: INP001
+"""Replace option by option_catalog and vehicle_option_set.
+
+option_catalog gets one row per athlon_id, with the latest name of the option.
+vehicle_option_set is filled from the history of vehicle: each vehicle version
+gets the options that were current for it, and contiguous versions with equal
+options become one option set version. Since the ids of the options are sorted in
+the same order as in Python (COLLATE "C"), the hashes computed in Python match the
+hashes of the upserter.
+
+Like vehicle, vehicle_option_set is partitioned by active_to.
+
+Downgrade only restores the options of the current vehicles.
+
+Revision ID: 9a6c3e7f2b15
+Revises: 4f8b2d6e1a97
+Create Date: 2026-10-19 14:00:09.317452
+
+"""
+
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from hashlib import sha256
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9a6c3e7f2b15"
+down_revision: str | None = "4f8b2d6e1a97"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+HASH_SEPARATOR = "-"
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:  # noqa: D103
+    op.create_table(
+        "option_catalog",
+        *_generated_columns(),
+        sa.Column("athlon_id", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("externalId", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("optionName", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "vehicle_option_set",
+        *_generated_columns(),
+        sa.Column(
+            "vehicle_key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        sa.Column("option_ids", sa.ARRAY(sa.String()), nullable=True),
+        sa.Column("included_option_ids", sa.ARRAY(sa.String()), nullable=True),
+        postgresql_partition_by="RANGE (active_to)",
+    )
+    op.execute(
+        "CREATE TABLE vehicle_option_set_current PARTITION OF vehicle_option_set "
+        "DEFAULT"
+    )
+    for start, end in _months("vehicle"):
+        op.execute(
+            f"CREATE TABLE vehicle_option_set_y{start:%Y}m{start:%m} "
+            "PARTITION OF vehicle_option_set "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    op.execute(
+        """
+        INSERT INTO option_catalog (
+            id, key_hash, attribute_hash_scd1, active_from, is_current, athlon_id,
+            "externalId", "optionName"
+        )
+        SELECT DISTINCT ON (athlon_id)
+            gen_random_uuid(),
+            encode(sha256(convert_to(athlon_id, 'UTF8')), 'hex'),
+            encode(sha256(''::bytea), 'hex'),
+            MIN(active_from) OVER (PARTITION BY athlon_id),
+            true,
+            athlon_id,
+            "externalId",
+            "optionName"
+        FROM option
+        ORDER BY athlon_id, active_from DESC
+        """
+    )
+    _fill_option_sets()
+    _update_hashes(
+        "option_catalog",
+        ['"externalId"', '"optionName"'],
+        "option_catalog.attribute_hash_scd2 IS NULL",
+    )
+    _update_hashes(
+        "vehicle_option_set",
+        ["included_option_ids", "option_ids"],
+        "vehicle_option_set.attribute_hash_scd2 IS NULL",
+    )
+    op.drop_table("option")
+    _create_indexes("option_catalog")
+    _create_indexes("vehicle_option_set")
+    op.create_index(
+        "ix_vehicle_option_set_id", "vehicle_option_set", ["id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_vehicle_option_set_vehicle_key_hash"),
+        "vehicle_option_set",
+        ["vehicle_key_hash"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.create_table(
+        "option",
+        *_generated_columns(),
+        sa.Column("athlon_id", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("externalId", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("optionName", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("included", sa.Boolean(), nullable=False),
+        sa.Column("vehicle_id", sa.Uuid(), nullable=False),
+        postgresql_partition_by="RANGE (active_to)",
+    )
+    op.execute("CREATE TABLE option_current PARTITION OF option DEFAULT")
+    # Hashes as computed by BaseTable: business keys athlon_id and vehicle_id,
+    # scd1 attribute vehicle_id, and scd2 attributes externalId, included and
+    # optionName.
+    op.execute(
+        """
+        INSERT INTO option (
+            id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+            is_current, athlon_id, "externalId", "optionName", included, vehicle_id
+        )
+        SELECT
+            gen_random_uuid(),
+            encode(sha256(convert_to(
+                catalog.athlon_id || '-' || vehicle.id::text, 'UTF8'
+            )), 'hex'),
+            encode(sha256(convert_to(vehicle.id::text, 'UTF8')), 'hex'),
+            encode(sha256(convert_to(
+                catalog."externalId" || '-'
+                || CASE WHEN option_id = ANY(option_set.included_option_ids)
+                    THEN 'True' ELSE 'False' END
+                || '-' || catalog."optionName",
+                'UTF8'
+            )), 'hex'),
+            option_set.active_from,
+            true,
+            catalog.athlon_id,
+            catalog."externalId",
+            catalog."optionName",
+            option_id = ANY(option_set.included_option_ids),
+            vehicle.id
+        FROM vehicle_option_set option_set
+        CROSS JOIN unnest(option_set.option_ids) option_id
+        JOIN option_catalog catalog
+            ON catalog.athlon_id = option_id AND catalog.active_to IS NULL
+        JOIN vehicle
+            ON vehicle.key_hash = option_set.vehicle_key_hash
+            AND vehicle.active_to IS NULL
+        WHERE option_set.active_to IS NULL
+        """
+    )
+    op.drop_table("vehicle_option_set")
+    op.drop_table("option_catalog")
+    op.create_index("ix_option_id", "option", ["id"], unique=False)
+    op.create_index(op.f("ix_option_vehicle_id"), "option", ["vehicle_id"])
+    _create_indexes("option")
+
+
+def _generated_columns() -> list[sa.Column]:
+    """Get the columns of BaseTable."""
+    return [
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column(
+            "attribute_hash_scd1", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        sa.Column(
+            "attribute_hash_scd2", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+        sa.Column("active_from", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("active_to", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("is_current", sa.Boolean(), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+    ]
+
+
+def _create_indexes(table: str) -> None:
+    op.create_index(op.f(f"ix_{table}_key_hash"), table, ["key_hash"], unique=False)
+    op.create_index(
+        f"ix_{table}_active_key_hash",
+        table,
+        ["key_hash"],
+        unique=False,
+        postgresql_where=sa.text("active_to IS NULL"),
+        postgresql_include=["attribute_hash_scd1", "attribute_hash_scd2"],
+    )
+    op.create_index(f"ix_{table}_active_to", table, ["active_to"], unique=False)
+
+
+def _fill_option_sets() -> None:
+    """Create an option set version for each run of vehicle versions.
+
+    The options of a vehicle version are the options that refer to it, in their
+    last version. A run is a sequence of vehicle versions, of which each starts at
+    the active_to of the previous one, and has the same options. Vehicles without
+    options get no option set.
+    """
+    op.execute(
+        """
+        INSERT INTO vehicle_option_set (
+            id, key_hash, attribute_hash_scd1, active_from, active_to, is_current,
+            vehicle_key_hash, option_ids, included_option_ids
+        )
+        WITH vehicle_options AS (
+            SELECT
+                vehicle.key_hash,
+                vehicle.active_from,
+                vehicle.active_to,
+                vehicle.is_current,
+                array_agg(option.athlon_id ORDER BY option.athlon_id COLLATE "C")
+                    AS option_ids,
+                array_agg(option.athlon_id ORDER BY option.athlon_id COLLATE "C")
+                    FILTER (WHERE option.included) AS included_option_ids
+            FROM vehicle
+            JOIN option
+                ON option.vehicle_id = vehicle.id AND option.is_current IS NOT FALSE
+            GROUP BY vehicle.id, vehicle.key_hash, vehicle.active_from,
+                vehicle.active_to, vehicle.is_current
+        ),
+        versions AS (
+            SELECT
+                *,
+                COALESCE(
+                    LAG(active_to) OVER w = active_from
+                    AND LAG(ROW(option_ids, included_option_ids)::text) OVER w
+                        = ROW(option_ids, included_option_ids)::text,
+                    false
+                ) AS continues_previous
+            FROM vehicle_options
+            WINDOW w AS (PARTITION BY key_hash ORDER BY active_from)
+        ),
+        runs AS (
+            SELECT
+                *,
+                SUM((NOT continues_previous)::int) OVER (
+                    PARTITION BY key_hash ORDER BY active_from
+                ) AS run
+            FROM versions
+        )
+        SELECT
+            gen_random_uuid(),
+            encode(sha256(convert_to(key_hash, 'UTF8')), 'hex'),
+            encode(sha256(''::bytea), 'hex'),
+            MIN(active_from),
+            (array_agg(active_to ORDER BY active_from DESC))[1],
+            (array_agg(is_current ORDER BY active_from DESC))[1],
+            key_hash,
+            (array_agg(option_ids ORDER BY active_from DESC))[1],
+            COALESCE(
+                (array_agg(included_option_ids ORDER BY active_from DESC))[1],
+                ARRAY[]::varchar[]
+            )
+        FROM runs
+        GROUP BY key_hash, run
+        """
+    )
+
+
+def _update_hashes(table: str, attributes: list[str], condition: str) -> None:
+    """Compute attribute_hash_scd2 of rows like BaseTable, in batches."""
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.text(
+            f"SELECT id, {', '.join(attributes)} FROM {table} WHERE {condition}"  # noqa: S608
+        )
+    ).all()
+    statement = sa.text(
+        f"UPDATE {table} SET attribute_hash_scd2 = :hash WHERE id = :id"  # noqa: S608
+    )
+    for start in range(0, len(rows), BATCH_SIZE):
+        bind.execute(
+            statement,
+            [
+                {"id": row[0], "hash": _hash(row[1:])}
+                for row in rows[start : start + BATCH_SIZE]
+            ],
+        )
+
+
+def _hash(values: Sequence) -> str:
+    return sha256(
+        HASH_SEPARATOR.join(str(value) for value in values).encode()
+    ).hexdigest()
+
+
+def _months(table: str) -> list[tuple[datetime, datetime]]:
+    """Get the bounds of each month that contains an active_to of a table."""
+    first, last = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT date_trunc('month', min(active_to), 'UTC'), "  # noqa: S608
+                f"date_trunc('month', max(active_to), 'UTC') FROM {table}"
+            )
+        )
+        .one()
+    )
+    months = []
+    while first is not None and first <= last:
+        start = first.astimezone(timezone.utc)
+        first = start.replace(
+            year=start.year + start.month // 12, month=start.month % 12 + 1
+        )
+        months.append((start, first))
+    return months
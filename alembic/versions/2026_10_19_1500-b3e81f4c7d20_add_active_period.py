@@ -0,0 +1,60 @@
+# noqa: INP001
+"""Add the generated column active_period to the SCD2 tables, with a GiST index.
+
+active_period is the range [active_from, active_to), and supports the point-in-time
+queries BaseTable.as_of and BaseTable.between. Adding a stored generated column
+rewrites each table.
+
+Revision ID: b3e81f4c7d20
+Revises: 9a6c3e7f2b15
+Create Date: 2026-10-19 15:00:27.904512
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b3e81f4c7d20"
+down_revision: str | None = "9a6c3e7f2b15"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = [
+    "vehicle_cluster",
+    "vehicle",
+    "vehicle_pricing",
+    "option_catalog",
+    "vehicle_option_set",
+    "notification",
+]
+
+
+def upgrade() -> None:  # noqa: D103
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column(
+                "active_period",
+                postgresql.TSTZRANGE(),
+                sa.Computed("tstzrange(active_from, active_to, '[)')", persisted=True),
+                nullable=False,
+            ),
+        )
+        op.create_index(
+            f"ix_{table}_active_period",
+            table,
+            ["active_period"],
+            unique=False,
+            postgresql_using="gist",
+        )
+
+
+def downgrade() -> None:  # noqa: D103
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_active_period", table_name=table)
+        op.drop_column(table, "active_period")
@@ -0,0 +1,72 @@
+# noqa: INP001
+"""Add digest item.
+
+Revision ID: e5c2a8d71f43
+Revises: b3e81f4c7d20
+Create Date: 2026-10-19 16:00:08.275641
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e5c2a8d71f43"
+down_revision: str | None = "b3e81f4c7d20"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:  # noqa: D103
+    op.create_table(
+        "digest_item",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("subscriber", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column(
+            "vehicle_key_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=False
+        ),
+        sa.Column("make", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("model", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("available_since", sa.DateTime(timezone=True), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("subscriber", "vehicle_key_hash", "available_since"),
+    )
+    op.create_index(
+        "ix_digest_item_pending",
+        "digest_item",
+        ["subscriber", "created_at"],
+        unique=False,
+        postgresql_where=sa.text("sent_at IS NULL"),
+    )
+    op.create_index(
+        "ix_digest_item_sent",
+        "digest_item",
+        ["subscriber", "sent_at"],
+        unique=False,
+        postgresql_where=sa.text("sent_at IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.drop_index(
+        "ix_digest_item_sent",
+        table_name="digest_item",
+        postgresql_where=sa.text("sent_at IS NOT NULL"),
+    )
+    op.drop_index(
+        "ix_digest_item_pending",
+        table_name="digest_item",
+        postgresql_where=sa.text("sent_at IS NULL"),
+    )
+    op.drop_table("digest_item")
@@ -0,0 +1,31 @@
+# noqa: INP001
+"""Add outbox claimed at.
+
+Revision ID: c1f7a3e9d254
+Revises: e5c2a8d71f43
+Create Date: 2026-10-19 17:00:12.604318
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c1f7a3e9d254"
+down_revision: str | None = "e5c2a8d71f43"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:  # noqa: D103
+    op.add_column(
+        "notification_outbox",
+        sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:  # noqa: D103
+    op.drop_column("notification_outbox", "claimed_at")
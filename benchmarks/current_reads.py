@@ -0,0 +1,154 @@
+# noqa: INP001
+"""Compare reads of current rows through the exclude_inactive hook and the fast path.
+
+The hook (bootstrap._exclude_inactive, opt-in by execution option exclude_inactive)
+adds with_loader_criteria to each SELECT. The fast path executes the statements of
+base_table.current_rows, which are built once per table.
+
+Measures, for each SCD2 table:
+- cache key: generating the cache key of the statement, done on each execution to
+    look up the compiled statement.
+- compile: compiling the statement for Postgres, done on a cache miss.
+- execute (with --execute): loading the current rows by key hash through a Session.
+    Requires a running Postgres with all migrations applied, configured through the
+    POSTGRES_* environment variables.
+
+Usage:
+    python benchmarks/current_reads.py [--repeat 2000] [--execute]
+"""
+
+import argparse
+from collections.abc import Callable
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import Select, create_engine, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import configure_mappers, with_loader_criteria
+from sqlmodel import Session
+
+from athlon_flex_notifier.bootstrap import database_url
+from athlon_flex_notifier.models.tables import (
+    Notification,
+    OptionCatalog,
+    Vehicle,
+    VehicleCluster,
+    VehicleOptionSet,
+    VehiclePricing,
+)
+from athlon_flex_notifier.models.tables.base_table import (
+    BaseTable,
+    current_rows_by_key_hashes,
+)
+
+TABLES = [
+    VehicleCluster,
+    Vehicle,
+    VehiclePricing,
+    OptionCatalog,
+    VehicleOptionSet,
+    Notification,
+]
+KEY_HASHES = [f"bench-{n}" for n in range(100)]
+
+
+def hooked(table: type[BaseTable]) -> Select:
+    """Build the statement as executed through the hook, with its criteria."""
+    return (
+        select(table)
+        .where(table.key_hash.in_(KEY_HASHES))
+        .options(
+            with_loader_criteria(
+                BaseTable,
+                lambda cls: (not hasattr(cls, "active_to")) or cls.active_to.is_(None),
+                include_aliases=True,
+            )
+        )
+    )
+
+
+def microseconds(function: Callable[[], object], repeat: int) -> float:
+    """Get the median duration of function in microseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        durations.append(perf_counter() - start)
+    return median(durations) * 1e6
+
+
+def report(name: str, hook: float, fast: float) -> None:
+    """Print the durations of the hook and the fast path."""
+    print(  # noqa: T201
+        f"{name:<40} hook {hook:>10.1f}us  fast {fast:>10.1f}us  "
+        f"x{hook / fast:>6.1f}"
+    )
+
+
+def main() -> None:
+    """Measure and print the durations of both paths."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--execute", action="store_true")
+    arguments = parser.parse_args()
+    configure_mappers()
+    dialect = postgresql.dialect()
+    for table in TABLES:
+        name = table.__tablename__
+        report(
+            f"{name}: cache key",
+            microseconds(
+                lambda table=table: hooked(table)._generate_cache_key(),  # noqa: SLF001
+                arguments.repeat,
+            ),
+            microseconds(
+                lambda table=table: (
+                    current_rows_by_key_hashes(table)._generate_cache_key()  # noqa: SLF001
+                ),
+                arguments.repeat,
+            ),
+        )
+        report(
+            f"{name}: compile",
+            microseconds(
+                lambda table=table: hooked(table).compile(dialect=dialect),
+                arguments.repeat // 10,
+            ),
+            microseconds(
+                lambda table=table: (
+                    current_rows_by_key_hashes(table).compile(dialect=dialect)
+                ),
+                arguments.repeat // 10,
+            ),
+        )
+    if not arguments.execute:
+        return
+    engine = create_engine(database_url())
+    with Session(engine) as session:
+        for table in TABLES:
+            report(
+                f"{table.__tablename__}: execute",
+                microseconds(
+                    lambda table=table: session.exec(
+                        select(table).where(table.key_hash.in_(KEY_HASHES)),
+                        execution_options={"exclude_inactive": True},
+                    )
+                    .unique()
+                    .all(),
+                    arguments.repeat // 10,
+                ),
+                microseconds(
+                    lambda table=table: session.exec(
+                        current_rows_by_key_hashes(table),
+                        params={"key_hashes": KEY_HASHES},
+                    )
+                    .unique()
+                    .all(),
+                    arguments.repeat // 10,
+                ),
+            )
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
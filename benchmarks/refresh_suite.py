@@ -0,0 +1,217 @@
+# noqa: INP001
+"""Benchmark the storage path of the refresh on a synthetic fleet.
+
+Generates a fleet with the FleetSimulator, and stores it like the refresh does,
+through VehicleCluster.store_api_response. The first refresh loads the complete
+fleet into empty tables. Each following refresh stores the fleet after one step of
+churn. After each refresh, vw_vehicle_availability is loaded.
+
+Records per refresh:
+- the duration of each phase: the time_it blocks of the storage path (upserting
+    clusters, vehicles, pricing, option catalog and option sets), the total of
+    store_api_response, and loading vw_vehicle_availability
+- the number of statements sent to Postgres
+- the peak memory allocated by Python (tracemalloc)
+
+Reports the initial refresh, and the median of the churned refreshes. The results
+are compared with the baseline in benchmarks/baselines/refresh_suite.json, if it was
+recorded with the same arguments. With --check, exits with 1 if a duration or the
+peak memory regressed by more than --tolerance, or if more statements were sent.
+--save-baseline stores the results as new baseline.
+
+Writes to the database: requires a running Postgres with all migrations applied,
+configured through the POSTGRES_* environment variables, of which the SCD2 tables
+are empty. Pass --reset to truncate them first. Never run against production.
+
+Usage:
+    python benchmarks/refresh_suite.py [--clusters 50] [--vehicles 20] [--options 5]
+        [--churn 0.05] [--refreshes 10] [--reset] [--check] [--save-baseline]
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from statistics import median
+from typing import Any
+
+from kink import di
+from sqlalchemy import Engine, event, text
+
+from athlon_flex_notifier.bootstrap import bootstrap_di
+from athlon_flex_notifier.models.tables import VehicleCluster
+from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+
+BASELINE = Path(__file__).parent / "baselines" / "refresh_suite.json"
+TABLES = [
+    "vehicle_cluster",
+    "vehicle",
+    "vehicle_pricing",
+    "option_catalog",
+    "vehicle_option_set",
+    "notification",
+    "notification_outbox",
+    "refresh_fingerprint",
+]
+TIME_IT_MESSAGE = "%s took %s seconds"
+
+
+class PhaseTimings(logging.Handler):
+    """Collect the durations logged by utils.time_it."""
+
+    def __init__(self) -> None:
+        super().__init__(level=logging.DEBUG)
+        self.durations: dict[str, float] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.msg == TIME_IT_MESSAGE:
+            name, seconds = record.args
+            self.durations[name] = self.durations.get(name, 0.0) + float(seconds)
+
+
+class StatementCounter:
+    """Count the statements executed by an engine."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_: Any) -> None:  # noqa: ANN401
+        self.count += 1
+
+
+def refresh(
+    simulator: FleetSimulator, timings: PhaseTimings, statements: StatementCounter
+) -> dict[str, float]:
+    """Store the current fleet, and load vw_vehicle_availability."""
+    response = simulator.vehicle_clusters()
+    timings.durations = {}
+    statements.count = 0
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    VehicleCluster.store_api_response(response)
+    stored = time.perf_counter()
+    availabilities = VehicleAvailability.all()
+    loaded = time.perf_counter()
+    return {
+        **{f"{name} (s)": seconds for name, seconds in timings.durations.items()},
+        "store_api_response (s)": stored - start,
+        "vw_vehicle_availability (s)": loaded - stored,
+        "availabilities": len(availabilities),
+        "statements": statements.count,
+        "peak memory (MiB)": tracemalloc.get_traced_memory()[1] / 2**20,
+    }
+
+
+def summarize(results: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+    """Get the initial refresh, and the median of the churned refreshes."""
+    churned = results[1:]
+    return {
+        "initial": results[0],
+        "churned (median)": {
+            metric: median(result.get(metric, 0.0) for result in churned)
+            for metric in churned[0]
+        }
+        if churned
+        else {},
+    }
+
+
+def regressed(metric: str, value: float, baseline: float, tolerance: float) -> bool:
+    """Check if a metric is worse than its baseline.
+
+    Durations and memory regress beyond the tolerance, the statement count on any
+    increase. Other counts describe the data, and do not regress.
+    """
+    if metric == "statements":
+        return value > baseline
+    if metric.endswith(("(s)", "(MiB)")):
+        return value > baseline * (1 + tolerance)
+    return False
+
+
+def compare(
+    summary: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]] | None,
+    tolerance: float,
+) -> int:
+    """Print the summary next to the baseline, and get the number of regressions."""
+    regressions = 0
+    for section, metrics in summary.items():
+        print(f"\n{section}")  # noqa: T201
+        for metric, value in metrics.items():
+            line = f"  {metric:<58}{value:>12.3f}"
+            reference = (baseline or {}).get(section, {}).get(metric)
+            if reference:
+                worse = regressed(metric, value, reference, tolerance)
+                regressions += worse
+                line += f"{reference:>12.3f}{value / reference:>8.2f}x"
+                line += "  REGRESSION" if worse else ""
+            print(line)  # noqa: T201
+    return regressions
+
+
+def main() -> None:
+    """Run the refreshes, and compare with the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--refreshes", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true")
+    arguments = parser.parse_args()
+    config = {
+        key: getattr(arguments, key)
+        for key in ["clusters", "vehicles", "options", "churn", "refreshes", "seed"]
+    }
+    bootstrap_di()
+    engine: Engine = di["database"]
+    with engine.begin() as connection:
+        if arguments.reset:
+            connection.execute(text(f"TRUNCATE {', '.join(TABLES)}"))
+        elif connection.execute(text("SELECT EXISTS (SELECT FROM vehicle)")).scalar():
+            sys.exit("Tables are not empty, pass --reset to truncate them")
+    timings = PhaseTimings()
+    di[logging.Logger].addHandler(timings)
+    statements = StatementCounter(engine)
+    simulator = FleetSimulator(
+        clusters=arguments.clusters,
+        vehicles_per_cluster=arguments.vehicles,
+        options_per_vehicle=arguments.options,
+        churn=arguments.churn,
+        seed=arguments.seed,
+    )
+    tracemalloc.start()
+    results = [refresh(simulator, timings, statements)]
+    for _ in range(arguments.refreshes):
+        simulator.advance()
+        results.append(refresh(simulator, timings, statements))
+    tracemalloc.stop()
+    summary = summarize(results)
+    stored = json.loads(BASELINE.read_text()) if BASELINE.exists() else None
+    baseline = (
+        stored["summary"] if stored is not None and stored["config"] == config else None
+    )
+    print(f"{config}, baseline: {'yes' if baseline else 'no'}")  # noqa: T201
+    regressions = compare(summary, baseline, arguments.tolerance)
+    if arguments.save_baseline:
+        BASELINE.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE.write_text(
+            json.dumps({"config": config, "summary": summary}, indent=2) + "\n"
+        )
+        print(f"\nStored baseline in {BASELINE}")  # noqa: T201
+    engine.dispose()
+    sys.exit(1 if arguments.check and regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
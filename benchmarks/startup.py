@@ -0,0 +1,109 @@
+# noqa: INP001
+"""Measure the import time of the worker and the package, against a budget.
+
+Imports each target in a fresh interpreter with python -X importtime, --repeat
+times, and reports the median cumulative import time. Prefect itself is the floor:
+the worker cannot start without prefect.flows, and defining a flow imports
+prefect.context (for the settings of its task runner). The overhead of a
+target is its import time minus the floor, or its import time if it does not import
+Prefect. The overhead is compared with --budget.
+
+Heavy dependencies are imported on first use, see docs/development.md#startup-time.
+The targets must therefor not import any of DEFERRED. With --check, exits with 1 if
+the overhead of a target exceeds the budget, or if it imports a deferred module.
+
+Does not require Postgres or the Prefect server.
+
+Usage:
+    python benchmarks/startup.py [--repeat 7] [--budget 0.3] [--top 10] [--check]
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import Counter
+from statistics import median
+
+FLOOR = ["prefect.flows", "prefect.context"]
+TARGETS = ["athlon_flex_notifier", "athlon_flex_notifier.flows"]
+DEFERRED = [
+    "sqlalchemy",
+    "sqlmodel",
+    "psycopg",
+    "psycopg2",
+    "aiohttp",
+    "athlon_flex_client",
+    "jinja2",
+]
+
+
+def import_time(modules: list[str]) -> tuple[float, Counter[str]]:
+    """Import modules in a fresh interpreter.
+
+    Returns
+    -------
+    float, the summed cumulative import time of modules in seconds
+    Counter[str], the self import time in seconds per top-level package
+
+    """
+    result = subprocess.run(  # noqa: S603
+        [
+            *(sys.executable, "-X", "importtime", "-W", "ignore"),
+            *("-c", f"import {', '.join(modules)}"),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0.0
+    packages: Counter[str] = Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(own) / 1e6
+        if name.strip() in modules and not name.startswith("  "):
+            total += int(cumulative) / 1e6
+    return total, packages
+
+
+def measure(modules: list[str], repeat: int) -> tuple[float, Counter[str]]:
+    """Get the median import time of modules, and the packages of the median run.
+
+    The first import is discarded, since it may compile the bytecode.
+    """
+    import_time(modules)
+    runs = sorted((import_time(modules) for _ in range(repeat)), key=lambda r: r[0])
+    return median(total for total, _ in runs), runs[len(runs) // 2][1]
+
+
+def main() -> None:
+    """Measure the targets, and compare with the budget."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--budget", type=float, default=0.3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--check", action="store_true")
+    arguments = parser.parse_args()
+    floor, _ = measure(FLOOR, arguments.repeat)
+    print(f"{', '.join(FLOOR):<30}{floor:>8.3f} s (floor)")  # noqa: T201
+    failures = 0
+    for target in TARGETS:
+        total, packages = measure([target], arguments.repeat)
+        overhead = total - floor if "prefect" in packages else total
+        deferred = sorted(package for package in DEFERRED if package in packages)
+        over_budget = overhead > arguments.budget
+        failures += over_budget + bool(deferred)
+        print(  # noqa: T201
+            f"\n{target:<30}{total:>8.3f} s, overhead {overhead:.3f} s of "
+            f"{arguments.budget:.3f} s{'  OVER BUDGET' if over_budget else ''}"
+        )
+        if deferred:
+            print(f"  imports deferred modules: {', '.join(deferred)}")  # noqa: T201
+        for package, seconds in packages.most_common(arguments.top):
+            print(f"  {package:<28}{seconds:>8.3f} s")  # noqa: T201
+    sys.exit(1 if arguments.check and failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# noqa: INP001
+"""Benchmark the statements of the Upserter, using psycopg2 and psycopg 3.
+
+Runs the statement patterns of the Upserter against a temporary table:
+- scd1: executemany of an UPDATE with bind parameters
+- close: executemany of an UPDATE that closes rows
+- insert: one multi-row INSERT
+- select: SELECT of the key hashes of the batch
+
+Each pattern is repeated, such that psycopg 3 prepares the statements server-side
+(POSTGRES_PREPARE_THRESHOLD) and runs executemany in pipeline mode.
+
+Requires a running Postgres, configured through the POSTGRES_* environment
+variables. Both drivers must be installed.
+
+Usage:
+    python benchmarks/upsert_drivers.py [--rows 5000] [--repeat 5]
+"""
+
+import argparse
+import os
+import time
+from uuid import uuid4
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    MetaData,
+    String,
+    Table,
+    and_,
+    bindparam,
+    create_engine,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import UUID, insert
+
+from athlon_flex_notifier.bootstrap import database_url
+
+metadata = MetaData()
+table = Table(
+    "benchmark_upsert",
+    metadata,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("key_hash", String, index=True),
+    Column("attribute_hash_scd1", String),
+    Column("attribute_hash_scd2", String),
+    Column("is_current", Boolean),
+    prefixes=["TEMPORARY"],
+)
+
+
+def run(driver: str, rows: int, repeat: int) -> dict[str, float]:
+    """Run all patterns with a driver, returning the total seconds per pattern."""
+    connect_args = (
+        {"prepare_threshold": int(os.getenv("POSTGRES_PREPARE_THRESHOLD", "5"))}
+        if driver == "psycopg"
+        else {}
+    )
+    engine = create_engine(database_url(driver=driver), connect_args=connect_args)
+    timings = dict.fromkeys(["insert", "scd1", "close", "select"], 0.0)
+    with engine.connect() as connection:
+        metadata.create_all(connection)
+        for iteration in range(repeat):
+            data = [
+                {
+                    "id": uuid4(),
+                    "key_hash": f"{iteration}-{index}",
+                    "attribute_hash_scd1": "a",
+                    "attribute_hash_scd2": "a",
+                    "is_current": True,
+                }
+                for index in range(rows)
+            ]
+            key_hashes = [row["key_hash"] for row in data]
+            start = time.perf_counter()
+            connection.execute(insert(table).values(data))
+            timings["insert"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            connection.execute(
+                update(table)
+                .where(
+                    and_(
+                        table.c.key_hash == bindparam("key_hash_"),
+                        table.c.attribute_hash_scd1 != bindparam("scd1_"),
+                    )
+                )
+                .values(attribute_hash_scd1=bindparam("scd1_")),
+                [{"key_hash_": key_hash, "scd1_": "b"} for key_hash in key_hashes],
+            )
+            timings["scd1"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            connection.execute(
+                update(table)
+                .where(
+                    and_(
+                        table.c.key_hash == bindparam("key_hash_"),
+                        table.c.attribute_hash_scd2 != bindparam("scd2_"),
+                    )
+                )
+                .values(is_current=False),
+                [{"key_hash_": key_hash, "scd2_": "b"} for key_hash in key_hashes],
+            )
+            timings["close"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            connection.execute(
+                select(table.c.key_hash).where(table.c.key_hash.in_(key_hashes))
+            ).all()
+            timings["select"] += time.perf_counter() - start
+        connection.rollback()
+    engine.dispose()
+    return timings
+
+
+def main() -> None:
+    """Run the benchmark for both drivers, and print a comparison."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    results = {
+        driver: run(driver, arguments.rows, arguments.repeat)
+        for driver in ["psycopg2", "psycopg"]
+    }
+    print(f"{arguments.repeat} x {arguments.rows} rows")  # noqa: T201
+    print(f"{'pattern':<10}{'psycopg2 (s)':>15}{'psycopg (s)':>15}{'speedup':>10}")  # noqa: T201
+    for pattern in results["psycopg2"]:
+        old, new = results["psycopg2"][pattern], results["psycopg"][pattern]
+        print(f"{pattern:<10}{old:>15.3f}{new:>15.3f}{old / new:>9.2f}x")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
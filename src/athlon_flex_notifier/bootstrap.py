@@ -4,19 +4,14 @@ import logging
 import os
 import smtplib
 from logging import Logger
+from typing import TYPE_CHECKING
 
-from athlon_flex_client import AthlonFlexClient
 from dotenv import find_dotenv, load_dotenv
 from kink import di
-from prefect.exceptions import MissingContextError
-from prefect.logging import get_logger, get_run_logger
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import with_loader_criteria
-from sqlalchemy.orm.session import ORMExecuteState
-from sqlmodel import Session
 
-from athlon_flex_notifier.models.tables.base_table import BaseTable
-from athlon_flex_notifier.services.filter_service import FilterService
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+    from sqlalchemy.orm.session import ORMExecuteState
 
 
 def load_env() -> None:
@@ -25,41 +20,90 @@ def load_env() -> None:
 
 
 def bootstrap_di() -> None:
-    """Setup all dependencies."""  # noqa: D401
-    di[AthlonFlexClient] = lambda _: AthlonFlexClient(
-        email=os.getenv("ATHLON_USERNAME", None),
-        password=os.getenv("ATHLON_PASSWORD", None),
-        gross_yearly_income=os.getenv("GROSS_YEARLY_INCOME", None),
-        apply_loonheffingskorting=os.getenv("APPLY_LOONHEFFINGSKORTING", "true")
-        == "true",
-    )
-    _setup_database()
-    di[smtplib.SMTP] = lambda _: _smpt_server()
+    """Setup the dependencies shared by all flows.
+
+    Nothing is connected here: the engine and SMTP server are created on first
+    use. Services that import heavy dependencies, like the Athlon client, register
+    their factory in their own module instead, such that importing the package
+    does not import them. So do the Metrics, the profilers and the
+    SnapshotArchive, which are only imported by the flows that use them. See
+    docs/development.md#startup-time.
+    """  # noqa: D401
+    di["database"] = lambda _: _create_engine()
+    # Use factory, since a connection is closed after use
+    di.factories[smtplib.SMTP] = lambda _: _smpt_server()
     # Use factory, to retry getting the prefect logger each time
     di.factories[Logger] = lambda _: _get_logger(__name__)
-    di[FilterService] = lambda _: FilterService()
 
 
-def database_url() -> str:
-    """Get the database URL."""
-    return "postgresql://{username}:{password}@{host}:{port}/{database}".format(
-        username=os.getenv("POSTGRES_USER"),
-        password=os.getenv("POSTGRES_PASSWORD"),
-        host=os.getenv("POSTGRES_HOST"),
-        port=os.getenv("POSTGRES_PORT"),
-        database=os.getenv("POSTGRES_DB"),
+def database_url(driver: str | None = None) -> str:
+    """Get the database URL.
+
+    driver is the DBAPI driver, psycopg2 or psycopg (psycopg 3). Defaults to
+    environment variable POSTGRES_DRIVER, or psycopg2.
+    """
+    return (
+        "postgresql+{driver}://{username}:{password}@{host}:{port}/{database}".format(
+            driver=driver or os.getenv("POSTGRES_DRIVER", "psycopg2"),
+            username=os.getenv("POSTGRES_USER"),
+            password=os.getenv("POSTGRES_PASSWORD"),
+            host=os.getenv("POSTGRES_HOST"),
+            port=os.getenv("POSTGRES_PORT"),
+            database=os.getenv("POSTGRES_DB"),
+        )
+    )
+
+
+def _create_engine() -> "Engine":
+    """Create the database engine.
+
+    The pool is configured through environment variables, see README.md. With
+    driver psycopg, statements executed at least POSTGRES_PREPARE_THRESHOLD times on
+    a connection are prepared server-side, and executemany (used by the Upserter)
+    runs in pipeline mode. The statements are counted by Metrics, and profiled by
+    the SqlProfiler if SQL_PROFILE is true. The _exclude_inactive hook is
+    registered on Session, which is only used with this engine.
+    """
+    from sqlalchemy import create_engine, event
+    from sqlmodel import Session
+
+    from athlon_flex_notifier.metrics import Metrics
+    from athlon_flex_notifier.sql_profiler import SqlProfiler
+
+    connect_args = {}
+    if os.getenv("POSTGRES_DRIVER", "psycopg2") == "psycopg":
+        connect_args["prepare_threshold"] = int(
+            os.getenv("POSTGRES_PREPARE_THRESHOLD", "5")
+        )
+    engine = create_engine(
+        database_url(),
+        pool_size=int(os.getenv("POSTGRES_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("POSTGRES_MAX_OVERFLOW", "10")),
+        pool_pre_ping=os.getenv("POSTGRES_POOL_PRE_PING", "true") == "true",
+        pool_recycle=int(os.getenv("POSTGRES_POOL_RECYCLE", "1800")),
+        connect_args=connect_args,
     )
+    di[Metrics].instrument(engine)
+    if di[SqlProfiler].enabled:
+        di[SqlProfiler].instrument(engine)
+    if not event.contains(Session, "do_orm_execute", _exclude_inactive):
+        event.listen(Session, "do_orm_execute", _exclude_inactive)
+    return engine
 
 
-def _setup_database() -> None:
-    """Setup database connection."""  # noqa: D401
-    di["database"] = create_engine(database_url())
+def _exclude_inactive(execute_state: "ORMExecuteState") -> None:
+    """Exclude inactive rows of all SCD2 tables, if opted in by exclude_inactive.
+
+    Also applies to the tables loaded through relationships. The criteria defeat
+    the statement cache, so the hot paths filter on active_to themselves instead,
+    see base_table.current_rows.
+    """
+    exclude_inactive = execute_state.execution_options.get("exclude_inactive", False)
+    if execute_state.is_select and exclude_inactive:
+        from sqlalchemy.orm import with_loader_criteria
 
+        from athlon_flex_notifier.models.tables.base_table import BaseTable
 
-@event.listens_for(Session, "do_orm_execute")
-def _exclude_inactive(execute_state: ORMExecuteState) -> None:
-    include_inactive = execute_state.execution_options.get("include_inactive", False)
-    if execute_state.is_select and not include_inactive:
         execute_state.statement = execute_state.statement.options(
             with_loader_criteria(
                 BaseTable,
@@ -75,6 +119,9 @@ def _get_logger(name: str) -> logging.Logger:
     If we can get the prefect logger (we are running in a prefect flow), use it
     If not, create a new logger.
     """
+    from prefect.exceptions import MissingContextError
+    from prefect.logging import get_logger, get_run_logger
+
     logging.basicConfig(level=logging.DEBUG)
     try:
         logger = get_run_logger()
@@ -87,8 +134,15 @@ def _get_logger(name: str) -> logging.Logger:
 
 
 def _smpt_server() -> smtplib.SMTP:
-    """Configure SMTP server."""
-    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+    """Configure SMTP server.
+
+    Each socket operation times out after SMTP_TIMEOUT seconds (default 30), such
+    that a hanging server does not keep the transaction of the DigestScheduler, and
+    the locks it holds, open.
+    """
+    server = smtplib.SMTP_SSL(
+        "smtp.gmail.com", 465, timeout=float(os.getenv("SMTP_TIMEOUT", "30"))
+    )
     server.ehlo()
     server.login(os.environ["EMAIL_FROM"], os.environ["GOOGLE_APP_PASSWORD"])
     return server
@@ -0,0 +1,83 @@
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from athlon_flex_notifier.services.fake_athlon_api import Catalog, FakeAthlonApi
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+from athlon_flex_notifier.services.snapshot_archive import SnapshotArchive
+
+parser = argparse.ArgumentParser(
+    description="Serve a fake Athlon Flex API, for load testing the refresh."
+)
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8080)
+parser.add_argument(
+    "--latency", type=float, default=0.05, help="Delay of each request, in seconds."
+)
+parser.add_argument(
+    "--jitter",
+    type=float,
+    default=0.05,
+    help="Maximum random delay added to the latency, in seconds.",
+)
+parser.add_argument(
+    "--error-rate",
+    type=float,
+    default=0.0,
+    help="Fraction of requests that fail with 503.",
+)
+parser.add_argument(
+    "--padding",
+    type=int,
+    default=0,
+    help="Bytes added to each vehicle response, to simulate larger payloads.",
+)
+parser.add_argument(
+    "--archive",
+    type=Path,
+    help="Serve the last complete snapshot of this SnapshotArchive directory, "
+    "instead of a generated fleet.",
+)
+parser.add_argument(
+    "--until",
+    type=datetime.fromisoformat,
+    help="With --archive, serve the last snapshot taken at or before this ISO "
+    "timestamp, with timezone.",
+)
+parser.add_argument("--clusters", type=int, default=50)
+parser.add_argument("--vehicles", type=int, default=20)
+parser.add_argument("--options", type=int, default=5)
+parser.add_argument("--churn", type=float, default=0.05)
+parser.add_argument(
+    "--advance-every",
+    type=float,
+    help="Change the generated fleet every this number of seconds.",
+)
+parser.add_argument("--seed", type=int, default=0)
+arguments = parser.parse_args()
+simulator = None
+if arguments.archive:
+    catalog = Catalog.from_archive(
+        SnapshotArchive(directory=arguments.archive),
+        until=arguments.until,
+        padding=arguments.padding,
+    )
+else:
+    simulator = FleetSimulator(
+        clusters=arguments.clusters,
+        vehicles_per_cluster=arguments.vehicles,
+        options_per_vehicle=arguments.options,
+        churn=arguments.churn,
+        seed=arguments.seed,
+    )
+    catalog = Catalog.from_simulator(simulator, padding=arguments.padding)
+FakeAthlonApi(
+    catalog=catalog,
+    latency=arguments.latency,
+    jitter=arguments.jitter,
+    error_rate=arguments.error_rate,
+    simulator=simulator,
+    advance_every=arguments.advance_every,
+    padding=arguments.padding,
+    seed=arguments.seed,
+).run(host=arguments.host, port=arguments.port)
@@ -0,0 +1,240 @@
+"""Profile the CPU and memory usage of a flow run."""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from types import CodeType, FrameType
+
+from kink import di
+
+_PACKAGE_ROOT = Path(__file__).parent.parent
+
+
+@dataclass
+class MemoryMark:
+    """Memory usage at a stage boundary, see FlowProfiler.mark."""
+
+    label: str
+    current_mib: float
+    peak_mib: float
+    top_growth: list[str]
+
+
+@dataclass
+class Profile:
+    """Result of FlowProfiler.profile."""
+
+    name: str
+    samples: int
+    folded: str
+    allocations: str
+
+    def hottest(self, top: int = 20) -> str:
+        """Get the top stacks of folded, with the most samples."""
+        stacks = sorted(
+            self.folded.splitlines(),
+            key=lambda line: int(line.rsplit(" ", 1)[1]),
+            reverse=True,
+        )
+        return "\n".join(stacks[:top])
+
+
+class FlowProfiler:
+    """Sample the stacks of all threads, and trace the memory allocations.
+
+    A background thread samples the stacks of all other threads every interval
+    seconds. This measures wall-clock time: a thread waiting, for example for a
+    response of the API or a queue of the Pipeline, is sampled as well. The samples
+    are aggregated as folded stacks (one line per stack: frames separated by ;
+    followed by the number of samples), the input of flamegraph.pl, speedscope and
+    most other flame graph tools. The root frame of each stack is the thread.
+
+    Memory is traced with tracemalloc. mark takes a snapshot, which utils.time_it
+    does at the start and end of each stage. The growth since the previous snapshot
+    is recorded per mark.
+    """
+
+    enabled: bool
+    interval: float
+    top: int
+    directory: Path | None
+    running: bool
+    samples: Counter[str]
+    marks: list[MemoryMark]
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        interval: float = 0.01,
+        top: int = 10,
+        directory: Path | None = None,
+    ) -> None:
+        self.enabled = enabled
+        self.interval = interval
+        self.top = top
+        self.directory = directory
+        self.running = False
+        self.samples = Counter()
+        self.marks = []
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, name: str) -> Generator[list[Profile]]:
+        """Profile the block. The yielded list contains the Profile afterwards.
+
+        If directory is set, the profile is stored there as <name>.folded and
+        <name>-allocations.md.
+        """
+        result: list[Profile] = []
+        self.samples = Counter()
+        self.marks = []
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        self._snapshot = _take_snapshot()
+        self.running = True
+        sampler = threading.Thread(
+            target=self._sample, name="flow-profiler", daemon=True
+        )
+        sampler.start()
+        try:
+            yield result
+        finally:
+            self.running = False
+            sampler.join()
+            self.mark("end")
+            allocations = self._allocations(name, _take_snapshot())
+            if not tracing:
+                tracemalloc.stop()
+            self._snapshot = None
+            profile = Profile(
+                name=name,
+                samples=self.samples.total(),
+                folded="\n".join(
+                    f"{stack} {count}" for stack, count in self.samples.most_common()
+                ),
+                allocations=allocations,
+            )
+            if self.directory is not None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                (self.directory / f"{name}.folded").write_text(profile.folded)
+                (self.directory / f"{name}-allocations.md").write_text(allocations)
+            result.append(profile)
+
+    def mark(self, label: str) -> None:
+        """Record the memory usage, and its growth since the previous mark.
+
+        Does nothing if not profiling.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                return
+            snapshot = _take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            growth = [
+                str(statistic)
+                for statistic in snapshot.compare_to(self._snapshot, "lineno")[
+                    : self.top
+                ]
+                if statistic.size_diff > 0
+            ]
+            self._snapshot = snapshot
+            self.marks.append(
+                MemoryMark(
+                    label=label,
+                    current_mib=current / 2**20,
+                    peak_mib=peak / 2**20,
+                    top_growth=growth,
+                )
+            )
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while self.running:
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # noqa: SLF001
+                if ident != own:
+                    stack = _folded(frame)
+                    self.samples[f"{names.get(ident, ident)};{stack}"] += 1
+            time.sleep(self.interval)
+
+    def _allocations(self, name: str, snapshot: tracemalloc.Snapshot) -> str:
+        lines = [
+            f"# Memory of {name}",
+            "",
+            "| Mark | Current (MiB) | Peak (MiB) |",
+            "| --- | ---: | ---: |",
+            *(
+                f"| {mark.label} | {mark.current_mib:.1f} | {mark.peak_mib:.1f} |"
+                for mark in self.marks
+            ),
+            "",
+            f"## Top {self.top} allocations at the end",
+            "",
+            *(
+                f"- {statistic}"
+                for statistic in snapshot.statistics("lineno")[: self.top]
+            ),
+            "",
+            "## Growth per mark",
+        ]
+        for mark in self.marks:
+            lines.extend(["", f"### {mark.label}", ""])
+            lines.extend(f"- {growth}" for growth in mark.top_growth)
+        return "\n".join(lines)
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    """Take a snapshot, without the allocations of the profiler itself."""
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(inclusive=False, filename_pattern=__file__),
+            tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__),
+        ]
+    )
+
+
+def _folded(frame: FrameType | None) -> str:
+    """Render the stack of frame from root to leaf.
+
+    Each frame is rendered as function (file:line of its definition), such that all
+    samples of a function are aggregated.
+    """
+    frames = []
+    while frame is not None:
+        frames.append(_function(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+@cache
+def _function(code: CodeType) -> str:
+    path = Path(code.co_filename)
+    filename = (
+        path.relative_to(_PACKAGE_ROOT)
+        if path.is_relative_to(_PACKAGE_ROOT)
+        else path.name
+    )
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di[FlowProfiler] = lambda _: FlowProfiler(
+    enabled=os.getenv("FLOW_PROFILE", "false") == "true",
+    interval=float(os.getenv("FLOW_PROFILE_INTERVAL", "0.01")),
+    directory=(
+        Path(os.environ["FLOW_PROFILE_DIR"]) if os.getenv("FLOW_PROFILE_DIR") else None
+    ),
+)
@@ -1,22 +1,154 @@
+import os
+from collections.abc import Generator
+from contextlib import contextmanager, nullcontext
+from logging import Logger
+from typing import TYPE_CHECKING
+
 from kink import di
-from prefect import flow, serve
-from prefect.client.schemas.schedules import CronSchedule
-from prefect.events import DeploymentEventTrigger
+from prefect.flows import flow
+
+if TYPE_CHECKING:
+    from prefect.client.schemas.schedules import CronSchedule
+
+    from athlon_flex_notifier.flow_profiler import Profile
+    from athlon_flex_notifier.sql_profiler import SqlProfiler
+
+# Services are imported by the flows that use them, such that starting the worker and
+# each flow run only import what they need. This includes the profilers, and the
+# parts of Prefect that are not needed to define a flow (artifacts import fastapi,
+# serve imports the runner). See docs/development.md#startup-time.
+
+
+@contextmanager
+def traced(name: str, *, profile: bool = False) -> Generator:
+    """Record a flow run as root span, and publish its metrics.
+
+    The trace of the run is attached to the flow run as markdown artifact. The
+    metrics are exported to METRICS_DIR, if set, see Metrics.export. If the
+    SqlProfiler is enabled, its report of the run is attached as well. If profile,
+    or if the FlowProfiler is enabled, the run is profiled by the FlowProfiler.
+    """
+    from prefect.artifacts import create_markdown_artifact
+
+    from athlon_flex_notifier.flow_profiler import FlowProfiler
+    from athlon_flex_notifier.metrics import Metrics
+    from athlon_flex_notifier.sql_profiler import SqlProfiler
+
+    metrics = di[Metrics]
+    sql_profiler = di[SqlProfiler]
+    sql_profiler.reset()
+    flow_profiler = di[FlowProfiler]
+    trace_id = None
+    profiles: list[Profile] = []
+    try:
+        with (
+            metrics.span(f"flow.{name}") as span,
+            flow_profiler.profile(name)
+            if profile or flow_profiler.enabled
+            else nullcontext(profiles) as profiles,
+        ):
+            trace_id = span.trace_id
+            yield
+    finally:
+        create_markdown_artifact(
+            key=f"{name.replace('_', '-')}-trace",
+            markdown=f"# Trace of {name}\n\n{metrics.trace_markdown(trace_id)}",
+            description=f"Spans of {name}, with durations and statement counts",
+        )
+        metrics.export(name)
+        if sql_profiler.enabled:
+            _publish_sql_profile(name, sql_profiler)
+        for result in profiles:
+            _publish_flow_profile(result)
+
+
+def _publish_sql_profile(name: str, profiler: "SqlProfiler") -> None:
+    """Log a summary of the SQL profile, and attach the report as artifact."""
+    from prefect.artifacts import create_markdown_artifact
+
+    logger = di[Logger]
+    n_plus_one = profiler.probable_n_plus_one()
+    logger.info(
+        "%s statements in %.3f seconds, %s probable N+1 queries",
+        profiler.total_count,
+        profiler.total_seconds,
+        len(n_plus_one),
+    )
+    for stats in n_plus_one:
+        logger.warning(
+            "Probable N+1: %s executions from %s of %s",
+            stats.count,
+            stats.callers.most_common(1)[0][0],
+            stats.shape,
+        )
+    create_markdown_artifact(
+        key=f"{name.replace('_', '-')}-sql-profile",
+        markdown=profiler.report(name),
+        description=f"Statements of {name}, grouped by shape",
+    )
+
+
+def _publish_flow_profile(profile: "Profile", max_stacks: int = 500) -> None:
+    """Attach the profile of the FlowProfiler as artifacts.
+
+    The CPU artifact contains the hottest stacks in the folded format. All stacks
+    are stored in FLOW_PROFILE_DIR, if set.
+    """
+    from prefect.artifacts import create_markdown_artifact
+
+    key = profile.name.replace("_", "-")
+    stacks = profile.folded.count("\n") + 1 if profile.folded else 0
+    create_markdown_artifact(
+        key=f"{key}-cpu-profile",
+        markdown=(
+            f"# CPU profile of {profile.name}\n\n"
+            f"{profile.samples} samples, {stacks} stacks, of which the "
+            f"{min(stacks, max_stacks)} hottest are listed. Save as .folded, and "
+            "render with flamegraph.pl or speedscope.\n\n"
+            f"```\n{profile.hottest(max_stacks)}\n```"
+        ),
+        description=f"Sampled stacks of {profile.name}, as folded stacks",
+    )
+    create_markdown_artifact(
+        key=f"{key}-memory-profile",
+        markdown=profile.allocations,
+        description=f"Memory of {profile.name} per stage, and top allocations",
+    )
 
-from athlon_flex_notifier.notifications.notifiers import Notifiers
-from athlon_flex_notifier.refresher import (
-    Refresher,
+
+@flow(
+    retries=int(os.getenv("REFRESH_FLOW_RETRIES", "1")),
+    retry_delay_seconds=int(os.getenv("REFRESH_FLOW_RETRY_DELAY", "60")),
 )
+def refresh(incremental: bool = False, profile: bool = False) -> None:  # noqa: FBT001, FBT002
+    """Update the database with the current vehicles.
 
+    Parameters
+    ----------
+    incremental : bool
+        If true, only load details of clusters of which the summary changed. See
+        Refresher.refresh.
+    profile : bool
+        If true, profile CPU and memory usage of the run. See FlowProfiler.
 
-@flow
-def refresh() -> None:
-    """Update the database with the current vehicles."""
-    di[Refresher].refresh()
+    A retry of the flow run resumes at the first stage that did not complete, see
+    stages.run_stage. The persisted results of the stages are deleted after a
+    successful run.
+
+    """
+    from prefect.context import FlowRunContext
+
+    from athlon_flex_notifier.refresher import Refresher
+    from athlon_flex_notifier.stages import clear_stages
+
+    with traced("refresh", profile=profile):
+        di[Refresher].refresh(incremental=incremental)
+    deleted = clear_stages(FlowRunContext.get().flow_run.id)
+    di[Logger].debug("Deleted %s persisted stage results", deleted)
 
 
 @flow
-def notify(filters: dict | None = None) -> None:
+def notify(filters: dict | None = None, profile: bool = False) -> None:  # noqa: FBT001, FBT002
     """Notify the user about new vehicles.
 
     Parameters
@@ -24,22 +156,105 @@ def notify(filters: dict | None = None) -> None:
     filters : dict, optional
         Optional filters to apply to the vehicles. Keys must be present in the Vehicle.
         Values will be filtered using regex.
+    profile : bool
+        If true, profile CPU and memory usage of the run. See FlowProfiler.
+
+    """
+    from athlon_flex_notifier.notifications.notifiers import Notifiers
+
+    with traced("notify", profile=profile):
+        Notifiers(filters=filters).notify()
+
+
+@flow
+def drain_outbox(batch_size: int = 50, filters: dict | None = None) -> None:
+    """Send the notifications enqueued in the outbox by refresh.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of outbox rows to claim and deliver at once.
+    filters : dict, optional
+        Optional filters to apply to the vehicles. See notify.
+
+    """
+    from athlon_flex_notifier.notifications.outbox_drainer import OutboxDrainer
+
+    with traced("drain_outbox"):
+        di[OutboxDrainer].drain(batch_size=batch_size, filters=filters)
+
+
+@flow
+def send_digests() -> None:
+    """Send the digests of new vehicles that are due, see DigestScheduler."""
+    from athlon_flex_notifier.notifications.digest_scheduler import DigestScheduler
+
+    with traced("send_digests"):
+        di[DigestScheduler].send()
+
+
+@flow
+def maintain_history() -> None:
+    """Create upcoming history partitions, and archive those beyond retention."""
+    from athlon_flex_notifier.services.history_partitioner import HistoryPartitioner
+
+    with traced("maintain_history"):
+        di[HistoryPartitioner].maintain()
+
+
+@flow
+def compact_history() -> None:
+    """Merge contiguous versions that only differ in volatile attributes.
 
+    See HistoryCompactor, which compacts vehicles and their pricing.
     """
-    Notifiers(filters=filters).notify()
+    from athlon_flex_notifier.services.history_compactor import HistoryCompactor
+
+    with traced("compact_history"):
+        di[HistoryCompactor].compact()
+
+
+@flow
+def adapt_refresh_schedule() -> None:
+    """Adapt the schedule of refresh to the rate of changes per hour of the day.
+
+    See RefreshScheduler. The learned rates and intervals are attached as artifact.
+    """
+    from prefect.artifacts import create_markdown_artifact
+
+    from athlon_flex_notifier.services.refresh_scheduler import RefreshScheduler
+
+    scheduler = di[RefreshScheduler]
+    with traced("adapt_refresh_schedule"):
+        rates, intervals = scheduler.plan()
+        scheduler.apply(scheduler.schedules(intervals))
+        create_markdown_artifact(
+            key="refresh-schedule",
+            markdown=scheduler.report(rates, intervals),
+            description="Changes and refresh interval per hour of the day",
+        )
 
 
 def work() -> None:
-    """Create the deployments."""
+    """Create the deployments.
+
+    The schedule of refresh is learned by the RefreshScheduler, and adapted daily by
+    adapt_refresh_schedule. If METRICS_PORT is set, the metrics are served to
+    Prometheus on that port.
+    """
+    from prefect import serve
+    from prefect.client.schemas.schedules import CronSchedule
+    from prefect.events import DeploymentEventTrigger
+
+    from athlon_flex_notifier.metrics import Metrics
+
+    if os.getenv("METRICS_PORT"):
+        di[Metrics].serve(int(os.environ["METRICS_PORT"]))
     serve(
         refresh.to_deployment(
             name="refresh",
-            version="2024.11.11",
-            schedules=[
-                CronSchedule(
-                    cron="*/10 * * * *",
-                )
-            ],
+            version="2026.10.19",
+            schedules=_refresh_schedules(),
         ),
         notify.to_deployment(
             name="notify",
@@ -59,4 +274,74 @@ def work() -> None:
                 )
             ],
         ),
+        drain_outbox.to_deployment(
+            name="drain_outbox",
+            version="2026.10.19",
+            triggers=[
+                DeploymentEventTrigger(
+                    name="drain_outbox_on_refresh",
+                    match_related={"prefect.resource.name": "refresh"},
+                    expect=["prefect.flow-run.Completed"],
+                )
+            ],
+        ),
+        send_digests.to_deployment(
+            name="send_digests",
+            version="2026.10.19",
+            schedules=[
+                CronSchedule(
+                    cron="*/5 * * * *",
+                    timezone="Europe/Amsterdam",
+                )
+            ],
+        ),
+        maintain_history.to_deployment(
+            name="maintain_history",
+            version="2026.10.19",
+            schedules=[
+                CronSchedule(
+                    cron="0 3 * * *",
+                    timezone="Europe/Amsterdam",
+                )
+            ],
+        ),
+        compact_history.to_deployment(
+            name="compact_history",
+            version="2026.10.19",
+            schedules=[
+                CronSchedule(
+                    cron="0 4 * * 0",
+                    timezone="Europe/Amsterdam",
+                )
+            ],
+        ),
+        adapt_refresh_schedule.to_deployment(
+            name="adapt_refresh_schedule",
+            version="2026.10.19",
+            schedules=[
+                CronSchedule(
+                    cron="30 2 * * *",
+                    timezone="Europe/Amsterdam",
+                )
+            ],
+        ),
     )
+
+
+def _refresh_schedules() -> list["CronSchedule"]:
+    """Get the schedules of refresh learned by the RefreshScheduler.
+
+    Falls back to the default interval if the database cannot be reached, such
+    that the worker starts regardless.
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from athlon_flex_notifier.services.refresh_scheduler import RefreshScheduler
+
+    scheduler = di[RefreshScheduler]
+    try:
+        _, intervals = scheduler.plan()
+    except SQLAlchemyError:
+        di[Logger].exception("Could not learn the refresh intervals, using default")
+        intervals = scheduler.intervals(None)
+    return scheduler.schedules(intervals)
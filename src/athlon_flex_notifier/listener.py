@@ -0,0 +1,16 @@
+import os
+
+from sqlalchemy import NullPool, create_engine
+
+from athlon_flex_notifier.bootstrap import database_url
+from athlon_flex_notifier.notifications.notification_listener import (
+    NotificationListener,
+)
+
+# The listener holds a single connection, and requires psycopg2 regardless of
+# POSTGRES_DRIVER.
+NotificationListener(
+    database=create_engine(database_url(driver="psycopg2"), poolclass=NullPool),
+).listen(
+    coalesce_seconds=float(os.getenv("NOTIFY_COALESCE_SECONDS", "2")),
+)
@@ -0,0 +1,429 @@
+"""Metrics and tracing of the application, in memory.
+
+Counters and histograms are aggregated per name and labels, and exported in the
+Prometheus text format. Spans time a block of code, and form a trace: a span
+started within another span is its child, also across the threads of a Pipeline,
+since they copy the context.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+from uuid import uuid4
+
+from kink import di
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = tuple[tuple[str, str], ...]
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+@dataclass
+class Span:
+    """A timed block of code, as part of a trace.
+
+    Attributes:
+        name: str
+            Name of the block, for example the stage of the refresh.
+        trace_id: str
+            Shared by all spans of the same root span.
+        span_id: str
+        parent_id: str | None
+            span_id of the span this span was started in, None for a root span.
+        started_at: datetime
+        duration: float | None
+            Seconds, measured with perf_counter. None while running.
+        status: str
+            ok, or error if the block raised.
+        attributes: dict[str, Any]
+            For example the entity of an upsert, or the number of rows.
+            db.statements is the number of statements executed in the span,
+            including its children.
+
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    started_at: datetime
+    duration: float | None = None
+    status: str = "ok"
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes: Any) -> None:  # noqa: ANN401
+        """Set attributes of the span."""
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float = 1) -> None:
+        """Add value to a numeric attribute of the span."""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+
+@dataclass
+class Histogram:
+    """Observations in cumulative buckets, like a Prometheus histogram."""
+
+    buckets: tuple[float, ...]
+    counts: list[int]
+    sum: float = 0.0
+    count: int = 0
+
+    @classmethod
+    def empty(cls, buckets: Iterable[float]) -> "Histogram":
+        buckets = tuple(buckets)
+        return cls(buckets=buckets, counts=[0] * len(buckets))
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        if other.buckets != self.buckets:
+            msg = "Cannot merge histograms with different buckets"
+            raise ValueError(msg)
+        self.counts = [a + b for a, b in zip(self.counts, other.counts, strict=True)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class Metrics:
+    """Counters, histograms and spans of the application.
+
+    Thread safe. The finished spans are kept, up to max_spans, to report a trace
+    after a run (see trace_markdown). Spans also record their duration in the
+    histogram duration_seconds, and their statements in span_db_statements.
+
+    Prefect runs each flow in its own process. To aggregate across runs, a flow
+    exports its metrics to directory (see export), in which the metrics are
+    accumulated per flow. serve exposes all flows in directory to Prometheus.
+    """
+
+    namespace: str
+    directory: Path | None
+    counters: dict[tuple[str, Labels], float]
+    histograms: dict[tuple[str, Labels], Histogram]
+    spans: deque[Span]
+
+    def __init__(
+        self,
+        namespace: str = "athlon_flex_notifier",
+        directory: Path | None = None,
+        max_spans: int = 10000,
+    ) -> None:
+        self.namespace = namespace
+        self.directory = directory
+        self.counters = {}
+        self.histograms = {}
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increment a counter."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Iterable[float] = DURATION_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """Add an observation to a histogram, created with buckets on first use."""
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram.empty(buckets)
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Generator[Span]:  # noqa: ANN401
+        """Time a block of code as a span, child of the current span."""
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid4().hex,
+            span_id=uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            started_at=datetime.now(timezone.utc),
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            statements = span.attributes.get("db.statements", 0)
+            if parent is not None:
+                parent.add("db.statements", statements)
+            self.observe("duration_seconds", span.duration, span=name)
+            self.observe(
+                "span_db_statements", statements, buckets=COUNT_BUCKETS, span=name
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    @staticmethod
+    def current_span() -> Span | None:
+        return _current_span.get()
+
+    def instrument(self, engine: "Engine") -> None:
+        """Count the statements executed by engine, in total and per span."""
+        # Imported here, such that importing Metrics does not import SQLAlchemy
+        from sqlalchemy import event
+
+        def count(*_: Any) -> None:  # noqa: ANN401
+            self.increment("db_statements_total")
+            if (span := _current_span.get()) is not None:
+                span.add("db.statements")
+
+        event.listen(engine, "before_cursor_execute", count)
+
+    def trace(self, trace_id: str) -> list[Span]:
+        """Get the finished spans of a trace, in the order they started."""
+        with self._lock:
+            spans = [span for span in self.spans if span.trace_id == trace_id]
+        return sorted(spans, key=lambda span: span.started_at)
+
+    def trace_markdown(self, trace_id: str) -> str:
+        """Render a trace as a markdown table, children indented below parents."""
+        spans = self.trace(trace_id)
+        children: dict[str | None, list[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        known = {span.span_id for span in spans}
+        rows = [
+            "| Span | Duration (s) | Statements | Status | Attributes |",
+            "| --- | ---: | ---: | --- | --- |",
+        ]
+
+        def render(span: Span, depth: int) -> None:
+            attributes = ", ".join(
+                f"{key}={value}"
+                for key, value in span.attributes.items()
+                if key != "db.statements"
+            )
+            rows.append(
+                f"| {'&nbsp;' * 4 * depth}{span.name} | {span.duration:.3f} | "
+                f"{span.attributes.get('db.statements', 0)} | {span.status} | "
+                f"{attributes} |"
+            )
+            for child in children.get(span.span_id, []):
+                render(child, depth + 1)
+
+        for span in spans:
+            if span.parent_id is None or span.parent_id not in known:
+                render(span, 0)
+        return "\n".join(rows)
+
+    def state(self) -> dict[str, list[dict[str, Any]]]:
+        """Get the counters and histograms, serializable as JSON."""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "buckets": list(histogram.buckets),
+                        "counts": histogram.counts,
+                        "sum": histogram.sum,
+                        "count": histogram.count,
+                    }
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def merge(self, state: dict[str, list[dict[str, Any]]], **labels: str) -> None:
+        """Add the counters and histograms of state, with additional labels."""
+        for counter in state["counters"]:
+            self.increment(
+                counter["name"], counter["value"], **counter["labels"], **labels
+            )
+        with self._lock:
+            for item in state["histograms"]:
+                key = (item["name"], _labels(item["labels"] | labels))
+                histogram = Histogram(
+                    buckets=tuple(item["buckets"]),
+                    counts=list(item["counts"]),
+                    sum=item["sum"],
+                    count=item["count"],
+                )
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+
+    def prometheus_text(self) -> str:
+        """Render the counters and histograms in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.namespace}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_render_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            metric = f"{self.namespace}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts, strict=True):
+                cumulative += count
+                bucket_labels = (*labels, ("le", f"{bound}"))
+                lines.append(
+                    f"{metric}_bucket{_render_labels(bucket_labels)} {cumulative}"
+                )
+            inf_labels = (*labels, ("le", "+Inf"))
+            lines.append(
+                f"{metric}_bucket{_render_labels(inf_labels)} {histogram.count}"
+            )
+            lines.append(f"{metric}_sum{_render_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{_render_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Clear the counters and histograms. Finished spans are kept."""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def export(self, name: str) -> None:
+        """Move the metrics into the accumulated metrics of name in directory.
+
+        Stores <name>.json, the accumulated state, and <name>.prom, the accumulated
+        metrics in the Prometheus text format (for the textfile collector of the
+        node exporter). Files are replaced atomically. The counters and histograms
+        are reset, such that a next export does not add them twice. Does nothing if
+        directory is not set.
+        """
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{name}.json"
+        accumulated = Metrics(namespace=self.namespace)
+        if path.exists():
+            accumulated.merge(json.loads(path.read_text()))
+        accumulated.merge(self.state())
+        _write_atomic(path, json.dumps(accumulated.state()))
+        _write_atomic(self.directory / f"{name}.prom", accumulated.prometheus_text())
+        self.reset()
+
+    @classmethod
+    def load_directory(cls, directory: Path) -> "Metrics":
+        """Load the exported metrics of all flows in directory, labeled by flow."""
+        metrics = cls()
+        for path in sorted(directory.glob("*.json")):
+            metrics.merge(json.loads(path.read_text()), flow=path.stem)
+        return metrics
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """Serve the metrics to Prometheus on /metrics, in a daemon thread.
+
+        If directory is set, the metrics exported to it are served as well.
+        """
+        metrics = self
+        directory = self.directory
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                served = Metrics(namespace=metrics.namespace)
+                served.merge(metrics.state())
+                if directory is not None and directory.exists():
+                    served.merge(Metrics.load_directory(directory).state())
+                body = served.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_: Any) -> None:  # noqa: ANN401
+                """Do not log each scrape."""
+
+        server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _render_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    temporary = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+    temporary.write_text(content)
+    temporary.replace(path)
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di[Metrics] = lambda _: Metrics(
+    directory=Path(os.environ["METRICS_DIR"]) if os.getenv("METRICS_DIR") else None,
+)
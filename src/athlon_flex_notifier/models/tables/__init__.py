@@ -1,6 +1,21 @@
+from athlon_flex_notifier.models.tables.digest_item import DigestItem
 from athlon_flex_notifier.models.tables.notification import Notification
-from athlon_flex_notifier.models.tables.option import Option
+from athlon_flex_notifier.models.tables.notification_outbox import NotificationOutbox
+from athlon_flex_notifier.models.tables.option_catalog import OptionCatalog
+from athlon_flex_notifier.models.tables.refresh_fingerprint import RefreshFingerprint
 from athlon_flex_notifier.models.tables.vehicle import Vehicle
 from athlon_flex_notifier.models.tables.vehicle_cluster import VehicleCluster
+from athlon_flex_notifier.models.tables.vehicle_option_set import VehicleOptionSet
+from athlon_flex_notifier.models.tables.vehicle_pricing import VehiclePricing
 
-__all__ = ["VehicleCluster", "Vehicle", "Option", "Notification"]
+__all__ = [
+    "VehicleCluster",
+    "Vehicle",
+    "VehiclePricing",
+    "OptionCatalog",
+    "VehicleOptionSet",
+    "Notification",
+    "NotificationOutbox",
+    "DigestItem",
+    "RefreshFingerprint",
+]
@@ -1,14 +1,27 @@
 from collections.abc import Iterable
 from datetime import datetime
 from enum import Enum
+from functools import cache
 from hashlib import sha256
-from typing import ClassVar, TypeVar
+from typing import Any, ClassVar, TypeVar
 from uuid import UUID, uuid4
 
 from kink import inject
 from pydantic import field_serializer
 from sqlalchemy import UUID as SQLAlchemyUUID  # noqa: N811
-from sqlalchemy import DateTime, Engine, select
+from sqlalchemy import (
+    ColumnElement,
+    Computed,
+    DateTime,
+    Engine,
+    Index,
+    Select,
+    bindparam,
+    literal,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import TSTZRANGE
 from sqlmodel import Field, Session, SQLModel, func
 
 T = TypeVar("T", bound="BaseTable")
@@ -23,6 +36,59 @@ class LoadType(Enum):
     DELTA_WITH_DELETE = 3
 
 
+def active_row_indexes(table_name: str) -> tuple[Index, ...]:
+    """Get the indexes on the access paths of the Upserter, for a table.
+
+    - Active rows by key_hash. Partial, such that history is not indexed. Includes
+        the attribute hashes, such that they can be compared without reading rows.
+    - Rows by active_to, to find the rows closed by an upsert.
+    - Rows by active_period (GiST), for the point-in-time queries of BaseTable.as_of
+        and BaseTable.between.
+
+    Use in __table_args__ of each table that extends BaseTable.
+    """
+    return (
+        Index(
+            f"ix_{table_name}_active_key_hash",
+            "key_hash",
+            postgresql_where=text("active_to IS NULL"),
+            postgresql_include=["attribute_hash_scd1", "attribute_hash_scd2"],
+        ),
+        Index(f"ix_{table_name}_active_to", "active_to"),
+        Index(
+            f"ix_{table_name}_active_period",
+            "active_period",
+            postgresql_using="gist",
+        ),
+    )
+
+
+# Table kwargs of the SCD2 tables partitioned by active_to, see HistoryPartitioner
+HISTORY_PARTITIONING = {"postgresql_partition_by": "RANGE (active_to)"}
+
+
+@cache
+def current_rows(table: type["BaseTable"]) -> Select:
+    """Get the statement that selects the current rows of a table.
+
+    Built once per table. Executing the same statement object lets SQLAlchemy reuse
+    its cache key and compiled form, unlike the criteria added by the opt-in
+    exclude_inactive hook (see bootstrap), which is analyzed on each execution.
+    """
+    return select(table).where(table.active_to.is_(None))
+
+
+@cache
+def current_rows_by_key_hashes(table: type["BaseTable"]) -> Select:
+    """Get the statement that selects current rows by key hash, see current_rows.
+
+    Execute with parameter key_hashes.
+    """
+    return current_rows(table).where(
+        table.key_hash.in_(bindparam("key_hashes", expanding=True))
+    )
+
+
 class BaseTable(SQLModel):
     """A Base class for SQLModel.
 
@@ -40,7 +106,8 @@ class BaseTable(SQLModel):
             Separates values when computing hashes
 
         id: UUID
-            Primary key. Generated when instantated.
+            Primary key. Generated when instantated. Not enforced unique for a
+            PartitionedTable.
         key_hash: str
             Hash of the business keys. Computed when upserted. Before store in DB,
             this property is None.
@@ -58,6 +125,9 @@ class BaseTable(SQLModel):
             End date for scd2. None upon creation. Set when updated or deleted.
         is_current: bool
             True if this record is the current record of this entity.
+        active_period: Range
+            The period [active_from, active_to) in which the record was active. An
+            open range for current records. Generated by the server.
 
         created_at: datetime
             Creation date of the record. Set by the server.
@@ -113,13 +183,22 @@ class BaseTable(SQLModel):
         default=True,
         sa_column_kwargs={"sort_order": 95},
     )
+    active_period: Any = Field(
+        exclude=True,
+        default=None,
+        sa_type=TSTZRANGE,
+        sa_column_args=[
+            Computed("tstzrange(active_from, active_to, '[)')", persisted=True)
+        ],
+        sa_column_kwargs={"sort_order": 96},
+    )
     created_at: datetime | None = Field(
         exclude=True,
         default=None,
         sa_type=DateTime(timezone=True),
         sa_column_kwargs={
             "server_default": func.now(),
-            "sort_order": 96,
+            "sort_order": 97,
         },
     )
     updated_at: datetime | None = Field(
@@ -130,7 +209,7 @@ class BaseTable(SQLModel):
             "onupdate": func.now(),
             "server_default": func.now(),
             "server_onupdate": func.now(),
-            "sort_order": 97,
+            "sort_order": 98,
         },
     )
 
@@ -162,24 +241,95 @@ class BaseTable(SQLModel):
         """  # noqa: D401
         return []
 
+    @classmethod
+    def volatile_attribute_keys(cls) -> list[str]:
+        """A model can define scd2 attributes that change without meaning.
+
+        Changes of these attributes still create a new SCD2 version. The
+        HistoryCompactor merges contiguous versions that only differ in these
+        attributes.
+
+        Example: a price that flaps in the API.
+        """  # noqa: D401
+        return []
+
+    @classmethod
+    def on_upsert(cls, session: Session, created_rows: list[dict[str, Any]]) -> None:
+        """A model can react to an upsert of a batch using this hook.
+
+        Called by the Upserter, after the SCD logic is applied but before it is
+        committed. Any statement executed on the session is therefor part of the same
+        transaction as the upsert.
+
+        created_rows contains the rows of entities that are new, or that re-appeared
+        after being deleted. Entities that only received a new SCD2 version are not
+        included.
+        """  # noqa: D401
+
     @classmethod
     @inject
     def get(cls: T, database: Engine, *, key_hashes: Iterable[str]) -> list[T]:
-        """Load entity by list of ids."""
+        """Load the current rows of entities by their key hashes."""
         with Session(database) as session:
             return [
                 item[0]
                 for item in session.exec(
-                    select(cls).where(cls.key_hash.in_(key_hashes))
+                    current_rows_by_key_hashes(cls),
+                    params={"key_hashes": list(key_hashes)},
                 ).unique()
             ]
 
     @classmethod
     @inject
     def all(cls: T, database: Engine) -> list[T]:
-        """Load all entities from the database."""
+        """Load the current rows of all entities from the database."""
         with Session(database) as session:
-            return [item[0] for item in session.exec(select(cls)).unique().all()]
+            return [item[0] for item in session.exec(current_rows(cls)).unique().all()]
+
+    @classmethod
+    @inject
+    def as_of(cls: T, database: Engine, *, timestamp: datetime) -> list[T]:
+        """Load the entities as they were at a moment.
+
+        Selects the version of each entity that was active at timestamp, by the
+        GiST index on active_period. Relationships are not point-in-time: to
+        reconstruct related entities, load their table as_of the same timestamp.
+        """
+        return cls._load_versions(database, cls.active_at(timestamp))
+
+    @classmethod
+    @inject
+    def between(cls: T, database: Engine, *, start: datetime, end: datetime) -> list[T]:
+        """Load all versions that were active somewhere in [start, end).
+
+        An entity can have multiple versions in the period; they are ordered by
+        key_hash and active_from.
+        """
+        return cls._load_versions(database, cls.active_during(start, end))
+
+    @classmethod
+    def active_at(cls, timestamp: datetime) -> ColumnElement[bool]:
+        """Get the condition for the versions active at timestamp."""
+        return cls.active_period.contains(literal(timestamp, DateTime(timezone=True)))
+
+    @classmethod
+    def active_during(cls, start: datetime, end: datetime) -> ColumnElement[bool]:
+        """Get the condition for the versions active somewhere in [start, end)."""
+        return cls.active_period.overlaps(
+            func.tstzrange(start, end, "[)", type_=TSTZRANGE)
+        )
+
+    @classmethod
+    def _load_versions(
+        cls: T, database: Engine, condition: ColumnElement[bool]
+    ) -> list[T]:
+        with Session(database) as session:
+            return [
+                item[0]
+                for item in session.exec(
+                    select(cls).where(condition).order_by(cls.key_hash, cls.active_from)
+                ).unique()
+            ]
 
     @classmethod
     def keys(cls) -> list[str]:
@@ -198,6 +348,7 @@ class BaseTable(SQLModel):
                 "updated_at",
                 "active_from",
                 "active_to",
+                "active_period",
                 "is_current",
             ]
         )
@@ -230,15 +381,11 @@ class BaseTable(SQLModel):
 
     @field_serializer("attribute_hash_scd2")
     def _attribute_hash_scd2_serializer(self, _: str | None) -> str:
-        return sha256(
-            self.HASH_SEPARATOR.join(self.scd2_attribute_values).encode()
-        ).hexdigest()
+        return self.compute_attribute_hash_scd2()
 
     @field_serializer("attribute_hash_scd1")
     def _attribute_hash_scd1_serializer(self, _: str | None) -> str:
-        return sha256(
-            self.HASH_SEPARATOR.join(self.scd1_attribute_values).encode()
-        ).hexdigest()
+        return self.compute_attribute_hash_scd1()
 
     @field_serializer("key_hash")
     def _key_hash_serializer(self, _: str | None) -> str:
@@ -254,3 +401,37 @@ class BaseTable(SQLModel):
         return sha256(
             self.HASH_SEPARATOR.join(self.business_key_values).encode()
         ).hexdigest()
+
+    def compute_attribute_hash_scd1(self) -> str:
+        """Compute the scd1 hash of the entity. See compute_key_hash."""
+        return sha256(
+            self.HASH_SEPARATOR.join(self.scd1_attribute_values).encode()
+        ).hexdigest()
+
+    def compute_attribute_hash_scd2(self) -> str:
+        """Compute the scd2 hash of the entity. See compute_key_hash."""
+        return sha256(
+            self.HASH_SEPARATOR.join(self.scd2_attribute_values).encode()
+        ).hexdigest()
+
+
+class PartitionedTable(BaseTable):
+    """A BaseTable that is partitioned by active_to, see HistoryPartitioner.
+
+    A primary key, or any unique constraint, of a partitioned table must include
+    active_to. The id is therefor only indexed, and not enforced unique by the
+    database; it is generated by uuid4. The id remains the primary key of the
+    mapper, such that the ORM identifies rows by it. Foreign keys can not refer to
+    a partitioned table: references to its rows are not enforced by the database.
+
+    Implementing classes MUST include HISTORY_PARTITIONING in their __table_args__.
+    """
+
+    __mapper_args__: ClassVar[dict[str, Any]] = {"primary_key": ["id"]}
+
+    id: UUID = Field(
+        sa_type=SQLAlchemyUUID(as_uuid=True),
+        default_factory=uuid4,
+        nullable=False,
+        index=True,
+    )
@@ -0,0 +1,136 @@
+from datetime import datetime
+from typing import Any, ClassVar
+from uuid import UUID, uuid4
+
+from sqlalchemy import UUID as SQLAlchemyUUID  # noqa: N811
+from sqlalchemy import (
+    DateTime,
+    Index,
+    UniqueConstraint,
+    delete,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Field, Session, SQLModel
+
+
+class DigestItem(SQLModel, table=True):
+    """A vehicle availability that must be included in the digest of a subscriber.
+
+    Rows are written by the DigestNotifier, one per subscriber per availability. The
+    DigestScheduler claims the pending rows of a subscriber once its digest is due,
+    sends them in one email, and sets sent_at. All rows of one digest share their
+    sent_at, which therefor identifies the digest.
+
+    This is a queue, not an entity: it does not extend BaseTable and has no SCD2
+    history, just like NotificationOutbox. An availability is enqueued at most once
+    per subscriber.
+    """
+
+    __tablename__ = "digest_item"
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        UniqueConstraint("subscriber", "vehicle_key_hash", "available_since"),
+        Index(
+            "ix_digest_item_pending",
+            "subscriber",
+            "created_at",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+        # Used to find the recent digests of a subscriber
+        Index(
+            "ix_digest_item_sent",
+            "subscriber",
+            "sent_at",
+            postgresql_where=text("sent_at IS NOT NULL"),
+        ),
+    )
+
+    id: UUID = Field(
+        primary_key=True,
+        sa_type=SQLAlchemyUUID(as_uuid=True),
+        default_factory=uuid4,
+    )
+    subscriber: str
+    vehicle_key_hash: str
+    make: str
+    model: str
+    available_since: datetime = Field(sa_type=DateTime(timezone=True))
+    created_at: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+        sa_column_kwargs={"server_default": func.now()},
+    )
+    sent_at: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+    )
+
+    @classmethod
+    def enqueue(
+        cls, session: Session, subscribers: list[str], rows: list[dict[str, Any]]
+    ) -> None:
+        """Add rows for each subscriber, within the transaction of the session.
+
+        Rows that are already enqueued for a subscriber are ignored. Ids are
+        generated here, because a multi-row insert would evaluate the default of the
+        id only once.
+        """
+        if not rows or not subscribers:
+            return
+        session.exec(
+            insert(cls)
+            .values(
+                [
+                    {"id": uuid4(), "subscriber": subscriber, **row}
+                    for subscriber in subscribers
+                    for row in rows
+                ]
+            )
+            .on_conflict_do_nothing(
+                index_elements=["subscriber", "vehicle_key_hash", "available_since"]
+            )
+        )
+
+    @classmethod
+    def claim_pending(cls, session: Session, subscriber: str) -> list["DigestItem"]:
+        """Lock and return the pending rows of subscriber, oldest first.
+
+        Rows locked by other sessions are skipped, such that concurrent schedulers
+        do not claim the same rows. The locks are held until the transaction of the
+        session ends.
+        """
+        statement = (
+            select(cls)
+            .where(cls.subscriber == subscriber)
+            .where(cls.sent_at.is_(None))
+            .order_by(cls.created_at)
+            .with_for_update(skip_locked=True)
+        )
+        return [item[0] for item in session.exec(statement).all()]
+
+    @classmethod
+    def sent_since(
+        cls, session: Session, subscriber: str, since: datetime
+    ) -> list[datetime]:
+        """Get the times at which digests were sent to subscriber since since."""
+        statement = (
+            select(cls.sent_at)
+            .distinct()
+            .where(cls.subscriber == subscriber)
+            .where(cls.sent_at >= since)
+            .order_by(cls.sent_at)
+        )
+        return [item[0] for item in session.exec(statement).all()]
+
+    @classmethod
+    def prune(cls, session: Session, before: datetime) -> int:
+        """Delete the rows that were sent before before.
+
+        Returns
+        -------
+        int, the number of deleted rows
+
+        """
+        return session.exec(delete(cls).where(cls.sent_at < before)).rowcount
@@ -1,10 +1,14 @@
 from datetime import datetime
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, Any, ClassVar
 
-from sqlalchemy import DateTime, func
+from sqlalchemy import DateTime, Index, func
 from sqlmodel import Field
 
-from athlon_flex_notifier.models.tables.base_table import BaseTable, LoadType
+from athlon_flex_notifier.models.tables.base_table import (
+    BaseTable,
+    LoadType,
+    active_row_indexes,
+)
 
 if TYPE_CHECKING:
     from athlon_flex_notifier.models.views.vehicle_availability import (
@@ -17,6 +21,15 @@ class Notification(BaseTable, table=True):
 
     # Notifications are never updated, and processed as delta (no delete)
     LOAD_TYPE: ClassVar[LoadType] = LoadType.DELTA_WITHOUT_DELETE
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        *active_row_indexes("notification"),
+        # Used to find the notification of an availability
+        Index(
+            "ix_notification_vehicle_key_hash_available_since",
+            "vehicle_key_hash",
+            "available_since",
+        ),
+    )
 
     vehicle_key_hash: str
     available_since: datetime = Field(
@@ -0,0 +1,168 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, ClassVar
+from uuid import UUID, uuid4
+
+from sqlalchemy import UUID as SQLAlchemyUUID  # noqa: N811
+from sqlalchemy import (
+    DateTime,
+    Index,
+    UniqueConstraint,
+    func,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Field, Session, SQLModel
+
+from athlon_flex_notifier.utils import now
+
+
+class NotificationOutbox(SQLModel, table=True):
+    """Transactional outbox of vehicle availabilities that must be notified.
+
+    Rows are written by the refresh path, in the same transaction that inserts the
+    vehicle rows (see Vehicle.on_upsert). The OutboxDrainer claims pending rows in
+    batches, delivers them, and marks them processed.
+
+    This is a queue, not an entity: it does not extend BaseTable and has no SCD2
+    history. An availability is identified by (vehicle_key_hash, available_since),
+    just like Notification, and is enqueued at most once.
+
+    Attributes:
+        CHANNEL: ClassVar[str] = "vehicle_available"
+            Postgres channel on which enqueued vehicle key hashes are published.
+        NOTIFY_BATCH_SIZE: ClassVar[int] = 100
+            Number of key hashes per notification. Keeps the payload below the
+            8000 bytes limit of pg_notify.
+        MAX_ATTEMPTS: ClassVar[int] = 5
+            Rows that failed this many times are dead letters: they are no longer
+            claimed, such that they do not block the rows behind them. Reset their
+            attempts to deliver them again.
+        CLAIM_TIMEOUT: ClassVar[timedelta] = timedelta(minutes=10)
+            Claims older than this are considered abandoned, for example by a
+            drainer that crashed, and their rows are claimed again.
+
+    """
+
+    CHANNEL: ClassVar[str] = "vehicle_available"
+    NOTIFY_BATCH_SIZE: ClassVar[int] = 100
+    MAX_ATTEMPTS: ClassVar[int] = 5
+    CLAIM_TIMEOUT: ClassVar[timedelta] = timedelta(minutes=10)
+
+    __tablename__ = "notification_outbox"
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        UniqueConstraint("vehicle_key_hash", "available_since"),
+        Index(
+            "ix_notification_outbox_pending",
+            "created_at",
+            postgresql_where=text("processed_at IS NULL"),
+        ),
+    )
+
+    id: UUID = Field(
+        primary_key=True,
+        sa_type=SQLAlchemyUUID(as_uuid=True),
+        default_factory=uuid4,
+    )
+    vehicle_key_hash: str
+    make: str
+    model: str
+    available_since: datetime = Field(sa_type=DateTime(timezone=True))
+    attempts: int = Field(default=0)
+    created_at: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+        sa_column_kwargs={"server_default": func.now()},
+    )
+    claimed_at: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+    )
+    processed_at: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+    )
+
+    @classmethod
+    def enqueue(cls, session: Session, rows: list[dict[str, Any]]) -> None:
+        """Add rows to the outbox, within the transaction of the session.
+
+        Rows that are already enqueued are ignored. Ids are generated here, because
+        a multi-row insert would evaluate the default of the id only once.
+
+        The key hashes of the inserted rows are published on CHANNEL, such that
+        listeners are not woken up if all rows were enqueued before. Postgres
+        delivers notifications when the transaction commits, hence listeners never
+        see uncommitted rows.
+        """
+        if not rows:
+            return
+        statement = (
+            insert(cls)
+            .values([{"id": uuid4(), **row} for row in rows])
+            .on_conflict_do_nothing(
+                index_elements=["vehicle_key_hash", "available_since"]
+            )
+            .returning(cls.vehicle_key_hash)
+        )
+        key_hashes = [item[0] for item in session.exec(statement).all()]
+        for start in range(0, len(key_hashes), cls.NOTIFY_BATCH_SIZE):
+            payload = json.dumps(key_hashes[start : start + cls.NOTIFY_BATCH_SIZE])
+            session.exec(select(func.pg_notify(cls.CHANNEL, payload)))
+
+    @classmethod
+    def claim_pending(cls, session: Session, limit: int) -> list["NotificationOutbox"]:
+        """Claim and return at most limit pending rows, oldest first.
+
+        The rows are selected FOR UPDATE SKIP LOCKED, their claimed_at is set and
+        their attempts are increased. Once the session commits, other sessions skip
+        the rows until they are released, marked processed, or their claim is older
+        than CLAIM_TIMEOUT. The rows can therefor be delivered outside a transaction,
+        without multiple drainers claiming the same rows. Dead letters are not
+        claimed.
+        """
+        statement = (
+            select(cls)
+            .where(cls.processed_at.is_(None))
+            .where(cls.attempts < cls.MAX_ATTEMPTS)
+            .where(
+                or_(
+                    cls.claimed_at.is_(None),
+                    cls.claimed_at < func.now() - cls.CLAIM_TIMEOUT,
+                )
+            )
+            .order_by(cls.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        messages = [item[0] for item in session.exec(statement).all()]
+        claimed_at = now()
+        for message in messages:
+            message.claimed_at = claimed_at
+            message.attempts += 1
+        session.add_all(messages)
+        return messages
+
+    @classmethod
+    def mark_processed(cls, session: Session, ids: list[UUID]) -> None:
+        """Mark the claimed rows with ids processed."""
+        session.exec(update(cls).where(cls.id.in_(ids)).values(processed_at=now()))
+
+    @classmethod
+    def release(cls, session: Session, ids: list[UUID]) -> None:
+        """Release the claim on the rows with ids, such that they are retried."""
+        session.exec(update(cls).where(cls.id.in_(ids)).values(claimed_at=None))
+
+    @classmethod
+    def count_dead_letters(cls, session: Session) -> int:
+        """Count the pending rows that failed MAX_ATTEMPTS times."""
+        statement = (
+            select(func.count())
+            .select_from(cls)
+            .where(cls.processed_at.is_(None))
+            .where(cls.attempts >= cls.MAX_ATTEMPTS)
+        )
+        return session.exec(statement).one()[0]
@@ -0,0 +1,41 @@
+from typing import Any, ClassVar
+
+from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
+
+from athlon_flex_notifier.models.tables.base_table import (
+    BaseTable,
+    LoadType,
+    active_row_indexes,
+)
+
+
+class OptionCatalog(BaseTable, table=True):
+    """Vehicle option, shared by all vehicles that have it.
+
+    Example: Trekhaak.
+
+    Which vehicles have which options, is stored in VehicleOptionSet. Options are
+    upserted as delta: the options of a partial load are only a subset of all
+    options, and an option that no vehicle has anymore is kept.
+    """
+
+    __tablename__ = "option_catalog"
+    LOAD_TYPE: ClassVar[LoadType] = LoadType.DELTA_WITHOUT_DELETE
+    __table_args__: ClassVar[tuple[Any, ...]] = active_row_indexes("option_catalog")
+
+    athlon_id: str
+    externalId: str
+    optionName: str
+
+    @staticmethod
+    def business_keys() -> list[str]:
+        return ["athlon_id"]
+
+    @staticmethod
+    def create_by_api_response(option_base: VehicleBase.Option) -> "OptionCatalog":
+        """Create a SQLModel instance from an API reponse."""
+        return OptionCatalog(
+            athlon_id=option_base.id,
+            externalId=option_base.externalId,
+            optionName=option_base.optionName,
+        )
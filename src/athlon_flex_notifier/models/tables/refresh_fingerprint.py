@@ -0,0 +1,89 @@
+from collections.abc import Iterable
+from datetime import datetime
+from typing import ClassVar
+
+from kink import inject
+from sqlalchemy import DateTime, Engine, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Field, Session, SQLModel
+
+from athlon_flex_notifier.utils import now
+
+
+class RefreshFingerprint(SQLModel, table=True):
+    """Fingerprints of the API responses that were stored by the refresh.
+
+    A fingerprint is the content hash of a response, computed by SnapshotArchive.put:
+    the sha256 of its JSON. The refresh stores the
+    fingerprint of the cluster summaries (key SUMMARY_KEY) and of each cluster
+    including its vehicles (see cluster_key). If a response has the same
+    fingerprint as the stored one, it is already stored in the database, and mapping,
+    hashing and upserting it can be skipped.
+
+    A fingerprint is only valid if the response it belongs to is fully stored.
+    Therefor, a fingerprint is invalidated before its response is stored, and written
+    after it is stored successfully.
+
+    Like NotificationOutbox, this is not an entity: it does not extend BaseTable and
+    has no SCD2 history.
+
+    Attributes:
+        SUMMARY_KEY: ClassVar[str] = "summary"
+            Key of the fingerprint of the cluster summaries.
+
+    """
+
+    SUMMARY_KEY: ClassVar[str] = "summary"
+
+    __tablename__ = "refresh_fingerprint"
+
+    key: str = Field(primary_key=True)
+    fingerprint: str
+    updated_at: datetime = Field(sa_type=DateTime(timezone=True))
+
+    @staticmethod
+    def cluster_key(make: str, model: str) -> str:
+        """Get the key of the fingerprint of a cluster, by its business keys."""
+        return f"cluster:{make}:{model}"
+
+    @classmethod
+    @inject
+    def load(cls, database: Engine) -> dict[str, str]:
+        """Load all stored fingerprints, by key."""
+        with Session(database) as session:
+            return dict(session.exec(select(cls.key, cls.fingerprint)).all())
+
+    @classmethod
+    @inject
+    def store(cls, fingerprints: dict[str, str], database: Engine) -> None:
+        """Insert or update fingerprints, by key."""
+        if not fingerprints:
+            return
+        timestamp = now()
+        statement = insert(cls).values(
+            [
+                {"key": key, "fingerprint": fingerprint, "updated_at": timestamp}
+                for key, fingerprint in fingerprints.items()
+            ]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["key"],
+            set_={
+                "fingerprint": statement.excluded.fingerprint,
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+        with Session(database) as session:
+            session.exec(statement)
+            session.commit()
+
+    @classmethod
+    @inject
+    def invalidate(cls, keys: Iterable[str], database: Engine) -> None:
+        """Delete the fingerprints with the given keys."""
+        keys = list(keys)
+        if not keys:
+            return
+        with Session(database) as session:
+            session.exec(delete(cls).where(cls.key.in_(keys)))
+            session.commit()
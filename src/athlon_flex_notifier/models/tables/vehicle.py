@@ -2,16 +2,23 @@ from typing import TYPE_CHECKING, Any, ClassVar
 from uuid import UUID
 
 from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
-from sqlmodel import Field, Relationship
-
-from athlon_flex_notifier.models.tables.base_table import BaseTable
+from sqlalchemy import Index
+from sqlmodel import Field, Relationship, Session
+
+from athlon_flex_notifier.models.tables.base_table import (
+    HISTORY_PARTITIONING,
+    PartitionedTable,
+    active_row_indexes,
+)
+from athlon_flex_notifier.models.tables.notification_outbox import NotificationOutbox
+from athlon_flex_notifier.models.tables.vehicle_option_set import VehicleOptionSet
+from athlon_flex_notifier.models.tables.vehicle_pricing import VehiclePricing
 
 if TYPE_CHECKING:
-    from athlon_flex_notifier.models.tables.option import Option
     from athlon_flex_notifier.models.tables.vehicle_cluster import VehicleCluster
 
 
-class Vehicle(BaseTable, table=True):
+class Vehicle(PartitionedTable, table=True):
     """Vehicle model.
 
     A Vehicle defines a specific vehicle configuration.
@@ -23,9 +30,18 @@ class Vehicle(BaseTable, table=True):
         - contributionInEuro is updated when the user is logged in
         - netCostPerMonthInEuro is not present when the user is not logged in
 
+    The prices are stored in VehiclePricing, such that price changes do not create
+    new versions of the vehicle. The price properties read the current pricing.
+
     """
 
     model_config: ClassVar[dict[str, Any]] = {"protected_namespaces": ()}
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        *active_row_indexes("vehicle"),
+        # Used by vw_vehicle_availability
+        Index("ix_vehicle_key_hash_active_from", "key_hash", "active_from"),
+        HISTORY_PARTITIONING,
+    )
     athlon_id: str
     make: str
     model: str
@@ -51,15 +67,8 @@ class Vehicle(BaseTable, table=True):
     avg_fuel_consumption: float | None = None
     type_spare_wheel: str | None = None
     fiscal_value_in_euro: float | None = None
-    base_price_in_euro_per_month: float | None = None
-    calculated_price_in_euro_per_month: float | None = None
-    price_per_km: float | None = None
-    fuel_price_per_km: float | None = None
-    contribution_in_euro: float | None = None
-    expected_fuel_cost_in_euro_per_month: float | None = None
-    net_cost_in_euro_per_month: float | None = None
     vehicle_cluster_id: UUID | None = Field(
-        foreign_key="vehicle_cluster.id", nullable=False
+        foreign_key="vehicle_cluster.id", nullable=False, index=True
     )
     vehicle_cluster: "VehicleCluster" = Relationship(
         back_populates="vehicles",
@@ -67,9 +76,27 @@ class Vehicle(BaseTable, table=True):
             "lazy": "joined",
         },
     )
-    options: list["Option"] = Relationship(
-        back_populates="vehicle",
-        cascade_delete=True,
+    # Current pricing. Joined on key hash, since pricing versions are independent of
+    # the versions of the vehicle.
+    pricing: "VehiclePricing" = Relationship(
+        sa_relationship_kwargs={
+            "primaryjoin": "and_(Vehicle.key_hash == "
+            "foreign(VehiclePricing.vehicle_key_hash), "
+            "VehiclePricing.active_to.is_(None))",
+            "uselist": False,
+            "viewonly": True,
+            "lazy": "joined",
+        },
+    )
+    # Current option set, joined on key hash like pricing
+    option_set: "VehicleOptionSet" = Relationship(
+        sa_relationship_kwargs={
+            "primaryjoin": "and_(Vehicle.key_hash == "
+            "foreign(VehicleOptionSet.vehicle_key_hash), "
+            "VehicleOptionSet.active_to.is_(None))",
+            "uselist": False,
+            "viewonly": True,
+        },
     )
 
     @staticmethod
@@ -80,6 +107,26 @@ class Vehicle(BaseTable, table=True):
     def scd1_attribute_keys() -> list[str]:
         return ["vehicle_cluster_id"]
 
+    @classmethod
+    def on_upsert(cls, session: Session, created_rows: list[dict[str, Any]]) -> None:
+        """Enqueue a notification for each vehicle that became available.
+
+        A created vehicle starts a new availability in vw_vehicle_availability, which
+        is available since the active_from of the new row.
+        """
+        NotificationOutbox.enqueue(
+            session,
+            [
+                {
+                    "vehicle_key_hash": row["key_hash"],
+                    "make": row["make"],
+                    "model": row["model"],
+                    "available_since": row["active_from"],
+                }
+                for row in created_rows
+            ],
+        )
+
     @classmethod
     def create_by_api_response(cls, vehicle_base: VehicleBase) -> "Vehicle":
         """Create a SQLModel instance by an API response.
@@ -87,8 +134,6 @@ class Vehicle(BaseTable, table=True):
         Note that the vehicle_cluster_id is not set here. Since it is required in the
         DB, this property must be set before the vehicle can be upserted.
         """
-        from athlon_flex_notifier.models.tables.option import Option
-
         data = {
             "athlon_id": vehicle_base.id,
             "make": vehicle_base.make,
@@ -121,30 +166,48 @@ class Vehicle(BaseTable, table=True):
         if vehicle_base.pricing is not None:
             data = data | {
                 "fiscal_value_in_euro": vehicle_base.pricing.fiscalValueInEuro,
-                "base_price_in_euro_per_month": (
-                    vehicle_base.pricing.basePricePerMonthInEuro
-                ),
-                "calculated_price_in_euro_per_month": (
-                    vehicle_base.pricing.calculatedPricePerMonthInEuro
-                ),
-                "price_per_km": vehicle_base.pricing.pricePerKm,
-                "fuel_price_per_km": vehicle_base.pricing.fuelPricePerKm,
-                "contribution_in_euro": vehicle_base.pricing.contributionInEuro,
-                "expected_fuel_cost_in_euro_per_month": (
-                    vehicle_base.pricing.expectedFuelCostPerMonthInEuro
-                ),
-                "net_cost_in_euro_per_month": (
-                    vehicle_base.pricing.netCostPerMonthInEuro
-                ),
             }
         vehicle = Vehicle(**data)
+        if vehicle_base.pricing is not None:
+            vehicle.pricing = VehiclePricing.create_by_api_response(
+                vehicle_base.pricing
+            )
         if vehicle_base.options:
-            vehicle.options = [
-                Option.create_by_api_response(option_base)
-                for option_base in vehicle_base.options
-            ]
+            vehicle.option_set = VehicleOptionSet.create_by_api_response(
+                vehicle_base.options
+            )
         return vehicle
 
+    @property
+    def base_price_in_euro_per_month(self) -> float | None:
+        return self.pricing.base_price_in_euro_per_month if self.pricing else None
+
+    @property
+    def calculated_price_in_euro_per_month(self) -> float | None:
+        return self.pricing.calculated_price_in_euro_per_month if self.pricing else None
+
+    @property
+    def price_per_km(self) -> float | None:
+        return self.pricing.price_per_km if self.pricing else None
+
+    @property
+    def fuel_price_per_km(self) -> float | None:
+        return self.pricing.fuel_price_per_km if self.pricing else None
+
+    @property
+    def contribution_in_euro(self) -> float | None:
+        return self.pricing.contribution_in_euro if self.pricing else None
+
+    @property
+    def expected_fuel_cost_in_euro_per_month(self) -> float | None:
+        return (
+            self.pricing.expected_fuel_cost_in_euro_per_month if self.pricing else None
+        )
+
+    @property
+    def net_cost_in_euro_per_month(self) -> float | None:
+        return self.pricing.net_cost_in_euro_per_month if self.pricing else None
+
     @property
     def has_active_availability(self) -> bool:
         return self.active_availability is not None
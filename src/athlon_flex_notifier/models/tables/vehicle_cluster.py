@@ -1,13 +1,24 @@
+from collections.abc import Iterable
+from typing import Any, ClassVar
+from uuid import UUID
+
 from athlon_flex_client.models.vehicle_cluster import (
     VehicleCluster as VehicleClusterBase,
 )
 from athlon_flex_client.models.vehicle_cluster import VehicleClusters
 from kink import inject
-from sqlmodel import Relationship
+from sqlalchemy import ColumnElement, Engine, select
+from sqlmodel import Relationship, Session
 
-from athlon_flex_notifier.models.tables.base_table import BaseTable
+from athlon_flex_notifier.models.tables.base_table import (
+    BaseTable,
+    active_row_indexes,
+)
+from athlon_flex_notifier.models.tables.option_catalog import OptionCatalog
 from athlon_flex_notifier.models.tables.vehicle import Vehicle
-from athlon_flex_notifier.upserter import Upserter
+from athlon_flex_notifier.models.tables.vehicle_option_set import VehicleOptionSet
+from athlon_flex_notifier.models.tables.vehicle_pricing import VehiclePricing
+from athlon_flex_notifier.upserter import UpsertBatch, Upserter
 from athlon_flex_notifier.utils import time_it
 
 
@@ -19,6 +30,7 @@ class VehicleCluster(BaseTable, table=True):
     """
 
     __tablename__ = "vehicle_cluster"
+    __table_args__: ClassVar[tuple[Any, ...]] = active_row_indexes("vehicle_cluster")
     first_vehicle_id: str
     external_type_id: str
     make: str
@@ -32,10 +44,15 @@ class VehicleCluster(BaseTable, table=True):
     max_co2_emission: int
     image_uri: str
 
+    # Current vehicles only: the history of vehicles refers to the cluster as well
     vehicles: list["Vehicle"] | None = Relationship(
         back_populates="vehicle_cluster",
         cascade_delete=True,
-        sa_relationship_kwargs={"lazy": "joined"},
+        sa_relationship_kwargs={
+            "primaryjoin": "and_(VehicleCluster.id == Vehicle.vehicle_cluster_id, "
+            "Vehicle.active_to.is_(None))",
+            "lazy": "joined",
+        },
     )
 
     @staticmethod
@@ -87,22 +104,73 @@ class VehicleCluster(BaseTable, table=True):
             ]
         return vehicle_cluster
 
+    @classmethod
+    @inject
+    def changed_key_hashes(
+        cls, vehicle_clusters: list["VehicleCluster"], database: Engine
+    ) -> set[str]:
+        """Get the key hashes of the clusters that changed wrt the database.
+
+        A cluster has changed if it is new, if its scd1 or scd2 hash differs from
+        the active row, or if it is deleted: it is active in the database, but not
+        present in vehicle_clusters. Only the hashes are loaded from the database.
+        """
+        with Session(database) as session:
+            stored = {
+                key_hash: (attribute_hash_scd1, attribute_hash_scd2)
+                for key_hash, attribute_hash_scd1, attribute_hash_scd2 in session.exec(
+                    select(
+                        cls.key_hash, cls.attribute_hash_scd1, cls.attribute_hash_scd2
+                    ).where(cls.active_to.is_(None))
+                ).all()
+            }
+        current = {
+            cluster.compute_key_hash(): (
+                cluster.compute_attribute_hash_scd1(),
+                cluster.compute_attribute_hash_scd2(),
+            )
+            for cluster in vehicle_clusters
+        }
+        changed = {
+            key_hash
+            for key_hash, hashes in current.items()
+            if stored.get(key_hash) != hashes
+        }
+        return changed | (stored.keys() - current.keys())
+
+    @classmethod
+    @inject
+    def active_ids(cls, database: Engine) -> dict[str, UUID]:
+        """Get the ids of the active clusters, by key hash.
+
+        Unlike all, this does not load the vehicles of the clusters.
+        """
+        with Session(database) as session:
+            return dict(
+                session.exec(
+                    select(cls.key_hash, cls.id).where(cls.active_to.is_(None))
+                ).all()
+            )
+
     @classmethod
     @inject
     def store_api_response(
-        cls, vehicle_cluster_bases: VehicleClusters, upserter: Upserter
+        cls,
+        vehicle_cluster_bases: VehicleClusters,
+        upserter: Upserter,
+        *,
+        changed_key_hashes: set[str] | None = None,
     ) -> list["VehicleCluster"]:
         """Create VehicleCluster instances from an API response, and upsert them.
 
         - Create the VehicleCluster instances, and upsert them
-        - Update the Vehicles of each cluster, setting the correct cluster_id
-            The cluster id was generated in _from_base, but if the cluster
-            is not updated wrt the database, it should be the existing ID.
-        - Upsert the vehicles
-        - Update the options with the correct vehicle_id, same as with vehicles
-        - Upsert the options
+        - Upsert the vehicles and options of the clusters, see store_vehicles
         - Return all active clusters
 
+        If changed_key_hashes is provided, the response is partial: only the
+        clusters with these key hashes include their vehicles. All clusters are
+        upserted, but the vehicles and options are upserted as a partial load,
+        scoped to the changed clusters. Vehicles of other clusters are left untouched.
         """
         vehicle_clusters = {
             cluster.compute_key_hash(): cluster
@@ -113,25 +181,172 @@ class VehicleCluster(BaseTable, table=True):
         }
         with time_it("Upserting clusters"):
             vehicle_clusters_upserted = upserter.upsert(list(vehicle_clusters.values()))
-        # set the correct vehicle_cluster_id on the vehicles
+        if changed_key_hashes is not None:
+            vehicle_clusters = {
+                key_hash: cluster
+                for key_hash, cluster in vehicle_clusters.items()
+                if key_hash in changed_key_hashes
+            }
+        cls.store_vehicles(
+            vehicle_clusters,
+            {
+                key_hash: cluster.id
+                for key_hash, cluster in vehicle_clusters_upserted.items()
+            },
+            scope_key_hashes=changed_key_hashes,
+        )
+        return list(vehicle_clusters_upserted.values())
+
+    @classmethod
+    def store_vehicles(
+        cls,
+        vehicle_clusters: dict[str, "VehicleCluster"],
+        cluster_ids: dict[str, UUID],
+        *,
+        scope_key_hashes: Iterable[str] | None = None,
+    ) -> None:
+        """Upsert the vehicles of clusters created from an API response.
+
+        See map_vehicles and upsert_vehicles. vehicle_clusters maps key hashes to the
+        clusters including vehicles, cluster_ids maps key hashes to the ids of the
+        upserted clusters.
+        """
+        cls.upsert_vehicles(
+            cls.map_vehicles(vehicle_clusters, cluster_ids),
+            scope_key_hashes=scope_key_hashes,
+        )
+
+    @classmethod
+    def map_vehicles(
+        cls,
+        vehicle_clusters: dict[str, "VehicleCluster"],
+        cluster_ids: dict[str, UUID],
+    ) -> dict[str, Vehicle]:
+        """Prepare the vehicles of clusters created from an API response for upsert.
+
+        Update the Vehicles of each cluster, setting the correct cluster_id. The
+        cluster id was generated in _from_base, but if the cluster is not updated
+        wrt the database, it should be the existing ID.
+
+        Does not access the database, such that it can run concurrently with
+        upsert_vehicles of other clusters.
+
+        Returns
+        -------
+        dict[str, Vehicle], the vehicles by key hash
+
+        """
         vehicles = {}
         for cluster_key_hash, cluster in vehicle_clusters.items():
             for vehicle in cluster.vehicles:
-                vehicle.vehicle_cluster_id = vehicle_clusters_upserted[
-                    cluster_key_hash
-                ].id
-                vehicles[vehicle.compute_key_hash()] = vehicle
-        with time_it("Upserting vehicles"):
-            vehicles_upserted = upserter.upsert(list(vehicles.values()))
-        # set the correct vehicle_id on the options
-        options = []
-        for vehicle_key_hash, vehicle in vehicles.items():
-            for option in vehicle.options:
-                option.vehicle_id = vehicles_upserted[vehicle_key_hash].id
-                options.append(option)
-        with time_it("Upserting options"):
-            upserter.upsert(list(options))
-        return VehicleCluster.all()
+                vehicle.vehicle_cluster_id = cluster_ids[cluster_key_hash]
+                key_hash = vehicle.compute_key_hash()
+                if vehicle.pricing is not None:
+                    vehicle.pricing.vehicle_key_hash = key_hash
+                if vehicle.option_set is not None:
+                    vehicle.option_set.vehicle_key_hash = key_hash
+                vehicles[key_hash] = vehicle
+        return vehicles
+
+    @classmethod
+    def upsert_vehicles(
+        cls,
+        vehicles: dict[str, Vehicle],
+        *,
+        scope_key_hashes: Iterable[str] | None = None,
+    ) -> None:
+        """Upsert vehicles prepared by map_vehicles, and their pricing and options.
+
+        - Upsert the vehicles
+        - Upsert the pricing of the vehicles
+        - Upsert the options of the vehicles in the OptionCatalog
+        - Upsert the option sets of the vehicles
+
+        If scope_key_hashes is provided, the vehicles, pricing and option sets are
+        upserted as a partial load, scoped to the clusters with these key hashes.
+        Vehicles of clusters in the scope but not in vehicles are closed.
+        """
+        for batch in cls.upsert_batches(vehicles, scope_key_hashes=scope_key_hashes):
+            batch.upsert()
+
+    @classmethod
+    def upsert_batches(
+        cls,
+        vehicles: dict[str, Vehicle],
+        *,
+        scope_key_hashes: Iterable[str] | None = None,
+    ) -> list[UpsertBatch]:
+        """Get the batches of upsert_vehicles, in the order they must be upserted.
+
+        Each batch can be upserted separately, such that a failed batch can be
+        retried without repeating the batches before it. The option catalog batch
+        is omitted if the vehicles have no options.
+        """
+        vehicles_scope = pricing_scope = option_sets_scope = None
+        if scope_key_hashes is not None:
+            vehicles_scope, pricing_scope, option_sets_scope = cls.scopes(
+                cls.key_hash.in_(list(scope_key_hashes))
+            )
+        option_sets = [
+            vehicle.option_set
+            for vehicle in vehicles.values()
+            if vehicle.option_set is not None
+        ]
+        # Vehicles share options: deduplicate, since a batch must be unique
+        catalog = {
+            option.compute_key_hash(): option
+            for option_set in option_sets
+            for option in option_set.options
+        }
+        batches = [
+            UpsertBatch(
+                "Upserting vehicles",
+                list(vehicles.values()),
+                Vehicle,
+                scope=vehicles_scope,
+            ),
+            UpsertBatch(
+                "Upserting pricing",
+                [
+                    vehicle.pricing
+                    for vehicle in vehicles.values()
+                    if vehicle.pricing is not None
+                ],
+                VehiclePricing,
+                scope=pricing_scope,
+            ),
+        ]
+        if catalog:
+            batches.append(
+                UpsertBatch(
+                    "Upserting option catalog", list(catalog.values()), OptionCatalog
+                )
+            )
+        batches.append(
+            UpsertBatch(
+                "Upserting option sets",
+                option_sets,
+                VehicleOptionSet,
+                scope=option_sets_scope,
+            )
+        )
+        return batches
+
+    @classmethod
+    def scopes(
+        cls, condition: ColumnElement[bool]
+    ) -> tuple[ColumnElement[bool], ColumnElement[bool], ColumnElement[bool]]:
+        """Get the scopes of the vehicles, pricing and option sets of clusters.
+
+        Used for partial loads, see Upserter.upsert. All versions of the clusters
+        in condition are included, since vehicles keep referring to the cluster
+        version that was active when they were created.
+        """
+        vehicles_scope = Vehicle.vehicle_cluster_id.in_(select(cls.id).where(condition))
+        vehicle_key_hashes = select(Vehicle.key_hash).where(vehicles_scope)
+        pricing_scope = VehiclePricing.vehicle_key_hash.in_(vehicle_key_hashes)
+        option_sets_scope = VehicleOptionSet.vehicle_key_hash.in_(vehicle_key_hashes)
+        return vehicles_scope, pricing_scope, option_sets_scope
 
     @property
     def uri(self) -> str:
@@ -0,0 +1,67 @@
+from typing import Any, ClassVar
+
+from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
+from pydantic import PrivateAttr
+from sqlalchemy import ARRAY, String
+from sqlmodel import Field
+
+from athlon_flex_notifier.models.tables.base_table import (
+    HISTORY_PARTITIONING,
+    PartitionedTable,
+    active_row_indexes,
+)
+from athlon_flex_notifier.models.tables.option_catalog import OptionCatalog
+
+
+class VehicleOptionSet(PartitionedTable, table=True):
+    """The options of a Vehicle, as one SCD2 entity.
+
+    Refers to the options by their athlon_id, the business key of OptionCatalog.
+    The ids are sorted, such that the same options always have the same hash. A
+    vehicle gets a new version of its option set only if an option is added,
+    removed or (un)included.
+
+    Like VehiclePricing, the option set refers to the vehicle by its key hash.
+    Vehicle.option_set is the current option set.
+    """
+
+    __tablename__ = "vehicle_option_set"
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        *active_row_indexes("vehicle_option_set"),
+        HISTORY_PARTITIONING,
+    )
+
+    vehicle_key_hash: str | None = Field(default=None, index=True)
+    option_ids: list[str] = Field(default_factory=list, sa_type=ARRAY(String))
+    included_option_ids: list[str] = Field(default_factory=list, sa_type=ARRAY(String))
+    # The options of the API response, to upsert the OptionCatalog. Not stored.
+    _options: list[OptionCatalog] = PrivateAttr(default_factory=list)
+
+    @staticmethod
+    def business_keys() -> list[str]:
+        return ["vehicle_key_hash"]
+
+    @property
+    def options(self) -> list[OptionCatalog]:
+        return self._options
+
+    @staticmethod
+    def create_by_api_response(
+        option_bases: list[VehicleBase.Option],
+    ) -> "VehicleOptionSet":
+        """Create a SQLModel instance from an API reponse.
+
+        Note that the vehicle_key_hash is not set here. Since it is the business key,
+        this property must be set before the option set can be upserted.
+        """
+        option_set = VehicleOptionSet(
+            option_ids=sorted(option_base.id for option_base in option_bases),
+            included_option_ids=sorted(
+                option_base.id for option_base in option_bases if option_base.included
+            ),
+        )
+        option_set._options = [  # noqa: SLF001
+            OptionCatalog.create_by_api_response(option_base)
+            for option_base in option_bases
+        ]
+        return option_set
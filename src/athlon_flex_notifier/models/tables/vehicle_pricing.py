@@ -0,0 +1,76 @@
+from typing import Any, ClassVar
+
+from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
+from sqlmodel import Field
+
+from athlon_flex_notifier.models.tables.base_table import (
+    HISTORY_PARTITIONING,
+    PartitionedTable,
+    active_row_indexes,
+)
+
+
+class VehiclePricing(PartitionedTable, table=True):
+    """Pricing of a Vehicle.
+
+    Prices change much more often than the other attributes of a vehicle, for
+    example because the API flaps. They are therefor kept in their own SCD2 table, of
+    which a version only holds the prices. A price change creates a new narrow
+    pricing version, while the vehicle keeps its version.
+
+    A pricing refers to the vehicle by its key hash, not by its id: it outlives
+    the versions of the vehicle. Vehicle.pricing is the current pricing.
+    """
+
+    __tablename__ = "vehicle_pricing"
+    __table_args__: ClassVar[tuple[Any, ...]] = (
+        *active_row_indexes("vehicle_pricing"),
+        HISTORY_PARTITIONING,
+    )
+
+    vehicle_key_hash: str | None = Field(default=None, index=True)
+    base_price_in_euro_per_month: float | None = None
+    calculated_price_in_euro_per_month: float | None = None
+    price_per_km: float | None = None
+    fuel_price_per_km: float | None = None
+    contribution_in_euro: float | None = None
+    expected_fuel_cost_in_euro_per_month: float | None = None
+    net_cost_in_euro_per_month: float | None = None
+
+    @staticmethod
+    def business_keys() -> list[str]:
+        return ["vehicle_key_hash"]
+
+    @classmethod
+    def volatile_attribute_keys(cls) -> list[str]:
+        """Get the prices that depend on whether the client is logged in.
+
+        These flap if a refresh runs without login, see Vehicle. The
+        HistoryCompactor merges pricing versions that only differ in these.
+        """
+        return [
+            "calculated_price_in_euro_per_month",
+            "contribution_in_euro",
+            "net_cost_in_euro_per_month",
+        ]
+
+    @staticmethod
+    def create_by_api_response(pricing_base: VehicleBase.Pricing) -> "VehiclePricing":
+        """Create a SQLModel instance from an API response.
+
+        Note that the vehicle_key_hash is not set here. Since it is the business key,
+        this property must be set before the pricing can be upserted.
+        """
+        return VehiclePricing(
+            base_price_in_euro_per_month=pricing_base.basePricePerMonthInEuro,
+            calculated_price_in_euro_per_month=(
+                pricing_base.calculatedPricePerMonthInEuro
+            ),
+            price_per_km=pricing_base.pricePerKm,
+            fuel_price_per_km=pricing_base.fuelPricePerKm,
+            contribution_in_euro=pricing_base.contributionInEuro,
+            expected_fuel_cost_in_euro_per_month=(
+                pricing_base.expectedFuelCostPerMonthInEuro
+            ),
+            net_cost_in_euro_per_month=pricing_base.netCostPerMonthInEuro,
+        )
@@ -3,18 +3,27 @@ from pydantic import BaseModel
 from sqlalchemy import Engine, text
 from sqlmodel import Session
 
+from athlon_flex_notifier.metrics import COUNT_BUCKETS, Metrics
+
 
 class BaseView(BaseModel):
     """Pydantic model to hold rows in a view."""
 
     @classmethod
     @inject
-    def all(cls, database: Engine) -> list["BaseView"]:
+    def all(cls, database: Engine, metrics: Metrics) -> list["BaseView"]:
         """Get all rows of the view."""
-        query = f"SELECT * FROM {cls.view_name()}"  # noqa: S608
-        with Session(database) as session:
+        view_name = cls.view_name()
+        query = f"SELECT * FROM {view_name}"  # noqa: S608
+        with (
+            metrics.span("view", view=view_name) as span,
+            Session(database) as session,
+        ):
             query_result = session.exec(text(query)).all()
-            return [cls(**row._asdict()) for row in query_result]
+            rows = [cls(**row._asdict()) for row in query_result]
+            span.set(rows=len(rows))
+        metrics.observe("view_rows", len(rows), buckets=COUNT_BUCKETS, view=view_name)
+        return rows
 
     @staticmethod
     def view_name() -> str:
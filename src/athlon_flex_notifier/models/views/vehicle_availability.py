@@ -41,8 +41,7 @@ class VehicleAvailability(BaseView):
                 session.exec(
                     select(Vehicle)
                     .where(Vehicle.key_hash == self.vehicle_key_hash)
-                    .order_by(Vehicle.active_from.desc()),
-                    execution_options={"include_inactive": True},
+                    .order_by(Vehicle.active_from.desc())
                 ).unique()
             )
             if not vehicles:
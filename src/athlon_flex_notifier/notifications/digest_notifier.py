@@ -0,0 +1,58 @@
+from logging import Logger
+
+from kink import inject
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables.digest_item import DigestItem
+from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
+from athlon_flex_notifier.notifications.notifier import Notifier
+from athlon_flex_notifier.notifications.subscriber import Subscriber
+
+
+class DigestNotifier(Notifier):
+    """Notify by adding the availabilities to the next digest of each subscriber.
+
+    Nothing is sent here: the DigestScheduler sends the digests once they are due.
+    """
+
+    database: Engine
+    subscribers: list[Subscriber]
+
+    @inject
+    def __init__(
+        self,
+        availabilities_to_notify: list[VehicleAvailability],
+        logger: Logger,
+        database: Engine,
+        subscribers: list[Subscriber] | None = None,
+    ) -> None:
+        self.availabilities_to_notify = availabilities_to_notify
+        self.logger = logger
+        self.database = database
+        self.subscribers = (
+            subscribers if subscribers is not None else Subscriber.from_env()
+        )
+
+    def notify(self) -> bool:
+        with Session(self.database) as session:
+            DigestItem.enqueue(
+                session,
+                [subscriber.email for subscriber in self.subscribers],
+                [
+                    {
+                        "vehicle_key_hash": availability.vehicle_key_hash,
+                        "make": availability.make,
+                        "model": availability.model,
+                        "available_since": availability.available_since,
+                    }
+                    for availability in self.availabilities_to_notify
+                ],
+            )
+            session.commit()
+        self.logger.info(
+            "Added %s availabilities to the digests of %s subscribers",
+            len(self.availabilities_to_notify),
+            len(self.subscribers),
+        )
+        return True
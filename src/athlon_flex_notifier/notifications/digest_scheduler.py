@@ -0,0 +1,159 @@
+import smtplib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import ClassVar
+
+from kink import di, inject
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables.digest_item import DigestItem
+from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
+from athlon_flex_notifier.notifications.email_notifier import EmailNotifier
+from athlon_flex_notifier.notifications.subscriber import Subscriber
+from athlon_flex_notifier.services.shard_locks import ShardLocks, shard_of
+from athlon_flex_notifier.utils import now, time_it
+
+
+@inject
+class DigestScheduler:
+    """Send each subscriber a digest of the vehicles that became available.
+
+    The DigestNotifier adds availabilities to the pending DigestItems of each
+    subscriber, across any number of notify runs and outbox drains. A digest is due
+    if a subscriber has pending items, its window elapsed since its last digest, and
+    it received less than max_per_day digests in the last 24 hours. Otherwise the
+    items remain pending, and are coalesced into the next digest. The number of
+    emails per subscriber is therefor bounded, and no vehicle is left out.
+
+    Due subscribers with the same items share a digest: it is rendered once, and
+    sent to all of them in one SMTP call. All digests of a run are sent over one
+    SMTP connection, which is only opened if a digest is due.
+
+    The items are claimed with FOR UPDATE SKIP LOCKED, and marked sent in the same
+    transaction. If sending fails, all items of the run remain pending and are
+    retried by the next run, such that a digest may be sent twice but never lost.
+    The SMTP connection times out (see bootstrap._smpt_server), such that a hanging
+    server does not keep the transaction open.
+
+    The listener and the send_digests flow may run at the same time. Each run
+    therefor first claims an advisory lock per subscriber, which is held until its
+    transaction ends. The window check, the claim, the send and marking the items
+    sent are thereby done by one run at a time per subscriber; other runs skip the
+    subscriber. Otherwise, two runs could both find a subscriber due, and each send
+    it a digest of the items it claimed.
+    """
+
+    # Sent items are kept for a while, the last 24 hours are needed for rate limits
+    RETENTION: ClassVar[timedelta] = timedelta(days=7)
+
+    logger: Logger
+    database: Engine
+    subscribers: list[Subscriber]
+    locks: ShardLocks
+
+    @inject
+    def __init__(
+        self,
+        logger: Logger,
+        database: Engine,
+        subscribers: list[Subscriber] | None = None,
+    ) -> None:
+        self.logger = logger
+        self.database = database
+        self.subscribers = (
+            subscribers if subscribers is not None else Subscriber.from_env()
+        )
+        self.locks = ShardLocks(namespace="digest")
+
+    def send(self) -> int:
+        """Send the digests that are due.
+
+        Returns
+        -------
+        int, the number of subscribers a digest was sent to
+
+        """
+        with time_it("Sending digests"), Session(self.database) as session:
+            sent_at = now()
+            due = {
+                subscriber.email: items
+                for subscriber in self.subscribers
+                if self._claim(session, subscriber)
+                and self._is_due(session, subscriber, sent_at)
+                and (items := DigestItem.claim_pending(session, subscriber.email))
+            }
+            if due:
+                digests = self._coalesce(due)
+                with di[smtplib.SMTP] as server:
+                    for recipients, items in digests:
+                        EmailNotifier(self._availabilities(items), server=server).send(
+                            server, recipients
+                        )
+                for items in due.values():
+                    for item in items:
+                        item.sent_at = sent_at
+                    session.add_all(items)
+                self.logger.info(
+                    "Sent digests to %s subscribers, in %s SMTP calls",
+                    len(due),
+                    len(digests),
+                )
+            else:
+                self.logger.info("No digests are due")
+            DigestItem.prune(session, sent_at - self.RETENTION)
+            session.commit()
+        return len(due)
+
+    def _claim(self, session: Session, subscriber: Subscriber) -> bool:
+        """Claim subscriber until the transaction of session ends, if not claimed."""
+        if self.locks.claim_for_transaction(session, shard_of(subscriber.email, 2**31)):
+            return True
+        self.logger.info("Digest of %s is sent by a concurrent run", subscriber.email)
+        return False
+
+    def _is_due(self, session: Session, subscriber: Subscriber, at: datetime) -> bool:
+        """Whether the window and the rate limit of subscriber allow a digest at at.
+
+        Does not check whether the subscriber has pending items.
+        """
+        sent = DigestItem.sent_since(session, subscriber.email, at - timedelta(days=1))
+        if len(sent) >= subscriber.max_per_day:
+            self.logger.debug("Rate limit of %s reached", subscriber.email)
+            return False
+        return not sent or at - sent[-1] >= subscriber.window
+
+    @staticmethod
+    def _coalesce(
+        due: dict[str, list[DigestItem]],
+    ) -> list[tuple[list[str], list[DigestItem]]]:
+        """Group the subscribers with the same items, such that each is sent once.
+
+        Returns
+        -------
+        list[tuple[list[str], list[DigestItem]]], the recipients and items of each
+            distinct digest
+
+        """
+        recipients: dict[frozenset, list[str]] = defaultdict(list)
+        for email, items in due.items():
+            recipients[
+                frozenset(
+                    (item.vehicle_key_hash, item.available_since) for item in items
+                )
+            ].append(email)
+        return [(emails, due[emails[0]]) for emails in recipients.values()]
+
+    @staticmethod
+    def _availabilities(items: list[DigestItem]) -> list[VehicleAvailability]:
+        return [
+            VehicleAvailability(
+                vehicle_key_hash=item.vehicle_key_hash,
+                make=item.make,
+                model=item.model,
+                available_since=item.available_since,
+                available_until=None,
+            )
+            for item in items
+        ]
@@ -28,19 +28,23 @@ class EmailNotifier(Notifier):
         self.server = server
 
     def notify(self) -> bool:
+        with self.server as server:
+            self.send(server, os.environ["EMAIL_TO"].split(","))
+        return True
+
+    def send(self, server: smtplib.SMTP, recipients: list[str]) -> None:
+        """Render the email once, and send it to all recipients in one SMTP call.
+
+        Multiple recipients are not disclosed to each other.
+        """
         message = MIMEMultipart()
         message["Subject"] = "Athlon: new vehicles available"
         message["From"] = os.environ["EMAIL_FROM"]
-        message["To"] = os.environ["EMAIL_TO"]
+        message["To"] = (
+            recipients[0] if len(recipients) == 1 else os.environ["EMAIL_FROM"]
+        )
         message.attach(MIMEText(self.renderer.render(), "html"))
-
-        with self.server as server:
-            server.sendmail(
-                os.environ["EMAIL_FROM"],
-                os.environ["EMAIL_TO"],
-                message.as_string(),
-            )
-        return True
+        server.sendmail(os.environ["EMAIL_FROM"], recipients, message.as_string())
 
     @property
     def renderer(self) -> Renderer:
@@ -0,0 +1,98 @@
+import json
+import select
+import time
+from logging import Logger
+
+from kink import inject
+from sqlalchemy import Engine
+
+from athlon_flex_notifier.models.tables.notification_outbox import NotificationOutbox
+from athlon_flex_notifier.notifications.digest_scheduler import DigestScheduler
+from athlon_flex_notifier.notifications.outbox_drainer import OutboxDrainer
+
+
+@inject
+class NotificationListener:
+    """Deliver notifications within seconds after a refresh commits.
+
+    Listens on NotificationOutbox.CHANNEL, on which the refresh publishes the key
+    hashes of newly available vehicles. The listener blocks until an event arrives,
+    then keeps collecting events for coalesce_seconds, such that all vehicles of one
+    refresh end up in one notification. It then drains the outbox, and sends the
+    digests that are due, see DigestScheduler. The outbox
+    remains the source of truth; events only wake up the listener. Therefor events
+    missed while the listener was not running are delivered at startup.
+
+    The database must use driver psycopg2, since the listener uses its notifies API.
+    """
+
+    logger: Logger
+    database: Engine
+    drainer: OutboxDrainer
+    scheduler: DigestScheduler
+
+    @inject
+    def __init__(
+        self,
+        logger: Logger,
+        database: Engine,
+        drainer: OutboxDrainer,
+        scheduler: DigestScheduler,
+    ) -> None:
+        self.logger = logger
+        self.database = database
+        self.drainer = drainer
+        self.scheduler = scheduler
+
+    def listen(
+        self, coalesce_seconds: float = 2.0, filters: dict | None = None
+    ) -> None:
+        """Listen forever, draining the outbox after each batch of events."""
+        connection = self.database.raw_connection()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.set_session(autocommit=True)
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NotificationOutbox.CHANNEL}")
+            self.logger.info("Listening on channel %s", NotificationOutbox.CHANNEL)
+            self._drain(filters)
+            while True:
+                key_hashes = self._wait_for_events(dbapi_connection, coalesce_seconds)
+                self.logger.info(
+                    "Received %s newly available vehicles", len(key_hashes)
+                )
+                self._drain(filters)
+        finally:
+            connection.close()
+
+    def _wait_for_events(
+        self, dbapi_connection: object, coalesce_seconds: float
+    ) -> set[str]:
+        """Block until an event arrives, then coalesce events for coalesce_seconds.
+
+        Returns
+        -------
+        set[str], the key hashes received in all coalesced events
+
+        """
+        key_hashes = set()
+        # Block without timeout untill the first event arrives
+        select.select([dbapi_connection], [], [])
+        deadline = time.monotonic() + coalesce_seconds
+        while True:
+            dbapi_connection.poll()
+            while dbapi_connection.notifies:
+                event = dbapi_connection.notifies.pop(0)
+                key_hashes.update(json.loads(event.payload))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return key_hashes
+            select.select([dbapi_connection], [], [], remaining)
+
+    def _drain(self, filters: dict | None) -> None:
+        """Drain the outbox and send due digests. Failures are retried later."""
+        try:
+            self.drainer.drain(filters=filters)
+            self.scheduler.send()
+        except Exception:
+            self.logger.exception("Failed to drain the outbox")
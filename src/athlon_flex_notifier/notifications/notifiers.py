@@ -3,53 +3,95 @@ from logging import Logger
 
 from kink import inject
 
+from athlon_flex_notifier.metrics import Metrics
 from athlon_flex_notifier.models.tables.notification import Notification
 from athlon_flex_notifier.models.tables.vehicle_cluster import VehicleCluster
 from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
 from athlon_flex_notifier.notifications.console_notifier import ConsoleNotifier
-from athlon_flex_notifier.notifications.email_notifier import EmailNotifier
+from athlon_flex_notifier.notifications.digest_notifier import DigestNotifier
 from athlon_flex_notifier.notifications.notifier import Notifier
 from athlon_flex_notifier.services.filter_service import FilterService
+from athlon_flex_notifier.services.shard_locks import ShardLocks
 from athlon_flex_notifier.upserter import Upserter
 
 
 class Notifiers:
-    """Run multiple notifiers, and mark all notified."""
+    """Run multiple notifiers, and mark all notified.
+
+    Emails are not sent here: the availabilities are added to the digests of the
+    subscribers, which the DigestScheduler sends.
+
+    The notify flow and the OutboxDrainer both notify. Finding the availabilities
+    that are not yet notified, notifying and marking them notified is therefor done
+    under an advisory lock, such that the two never notify the same availability.
+    """
+
+    LOCK = 0
 
     notifiers: list[Notifier]
     logger: Logger
+    metrics: Metrics
     upserter: Upserter
     filter_service: FilterService
+    locks: ShardLocks
     filters: dict | None
+    availabilities: list[VehicleAvailability] | None
 
     @inject
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         logger: Logger,
+        metrics: Metrics,
         upserter: Upserter,
         filter_service: FilterService,
         filters: dict | None = None,
+        availabilities: list[VehicleAvailability] | None = None,
     ) -> "Notifiers":
+        """Create the notifiers.
+
+        If availabilities is provided, notify about those that are not yet
+        notified. Otherwise, notify about all availabilities that are not yet
+        notified.
+        """
         self.logger = logger
+        self.metrics = metrics
         self.upserter = upserter
         self.filter_service = filter_service
+        self.locks = ShardLocks(namespace="notify")
         self.filters = filters
+        self.availabilities = availabilities
 
     def notify(self) -> bool:
-        if not self.vehicle_clusters:
-            self.logger.info("No new vehicles are available.")
-            return True
+        with self.locks.hold(self.LOCK):
+            if not self.vehicle_clusters:
+                self.logger.info("No new vehicles are available.")
+                return True
+
+            if all(self._send(notifier) for notifier in self.notifiers):
+                self._mark_notified()
+                return True
+            return False
 
-        if all(notifier.notify() for notifier in self.notifiers):
-            self._mark_notified()
-            return True
-        return False
+    def _send(self, notifier: Notifier) -> bool:
+        """Notify through notifier, recorded as span and counted by its outcome."""
+        name = type(notifier).__name__
+        with self.metrics.span(
+            "notifier.send",
+            notifier=name,
+            availabilities=len(self.availabilities_to_notify),
+        ) as span:
+            sent = notifier.notify()
+            span.set(sent=sent)
+        self.metrics.increment(
+            "notifications_sent_total", notifier=name, status="ok" if sent else "failed"
+        )
+        return sent
 
     @property
     def notifiers(self) -> list[Notifier]:
         return [
             ConsoleNotifier(self.availabilities_to_notify),
-            EmailNotifier(self.availabilities_to_notify),
+            DigestNotifier(self.availabilities_to_notify),
         ]
 
     def _mark_notified(self) -> None:
@@ -70,7 +112,22 @@ class Notifiers:
 
     @cached_property
     def availabilities_to_notify(self) -> list[VehicleAvailability]:
-        availabilities = VehicleAvailability.to_notify()
+        if self.availabilities is None:
+            availabilities = VehicleAvailability.to_notify()
+        else:
+            notified = {
+                notification.key_hash
+                for notification in Notification.get(
+                    key_hashes=[
+                        availability.key_hash for availability in self.availabilities
+                    ]
+                )
+            }
+            availabilities = [
+                availability
+                for availability in self.availabilities
+                if availability.key_hash not in notified
+            ]
         filtered_availabilities = self.filter_service.filter_vehicle_availabilities(
             availabilities, self.filters
         )
@@ -0,0 +1,108 @@
+from logging import Logger
+
+from kink import inject
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables.notification_outbox import NotificationOutbox
+from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
+from athlon_flex_notifier.notifications.notifiers import Notifiers
+from athlon_flex_notifier.utils import time_it
+
+
+@inject
+class OutboxDrainer:
+    """Deliver the notifications that are enqueued in the NotificationOutbox.
+
+    Pending rows are claimed in batches using FOR UPDATE SKIP LOCKED, in a short
+    transaction that records the claim. They are delivered through the Notifiers
+    outside of that transaction, and marked processed in a second short
+    transaction. No row locks are therefor held while delivering. Multiple drainers
+    can run concurrently, without claiming the same rows. Rows that failed
+    NotificationOutbox.MAX_ATTEMPTS times are dead letters, which are no longer
+    claimed.
+    """
+
+    logger: Logger
+    database: Engine
+
+    @inject
+    def __init__(self, logger: Logger, database: Engine) -> None:
+        self.logger = logger
+        self.database = database
+
+    def drain(self, batch_size: int = 50, filters: dict | None = None) -> int:
+        """Drain batches until the outbox is empty.
+
+        Returns
+        -------
+        int, the number of outbox rows that were processed
+
+        """
+        processed = 0
+        with time_it("Draining outbox"):
+            while processed_in_batch := self.drain_batch(batch_size, filters):
+                processed += processed_in_batch
+        self.logger.info("Processed %s outbox rows", processed)
+        with Session(self.database) as session:
+            dead_letters = NotificationOutbox.count_dead_letters(session)
+        if dead_letters:
+            self.logger.warning(
+                "%s outbox rows failed %s times, and are no longer retried",
+                dead_letters,
+                NotificationOutbox.MAX_ATTEMPTS,
+            )
+        return processed
+
+    def drain_batch(self, batch_size: int, filters: dict | None = None) -> int:
+        """Claim, deliver and mark processed one batch of pending rows.
+
+        Claiming increases the attempts of the rows. If delivery fails, the claim is
+        released and the error is raised. The rows remain pending, and will be
+        retried by the next drain, until they failed NotificationOutbox.MAX_ATTEMPTS
+        times. If the drainer dies while delivering, the rows are claimed again after
+        NotificationOutbox.CLAIM_TIMEOUT.
+        """
+        with Session(self.database) as session:
+            messages = NotificationOutbox.claim_pending(session, batch_size)
+            ids = [message.id for message in messages]
+            availabilities = self._availabilities(messages)
+            session.commit()
+        if not ids:
+            return 0
+        try:
+            delivered = Notifiers(
+                filters=filters, availabilities=availabilities
+            ).notify()
+            if not delivered:
+                msg = f"Failed to deliver {len(availabilities)} notifications"
+                raise RuntimeError(msg)  # noqa: TRY301
+        except Exception:
+            with Session(self.database) as session:
+                NotificationOutbox.release(session, ids)
+                session.commit()
+            raise
+        with Session(self.database) as session:
+            NotificationOutbox.mark_processed(session, ids)
+            session.commit()
+        return len(ids)
+
+    @staticmethod
+    def _availabilities(
+        messages: list[NotificationOutbox],
+    ) -> list[VehicleAvailability]:
+        """Convert messages to availabilities.
+
+        Availabilities that were notified before, for example by the notify flow or
+        by a drain that failed after sending, are skipped by the Notifiers.
+        """
+        return [
+            VehicleAvailability(
+                vehicle_key_hash=message.vehicle_key_hash,
+                make=message.make,
+                model=message.model,
+                available_since=message.available_since,
+                available_until=None,
+            )
+            for message in messages
+        ]
@@ -0,0 +1,55 @@
+import json
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+
+
+@dataclass(frozen=True)
+class Subscriber:
+    """A recipient of digests, with its own window and rate limit.
+
+    Attributes:
+        email: str
+            The address to which digests are sent.
+        window: timedelta
+            The minimum time between two digests.
+        max_per_day: int
+            The maximum number of digests in any 24 hours.
+
+    """
+
+    email: str
+    window: timedelta
+    max_per_day: int
+
+    @classmethod
+    def from_env(cls) -> list["Subscriber"]:
+        """Get the subscribers from the environment.
+
+        EMAIL_TO is a comma-separated list of addresses, which get
+        DIGEST_WINDOW_MINUTES and DIGEST_MAX_PER_DAY. DIGEST_SUBSCRIBERS is a JSON
+        object with per address overrides, for example
+        {"me@example.com": {"window_minutes": 15, "max_per_day": 24}}. Addresses in
+        DIGEST_SUBSCRIBERS that are not in EMAIL_TO are subscribed as well.
+        """
+        window_minutes = float(os.getenv("DIGEST_WINDOW_MINUTES", "60"))
+        max_per_day = int(os.getenv("DIGEST_MAX_PER_DAY", "12"))
+        overrides: dict[str, dict] = json.loads(os.getenv("DIGEST_SUBSCRIBERS", "{}"))
+        emails = [
+            email.strip()
+            for email in os.getenv("EMAIL_TO", "").split(",")
+            if email.strip()
+        ]
+        emails += [email for email in overrides if email not in emails]
+        return [
+            cls(
+                email=email,
+                window=timedelta(
+                    minutes=overrides.get(email, {}).get(
+                        "window_minutes", window_minutes
+                    )
+                ),
+                max_per_day=overrides.get(email, {}).get("max_per_day", max_per_day),
+            )
+            for email in emails
+        ]
@@ -1,36 +1,398 @@
+import os
+import random
+from dataclasses import dataclass
 from logging import Logger
+from uuid import UUID
 
 from athlon_flex_client import AthlonFlexClient
 from athlon_flex_client.models.filters.vehicle_cluster_filter import AllVehicleClusters
-from athlon_flex_client.models.vehicle_cluster import DetailLevel
-from kink import inject
+from athlon_flex_client.models.vehicle_cluster import (
+    DetailLevel,
+    VehicleClusters,
+)
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+from kink import di, inject
+from prefect import Task
 
+from athlon_flex_notifier.metrics import Metrics
+from athlon_flex_notifier.models.tables.refresh_fingerprint import RefreshFingerprint
+from athlon_flex_notifier.models.tables.vehicle import Vehicle
 from athlon_flex_notifier.models.tables.vehicle_cluster import VehicleCluster
-from athlon_flex_notifier.utils import time_it
+from athlon_flex_notifier.services.cluster_detail_fetcher import ClusterDetailFetcher
+from athlon_flex_notifier.services.pipeline import Pipeline
+from athlon_flex_notifier.services.shard_locks import ShardLocks, shard_of
+from athlon_flex_notifier.services.snapshot_archive import Snapshot, SnapshotArchive
+from athlon_flex_notifier.stages import run_stage
+from athlon_flex_notifier.upserter import Upserter
+from athlon_flex_notifier.utils import now, time_it
+
+
+@dataclass
+class MappedCluster:
+    """A loaded cluster, mapped and ready to be written."""
+
+    key: str
+    fingerprint: str
+    key_hash: str
+    vehicles: dict[str, Vehicle]
 
 
 @inject
 class Refresher:
     """Service to refresh the database.
 
-    Uses the AthlonFlexClient to load all currently available
-    clusters and vehicles. from_bases will upsert the clusters and vehicles
-    SCD2.
+    Uses the AthlonFlexClient to load all currently available clusters. The
+    ClusterDetailFetcher then loads the vehicles of the clusters concurrently. Each
+    cluster flows through a Pipeline as soon as its vehicles are loaded: it is mapped
+    and hashed in one thread, and stored in another, as a partial load scoped to
+    that cluster. Loading, mapping and storing therefor overlap. The clusters,
+    vehicles and options are upserted SCD2. Responses that did not change since the
+    last refresh are skipped. All responses are archived in the SnapshotArchive.
+
+    Loading the summaries, storing the clusters and each upsert batch of a cluster
+    run as stages, see stages.run_stage. Storing stages are retried stage_retries
+    times, stage_retry_delay seconds apart. If the flow run is retried, completed
+    stages are not repeated: their results are reused.
+
+    The clusters are partitioned into shards, by a hash of their key, or of their
+    make if shard_by_make. Each shard is claimed with an advisory lock (see
+    ShardLocks) before its vehicles are loaded and stored. Concurrent refreshes, for
+    example by several workers, therefor each take the shards that are not claimed
+    yet, and never write the same rows at the same time.
     """
 
     client: AthlonFlexClient
     logger: Logger
+    fetcher: ClusterDetailFetcher
+    upserter: Upserter
+    archive: SnapshotArchive
+    locks: ShardLocks
+    metrics: Metrics
+    queue_size: int
+    stage_retries: int
+    stage_retry_delay: float
+    shards: int
+    shard_by_make: bool
+    fingerprints: dict[str, str]
+    cluster_ids: dict[str, UUID]
+    skipped_clusters: int
+    archived_clusters: list[str]
 
     @inject
-    def __init__(self, client: AthlonFlexClient, logger: Logger) -> None:
+    def __init__(  # noqa: PLR0913
+        self,
+        client: AthlonFlexClient,
+        logger: Logger,
+        fetcher: ClusterDetailFetcher,
+        upserter: Upserter,
+        archive: SnapshotArchive,
+        locks: ShardLocks,
+        metrics: Metrics,
+        queue_size: int = 8,
+        stage_retries: int = 2,
+        stage_retry_delay: float = 5.0,
+        shards: int = 1,
+        *,
+        shard_by_make: bool = False,
+    ) -> None:
         self.client = client
         self.logger = logger
+        self.fetcher = fetcher
+        self.upserter = upserter
+        self.archive = archive
+        self.locks = locks
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self.stage_retries = stage_retries
+        self.stage_retry_delay = stage_retry_delay
+        self.shards = shards
+        self.shard_by_make = shard_by_make
+
+    def refresh(self, *, incremental: bool = False) -> None:
+        """Refresh all clusters, vehicles and options.
+
+        - Load the cluster summaries, which requires a single request
+        - Upsert the clusters, and close the vehicles of deleted clusters. This is a
+          full load of the clusters, that runs in one refresh at a time
+        - For each shard that is not claimed by a concurrent refresh: load the
+          vehicles including details of each of its clusters, and store them
+
+        If incremental, only the vehicles of clusters whose summary changed since the
+        last refresh are loaded. Note that a vehicle change that does not affect the
+        summary of its cluster (for example a price change of a vehicle that is not
+        the cheapest) is then not detected. A full refresh picks up such changes.
+
+        The summaries and each cluster are fingerprinted, see RefreshFingerprint.
+        Responses with the same fingerprint as in the last successful refresh are not
+        mapped, hashed or upserted. The summary fingerprint is only stored if this
+        refresh stored all shards, since a shard that is claimed by a concurrent
+        refresh may still fail.
+
+        Raises
+        ------
+        RuntimeError, if the vehicles of any cluster could not be loaded. All other
+            clusters are stored.
+
+        """
+        taken_at = now()
+        self.logger.debug("Loading cluster summaries...")
+        with time_it("Loading cluster summaries"):
+            base_clusters = run_stage(
+                "Loading cluster summaries",
+                "",
+                lambda: self.client.vehicle_clusters(
+                    detail_level=DetailLevel.CLUSTER_ONLY,
+                    filter_=AllVehicleClusters(),
+                ),
+            )
+        summary_fingerprint = self.archive.put(base_clusters)
+        with self.locks.hold(ShardLocks.COORDINATOR):
+            self.fingerprints = RefreshFingerprint.load()
+            summary_unchanged = (
+                self.fingerprints.get(RefreshFingerprint.SUMMARY_KEY)
+                == summary_fingerprint
+            )
+            if summary_unchanged:
+                self.logger.info(
+                    "Cluster summaries unchanged, skipping clusters upsert"
+                )
+                self.cluster_ids = VehicleCluster.active_ids()
+                to_load = [] if incremental else base_clusters.vehicle_clusters
+            else:
+                to_load, self.cluster_ids = self._retried_stage()(
+                    "Storing clusters",
+                    f"{summary_fingerprint}/{incremental}",
+                    lambda: self._store_clusters(
+                        base_clusters, incremental=incremental
+                    ),
+                )
+        self.skipped_clusters = 0
+        self.archived_clusters = []
+        failed: list[VehicleClusterBase] = []
+        unclaimed: list[int] = []
+        claimed_clusters = 0
+        with time_it("Loading and storing clusters") as span:
+            span.set(clusters=len(to_load), shards=self.shards)
+            for shard, clusters in self._shard(to_load):
+                with self.locks.claim(shard) as claimed:
+                    if not claimed:
+                        self.logger.info(
+                            "Shard %s is claimed by a concurrent refresh, skipping",
+                            shard,
+                        )
+                        unclaimed.append(shard)
+                        continue
+                    claimed_clusters += len(clusters)
+                    failed += self._load_and_store(shard, clusters)
+        self._record_skips(
+            summary_unchanged=summary_unchanged,
+            clusters=claimed_clusters,
+            incremental=incremental,
+        )
+        self.archive.record(
+            Snapshot(
+                taken_at=taken_at,
+                summary=summary_fingerprint,
+                clusters=self.archived_clusters,
+                partial=incremental or bool(failed) or bool(unclaimed),
+            )
+        )
+        if failed:
+            msg = "Failed to load clusters: " + ", ".join(
+                f"{base_cluster.make} {base_cluster.model}" for base_cluster in failed
+            )
+            raise RuntimeError(msg)
+        if not summary_unchanged and not unclaimed:
+            RefreshFingerprint.store(
+                {RefreshFingerprint.SUMMARY_KEY: summary_fingerprint}
+            )
+
+    def _record_skips(
+        self, *, summary_unchanged: bool, clusters: int, incremental: bool
+    ) -> None:
+        """Log the skip ratios, and count the skipped and changed fingerprints.
+
+        The counter refresh_fingerprints_total is labeled by kind (summary or
+        cluster), outcome (skipped or changed) and mode (full or incremental) of the
+        refresh. The skip ratio of a kind is the rate of its skipped fingerprints,
+        divided by the rate of all its fingerprints.
+        """
+        self.logger.info(
+            "Skip ratio summaries: %.2f, clusters: %.2f (%s of %s)",
+            float(summary_unchanged),
+            self.skipped_clusters / clusters if clusters else 1.0,
+            self.skipped_clusters,
+            clusters,
+        )
+        mode = "incremental" if incremental else "full"
+        for kind, skipped, total in (
+            ("summary", int(summary_unchanged), 1),
+            ("cluster", self.skipped_clusters, clusters),
+        ):
+            self.metrics.increment(
+                "refresh_fingerprints_total",
+                skipped,
+                kind=kind,
+                outcome="skipped",
+                mode=mode,
+            )
+            self.metrics.increment(
+                "refresh_fingerprints_total",
+                total - skipped,
+                kind=kind,
+                outcome="changed",
+                mode=mode,
+            )
+
+    def _shard(
+        self, clusters: list[VehicleClusterBase]
+    ) -> list[tuple[int, list[VehicleClusterBase]]]:
+        """Partition clusters into shards.
 
-    def refresh(self) -> None:
-        self.logger.debug("Loading clusters...")
-        with time_it("Loading clusters"):
-            base_clusters = self.client.vehicle_clusters(
-                detail_level=DetailLevel.INCLUDE_VEHICLE_DETAILS,
-                filter_=AllVehicleClusters(),
+        The shards are ordered from a random shard on, such that concurrent
+        refreshes start at different shards. Empty shards are left out.
+        """
+        sharded: dict[int, list[VehicleClusterBase]] = {}
+        for base_cluster in clusters:
+            key = (
+                base_cluster.make
+                if self.shard_by_make
+                else RefreshFingerprint.cluster_key(
+                    base_cluster.make, base_cluster.model
+                )
             )
-        VehicleCluster.store_api_response(base_clusters)
+            sharded.setdefault(shard_of(key, self.shards), []).append(base_cluster)
+        start = random.randrange(self.shards)  # noqa: S311
+        return sorted(sharded.items(), key=lambda item: (item[0] - start) % self.shards)
+
+    def _load_and_store(
+        self, shard: int, clusters: list[VehicleClusterBase]
+    ) -> list[VehicleClusterBase]:
+        """Load and store the vehicles of the clusters of a claimed shard.
+
+        The fingerprints are reloaded, since a concurrent refresh may have stored
+        the shard since they were loaded.
+
+        Returns
+        -------
+        list[VehicleClusterBase], the clusters that could not be loaded
+
+        """
+        self.fingerprints = RefreshFingerprint.load()
+        with (
+            time_it("Loading and storing shard") as span,
+            Pipeline(
+                self.logger,
+                [("map", self._map_cluster), ("write", self._write_cluster)],
+                maxsize=self.queue_size,
+                producer_name="fetch",
+            ) as pipeline,
+        ):
+            span.set(shard=shard, clusters=len(clusters))
+            return self.fetcher.fetch(clusters, consumer=pipeline.put)
+
+    def _store_clusters(
+        self, base_clusters: VehicleClusters, *, incremental: bool
+    ) -> tuple[list[VehicleClusterBase], dict[str, UUID]]:
+        """Upsert the clusters, and close the vehicles of deleted clusters.
+
+        The summary fingerprint is invalidated first, and the fingerprints of deleted
+        clusters are removed.
+
+        Returns
+        -------
+        list[VehicleClusterBase], the clusters of which the vehicles must be loaded
+        dict[str, UUID], the ids of the upserted clusters by key hash
+
+        """
+        RefreshFingerprint.invalidate([RefreshFingerprint.SUMMARY_KEY])
+        clusters = [
+            (VehicleCluster.create_by_api_response(base_cluster), base_cluster)
+            for base_cluster in base_clusters.vehicle_clusters
+        ]
+        current_key_hashes = {cluster.compute_key_hash() for cluster, _ in clusters}
+        changed_key_hashes = VehicleCluster.changed_key_hashes(
+            [cluster for cluster, _ in clusters]
+        )
+        self.logger.info(
+            "%s of %s clusters changed", len(changed_key_hashes), len(clusters)
+        )
+        with time_it("Upserting clusters"):
+            cluster_ids = {
+                key_hash: cluster.id
+                for key_hash, cluster in self.upserter.upsert(
+                    [cluster for cluster, _ in clusters]
+                ).items()
+            }
+        deleted_key_hashes = changed_key_hashes - current_key_hashes
+        if deleted_key_hashes:
+            VehicleCluster.store_vehicles(
+                {}, cluster_ids, scope_key_hashes=deleted_key_hashes
+            )
+        current_keys = {
+            RefreshFingerprint.cluster_key(base_cluster.make, base_cluster.model)
+            for base_cluster in base_clusters.vehicle_clusters
+        }
+        RefreshFingerprint.invalidate(
+            self.fingerprints.keys() - current_keys - {RefreshFingerprint.SUMMARY_KEY}
+        )
+        return [
+            base_cluster
+            for cluster, base_cluster in clusters
+            if not incremental or cluster.compute_key_hash() in changed_key_hashes
+        ], cluster_ids
+
+    def _map_cluster(self, base_cluster: VehicleClusterBase) -> MappedCluster | None:
+        """Map and hash the vehicles of one loaded cluster.
+
+        Runs in the map stage of the pipeline, without accessing the database. The
+        response is archived, and its content hash is used as fingerprint.
+        Returns None if the cluster has the same fingerprint as when it was last
+        stored, such that it is skipped.
+        """
+        key = RefreshFingerprint.cluster_key(base_cluster.make, base_cluster.model)
+        fingerprint = self.archive.put(base_cluster)
+        self.archived_clusters.append(fingerprint)
+        if self.fingerprints.get(key) == fingerprint:
+            self.skipped_clusters += 1
+            return None
+        cluster = VehicleCluster.create_by_api_response(base_cluster)
+        key_hash = cluster.compute_key_hash()
+        return MappedCluster(
+            key=key,
+            fingerprint=fingerprint,
+            key_hash=key_hash,
+            vehicles=VehicleCluster.map_vehicles({key_hash: cluster}, self.cluster_ids),
+        )
+
+    def _write_cluster(self, mapped: MappedCluster) -> None:
+        """Upsert the vehicles of one mapped cluster, scoped to that cluster.
+
+        Runs in the write stage of the pipeline. Each batch is a stage, keyed by the
+        fingerprint of the cluster.
+        """
+        RefreshFingerprint.invalidate([mapped.key])
+        for batch in VehicleCluster.upsert_batches(
+            mapped.vehicles, scope_key_hashes=[mapped.key_hash]
+        ):
+            self._retried_stage()(
+                batch.name, f"{mapped.key}/{mapped.fingerprint}", batch.upsert
+            )
+        RefreshFingerprint.store({mapped.key: mapped.fingerprint})
+
+    def _retried_stage(self) -> Task:
+        """Get run_stage, retrying stage_retries times."""
+        return run_stage.with_options(
+            retries=self.stage_retries, retry_delay_seconds=self.stage_retry_delay
+        )
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di.factories[Refresher] = lambda _: Refresher(
+    stage_retries=int(os.getenv("REFRESH_STAGE_RETRIES", "2")),
+    stage_retry_delay=float(os.getenv("REFRESH_STAGE_RETRY_DELAY", "5")),
+    shards=int(os.getenv("REFRESH_SHARDS", "1")),
+    shard_by_make=os.getenv("REFRESH_SHARD_BY", "cluster") == "make",
+)
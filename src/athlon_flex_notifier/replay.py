@@ -0,0 +1,22 @@
+import argparse
+from datetime import datetime
+
+from kink import di
+
+from athlon_flex_notifier.replayer import Replayer
+
+parser = argparse.ArgumentParser(
+    description="Rebuild or backfill the database from the snapshot archive."
+)
+parser.add_argument(
+    "--since",
+    type=datetime.fromisoformat,
+    help="Only replay snapshots taken at or after this ISO timestamp, with timezone.",
+)
+parser.add_argument(
+    "--until",
+    type=datetime.fromisoformat,
+    help="Only replay snapshots taken at or before this ISO timestamp, with timezone.",
+)
+arguments = parser.parse_args()
+di[Replayer].replay(since=arguments.since, until=arguments.until)
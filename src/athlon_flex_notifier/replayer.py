@@ -0,0 +1,144 @@
+import time
+from datetime import datetime
+from logging import Logger
+
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+from athlon_flex_client.models.vehicle_cluster import VehicleClusters
+from kink import inject
+
+from athlon_flex_notifier.models.tables.refresh_fingerprint import RefreshFingerprint
+from athlon_flex_notifier.models.tables.vehicle_cluster import VehicleCluster
+from athlon_flex_notifier.services.snapshot_archive import Snapshot, SnapshotArchive
+from athlon_flex_notifier.upserter import Upserter
+
+
+@inject
+class Replayer:
+    """Service to rebuild or backfill the database from the SnapshotArchive.
+
+    Snapshots are replayed in chronological order, through
+    VehicleCluster.store_api_response, with the timestamp of the snapshot. The SCD2
+    history therefor looks as if the refreshes ran at the original times. No
+    notifications are enqueued for replayed vehicles.
+
+    Replay keeps track of the content hash of each cluster. Only the clusters of
+    which the content changed since the previous snapshot are decompressed and
+    upserted, as a partial load. Snapshots in which nothing changed are skipped.
+
+    Replay is meant for an empty database, or to backfill a period before the
+    oldest row. Replaying a period before rows that already exist, corrupts their
+    history.
+    """
+
+    logger: Logger
+    archive: SnapshotArchive
+    upserter: Upserter
+    summary_hash: str | None
+    cluster_key_hashes: dict[tuple[str, str], str]
+    summaries: dict[str, VehicleClusterBase]
+    cluster_hashes: dict[str, str]
+
+    @inject
+    def __init__(
+        self, logger: Logger, archive: SnapshotArchive, upserter: Upserter
+    ) -> None:
+        self.logger = logger
+        self.archive = archive
+        self.upserter = upserter
+
+    def replay(
+        self, since: datetime | None = None, until: datetime | None = None
+    ) -> int:
+        """Replay the snapshots taken between since and until, both inclusive.
+
+        Returns
+        -------
+        int, the number of snapshots that were replayed, excluding skipped ones
+
+        """
+        self.summary_hash = None
+        self.cluster_key_hashes = {}
+        self.summaries = {}
+        self.cluster_hashes = {}
+        start = time.perf_counter()
+        first = last = None
+        replayed = total = 0
+        for snapshot in self.archive.snapshots(since, until):
+            first = first or snapshot.taken_at
+            last = snapshot.taken_at
+            total += 1
+            replayed += self._replay(snapshot)
+        # The database no longer matches the fingerprints of the last refresh
+        RefreshFingerprint.invalidate(RefreshFingerprint.load().keys())
+        elapsed = time.perf_counter() - start
+        self.logger.info(
+            "Replayed %s of %s snapshots in %.2f seconds, covering %s",
+            replayed,
+            total,
+            elapsed,
+            (last - first) if first else "nothing",
+        )
+        return replayed
+
+    def _replay(self, snapshot: Snapshot) -> bool:
+        """Replay one snapshot, only upserting the clusters that changed.
+
+        Clusters that are archived, but are not in the summary of the snapshot, are
+        skipped: their vehicles can not be stored without their cluster.
+
+        Returns
+        -------
+        bool, False if nothing changed and the snapshot was skipped
+
+        """
+        summary_changed = snapshot.summary != self.summary_hash
+        if summary_changed:
+            self._load_summary(snapshot.summary)
+        changed = {}
+        current_hashes = set(self.cluster_hashes.values())
+        for content_hash in snapshot.clusters:
+            if content_hash in current_hashes:
+                # Content includes make and model, so the cluster is unchanged
+                continue
+            base_cluster = self.archive.get(content_hash, VehicleClusterBase)
+            key_hash = self.cluster_key_hashes.get(
+                (base_cluster.make, base_cluster.model)
+            )
+            if key_hash not in self.summaries:
+                self.logger.warning(
+                    "Skipping cluster %s %s of snapshot %s: not in its summary",
+                    base_cluster.make,
+                    base_cluster.model,
+                    snapshot.taken_at,
+                )
+                continue
+            changed[key_hash] = (content_hash, base_cluster)
+        deleted = self.cluster_hashes.keys() - self.summaries.keys()
+        if not summary_changed and not changed and not deleted:
+            return False
+        response = VehicleClusters(
+            vehicle_clusters=[
+                changed[key_hash][1] if key_hash in changed else summary
+                for key_hash, summary in self.summaries.items()
+            ]
+        )
+        with self.upserter.replaying(snapshot.taken_at):
+            VehicleCluster.store_api_response(
+                response, changed_key_hashes=changed.keys() | deleted
+            )
+        for key_hash in deleted:
+            del self.cluster_hashes[key_hash]
+        for key_hash, (content_hash, _) in changed.items():
+            self.cluster_hashes[key_hash] = content_hash
+        return True
+
+    def _load_summary(self, content_hash: str) -> None:
+        """Load the cluster summaries, and the key hashes of the clusters."""
+        self.summary_hash = content_hash
+        self.summaries = {}
+        for summary in self.archive.get(content_hash, VehicleClusters):
+            key_hash = VehicleCluster.create_by_api_response(summary).compute_key_hash()
+            self.summaries[key_hash] = summary
+            self.cluster_key_hashes[(summary.make, summary.model)] = key_hash
@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import os
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from logging import Logger
+from typing import Any, TypeVar
+
+from aiohttp import ClientError, ClientSession
+from athlon_flex_client import AthlonFlexClient
+from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+from kink import di, inject
+from prefect.utilities.asyncutils import run_coro_as_sync
+
+from athlon_flex_notifier.stages import run_stage_async
+from athlon_flex_notifier.utils import TokenBucket
+
+T = TypeVar("T")
+
+
+@inject
+class ClusterDetailFetcher:
+    """Load the vehicles of clusters including details, concurrently.
+
+    Requests of all clusters run concurrently. At most max_concurrency requests are
+    in flight, and requests are rate limited to requests_per_second by a
+    TokenBucket. If loading a cluster fails, it is retried with exponential backoff.
+
+    Each cluster is passed to a consumer as soon as it is loaded. The consumer runs
+    in a single worker thread, such that storing one cluster overlaps with loading
+    the others. The total duration therefor depends on the slowest cluster, instead
+    of on the sum of all clusters. At most max_concurrency clusters are loaded or
+    waiting for the consumer, hence a slow consumer slows down loading.
+
+    The clusters are loaded on a new event loop in a dedicated thread, such that
+    fetch works regardless of whether the caller runs an event loop itself.
+    """
+
+    client: AthlonFlexClient
+    logger: Logger
+    max_concurrency: int
+    requests_per_second: float
+    max_retries: int
+    backoff_seconds: float
+
+    @inject
+    def __init__(  # noqa: PLR0913
+        self,
+        client: AthlonFlexClient,
+        logger: Logger,
+        max_concurrency: int = 8,
+        requests_per_second: float = 20,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+    ) -> None:
+        self.client = client
+        self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def fetch(
+        self,
+        base_clusters: list[VehicleClusterBase],
+        consumer: Callable[[VehicleClusterBase], None],
+    ) -> list[VehicleClusterBase]:
+        """Load all clusters, and call consumer for each loaded cluster.
+
+        Returns
+        -------
+        list[VehicleClusterBase], the clusters that could not be loaded
+
+        """
+        return run_coro_as_sync(
+            self._fetch(base_clusters, consumer), force_new_thread=True
+        )
+
+    async def _fetch(
+        self,
+        base_clusters: list[VehicleClusterBase],
+        consumer: Callable[[VehicleClusterBase], None],
+    ) -> list[VehicleClusterBase]:
+        requests = asyncio.Semaphore(self.max_concurrency)
+        clusters = asyncio.Semaphore(self.max_concurrency)
+        bucket = TokenBucket(self.requests_per_second, capacity=self.max_concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def fetch_and_consume(base_cluster: VehicleClusterBase) -> bool:
+            # A cluster holds its slot until it is consumed. If the consumer blocks,
+            # no new clusters are loaded (back-pressure).
+            async with clusters:
+                try:
+                    base_cluster.vehicles = await run_stage_async(
+                        "Loading cluster",
+                        f"{base_cluster.make}/{base_cluster.model}",
+                        lambda: self._fetch_with_retry(base_cluster, requests, bucket),
+                    )
+                except (ClientError, asyncio.TimeoutError):
+                    return False
+                # Copy the context, such that the consumer can use the flow logger
+                await loop.run_in_executor(
+                    executor, contextvars.copy_context().run, consumer, base_cluster
+                )
+                return True
+
+        async with self._session():
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                succeeded = await asyncio.gather(
+                    *[fetch_and_consume(base_cluster) for base_cluster in base_clusters]
+                )
+        return [
+            base_cluster
+            for base_cluster, loaded in zip(base_clusters, succeeded, strict=True)
+            if not loaded
+        ]
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncGenerator[None]:
+        """Let the client use a session of the running loop, sharing its cookies.
+
+        An aiohttp session can only be used in the loop it was created in, and the
+        session of the client was created in the loop of the thread that created
+        the client.
+        """
+        client_session = self.client.session
+        async with ClientSession(cookie_jar=client_session.cookie_jar) as session:
+            self.client.session = session
+            try:
+                yield
+            finally:
+                self.client.session = client_session
+
+    async def _fetch_with_retry(
+        self,
+        base_cluster: VehicleClusterBase,
+        semaphore: asyncio.Semaphore,
+        bucket: TokenBucket,
+    ) -> list[VehicleBase]:
+        """Load the vehicles of one cluster, retrying with exponential backoff.
+
+        Runs as stage, see stages.run_stage: a retry of the flow run does not load
+        the cluster again.
+
+        Returns
+        -------
+        list[VehicleBase], the vehicles including details
+
+        Raises
+        ------
+        ClientError or TimeoutError, if the last retry failed
+
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._fetch_cluster(base_cluster, semaphore, bucket)
+            except (ClientError, asyncio.TimeoutError) as e:  # noqa: PERF203
+                if attempt == self.max_retries:
+                    self.logger.exception(
+                        "Failed to load cluster %s %s",
+                        base_cluster.make,
+                        base_cluster.model,
+                    )
+                    raise
+                delay = self.backoff_seconds * 2**attempt
+                self.logger.warning(
+                    "Loading cluster %s %s failed (%s), retrying in %s seconds",
+                    base_cluster.make,
+                    base_cluster.model,
+                    e,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+        return []
+
+    async def _fetch_cluster(
+        self,
+        base_cluster: VehicleClusterBase,
+        semaphore: asyncio.Semaphore,
+        bucket: TokenBucket,
+    ) -> list[VehicleBase]:
+        """Load the vehicles and their details of one cluster.
+
+        Equivalent to DetailLevel.INCLUDE_VEHICLE_DETAILS for AllVehicleClusters.
+        """
+        vehicles = await self._request(
+            semaphore,
+            bucket,
+            self.client.vehicles_async,
+            base_cluster.make,
+            base_cluster.model,
+            filter_vehicles_by_profile=False,
+        )
+        return await asyncio.gather(
+            *[
+                self._request(
+                    semaphore, bucket, self.client.vehicle_details_async, vehicle
+                )
+                for vehicle in vehicles
+            ]
+        )
+
+    async def _request(
+        self,
+        semaphore: asyncio.Semaphore,
+        bucket: TokenBucket,
+        request: Callable[..., Awaitable[T]],
+        *args: Any,  # noqa: ANN401
+        **kwargs: Any,  # noqa: ANN401
+    ) -> T:
+        async with semaphore:
+            await bucket.acquire()
+            return await request(*args, **kwargs)
+
+
+def _athlon_client_class() -> type[AthlonFlexClient]:
+    """Get the client class, calling ATHLON_BASE_URL if set.
+
+    The base URL is a class variable, that is used while constructing the client
+    (to login). It is therefor overridden in a subclass. Used to call the fake API,
+    see services.fake_athlon_api.
+    """
+    base_url = os.getenv("ATHLON_BASE_URL")
+    if not base_url:
+        return AthlonFlexClient
+    return type(
+        "AthlonFlexClient", (AthlonFlexClient,), {"BASE_URL": base_url.rstrip("/")}
+    )
+
+
+# Registered here instead of in bootstrap, such that the client is only imported
+# when used, see bootstrap.bootstrap_di
+di[AthlonFlexClient] = lambda _: _athlon_client_class()(
+    email=os.getenv("ATHLON_USERNAME", None),
+    password=os.getenv("ATHLON_PASSWORD", None),
+    gross_yearly_income=os.getenv("GROSS_YEARLY_INCOME", None),
+    apply_loonheffingskorting=os.getenv("APPLY_LOONHEFFINGSKORTING", "true") == "true",
+)
+# Use factory, such that the fetcher uses the logger of the current run
+di.factories[ClusterDetailFetcher] = lambda _: ClusterDetailFetcher(
+    max_concurrency=int(os.getenv("REFRESH_MAX_CONCURRENCY", "8")),
+    requests_per_second=float(os.getenv("REFRESH_REQUESTS_PER_SECOND", "20")),
+    max_retries=int(os.getenv("REFRESH_MAX_RETRIES", "3")),
+)
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import random
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import datetime
+from logging import Logger
+
+from aiohttp import web
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+from kink import inject
+
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+from athlon_flex_notifier.services.snapshot_archive import SnapshotArchive
+
+PREFIX = "/api/v1"
+TAX_RATES = [
+    {
+        "label": "Met loonheffingskorting jaarinkomen € 0 t/m € 75.518",
+        "percentage": 36.97,
+    },
+    {
+        "label": "Met loonheffingskorting jaarinkomen € 75.519 of meer",
+        "percentage": 49.5,
+    },
+]
+PROFILE = {
+    "id": "fake-profile",
+    "initials": "F.",
+    "firstName": "Fake",
+    "lastName": "Driver",
+    "phoneNumber": "0600000000",
+    "email": "fake@example.com",
+    "customerName": "Fake Customer",
+    "isConsumer": False,
+    "flexPlus": False,
+    "relationshipManager": {
+        "name": "Fake Manager",
+        "email": "manager@example.com",
+        "phone": "0600000001",
+    },
+    "requiresIncludeTaxInPrices": False,
+    "includeMileageCostsInPricing": True,
+    "includeFuelCostsInPricing": True,
+    "onlyShowNetMonthCosts": False,
+    "numberOfKmPerMonth": 1500,
+    "remainingSwaps": 2,
+    "budget": {
+        "actualBudgetPerMonth": 900,
+        "maxBudgetPerMonth": 1100,
+        "normBudgetPerMonth": 900,
+        "normBudgetGasolinePerMonth": 900,
+        "normBudgetElectricPerMonth": 900,
+        "maxBudgetGasolinePerMonth": 1100,
+        "maxBudgetElectricPerMonth": 1100,
+        "normUndershootPercentage": 0,
+        "maxNormUndershootPercentage": 0,
+        "savedBudget": 0,
+        "savedBudgetPayoutAllowed": False,
+        "holidayCarRaiseAllowed": False,
+    },
+    "firstReservationAllowedFromUtc": "2024-01-01T00:00:00Z",
+    "firstDeliveryAllowedFromUtc": "2024-01-01T00:00:00Z",
+}
+
+
+@dataclass
+class Catalog:
+    """The responses of the fake API, serialized once.
+
+    Attributes:
+        summaries: bytes
+            Response of VehicleCluster: the clusters, without vehicles.
+        variations: dict[tuple[str, str], bytes]
+            Responses of VehicleVariation per make and model: the vehicles of the
+            cluster, without details, pricing and options.
+        vehicles: dict[str, bytes]
+            Responses of Vehicle per vehicle id: the vehicle including details.
+
+    """
+
+    summaries: bytes
+    variations: dict[tuple[str, str], bytes]
+    vehicles: dict[str, bytes]
+
+    @classmethod
+    def from_clusters(
+        cls, clusters: list[VehicleClusterBase], padding: int = 0
+    ) -> "Catalog":
+        """Serialize clusters including vehicles and details.
+
+        Each vehicle response is padded with padding bytes, in an attribute the
+        client ignores, to simulate larger payloads.
+        """
+        pad = {"padding": "x" * padding} if padding else {}
+        variations = {}
+        vehicles = {}
+        for cluster in clusters:
+            variations[(cluster.make, cluster.model)] = json.dumps(
+                [
+                    vehicle.model_dump(
+                        mode="json", exclude={"details", "pricing", "options"}
+                    )
+                    for vehicle in cluster.vehicles or []
+                ]
+            ).encode()
+            for vehicle in cluster.vehicles or []:
+                vehicles[vehicle.id] = json.dumps(
+                    {**vehicle.model_dump(mode="json"), **pad}
+                ).encode()
+        return cls(
+            summaries=json.dumps(
+                [
+                    cluster.model_dump(mode="json", exclude={"vehicles"})
+                    for cluster in clusters
+                ]
+            ).encode(),
+            variations=variations,
+            vehicles=vehicles,
+        )
+
+    @classmethod
+    def from_simulator(cls, simulator: FleetSimulator, padding: int = 0) -> "Catalog":
+        """Serialize the current fleet of simulator."""
+        return cls.from_clusters(
+            simulator.vehicle_clusters().vehicle_clusters, padding=padding
+        )
+
+    @classmethod
+    def from_archive(
+        cls,
+        archive: SnapshotArchive,
+        until: datetime | None = None,
+        padding: int = 0,
+    ) -> "Catalog":
+        """Serialize the last complete snapshot in archive, taken at or before until.
+
+        Partial snapshots are skipped, since they only contain changed clusters.
+        """
+        snapshot = None
+        for candidate in archive.snapshots(until=until):
+            if not candidate.partial:
+                snapshot = candidate
+        if snapshot is None:
+            msg = "No complete snapshot found in the archive"
+            raise ValueError(msg)
+        return cls.from_clusters(
+            [
+                archive.get(content_hash, VehicleClusterBase)
+                for content_hash in snapshot.clusters
+            ],
+            padding=padding,
+        )
+
+
+@inject
+class FakeAthlonApi:
+    """Local stand-in for the Athlon Flex API, for load testing the refresh.
+
+    Serves the endpoints used by the AthlonFlexClient from a Catalog. Point the
+    client at it with ATHLON_BASE_URL=http://<host>:<port>/api/v1.
+
+    Each request is delayed by latency plus a uniform random jitter (seconds), and
+    fails with 503 Service Unavailable with probability error_rate. If a simulator
+    is provided and advance_every is set, the fleet changes every advance_every
+    seconds, see FleetSimulator.advance. GET /stats returns the number of requests
+    and errors per endpoint.
+    """
+
+    catalog: Catalog
+    logger: Logger
+    latency: float
+    jitter: float
+    error_rate: float
+    simulator: FleetSimulator | None
+    advance_every: float | None
+    padding: int
+    requests: Counter[str]
+    errors: Counter[str]
+
+    @inject
+    def __init__(  # noqa: PLR0913
+        self,
+        catalog: Catalog,
+        logger: Logger,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        simulator: FleetSimulator | None = None,
+        advance_every: float | None = None,
+        padding: int = 0,
+        seed: int = 0,
+    ) -> None:
+        self.catalog = catalog
+        self.logger = logger
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.simulator = simulator
+        self.advance_every = advance_every
+        self.padding = padding
+        self.random = random.Random(seed)  # noqa: S311
+        self.requests = Counter()
+        self.errors = Counter()
+
+    def app(self) -> web.Application:
+        """Create the aiohttp application."""
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes(
+            [
+                web.post(f"{PREFIX}/MemberLogin", self._login),
+                web.get(f"{PREFIX}/MemberProfile", self._profile),
+                web.get(f"{PREFIX}/TaxRates", self._tax_rates),
+                web.get(f"{PREFIX}/VehicleCluster", self._vehicle_clusters),
+                web.get(f"{PREFIX}/VehicleVariation", self._vehicle_variations),
+                web.get(f"{PREFIX}/Vehicle", self._vehicle),
+                web.get("/stats", self._stats),
+            ]
+        )
+        if self.simulator is not None and self.advance_every:
+            app.cleanup_ctx.append(self._advancing)
+        return app
+
+    def run(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """Serve until interrupted."""
+        self.logger.info(
+            "Serving %s vehicles on http://%s:%s%s",
+            len(self.catalog.vehicles),
+            host,
+            port,
+            PREFIX,
+        )
+        # No access log: logging each request would limit the throughput
+        web.run_app(self.app(), host=host, port=port, print=None, access_log=None)
+
+    @web.middleware
+    async def _middleware(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        endpoint = request.path.removeprefix(f"{PREFIX}/")
+        if endpoint == "/stats":
+            return await handler(request)
+        self.requests[endpoint] += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            raise web.HTTPServiceUnavailable
+        return await handler(request)
+
+    async def _advancing(self, _: web.Application) -> object:
+        """Advance the simulator in the background, while the app runs."""
+        task = asyncio.create_task(self._advance())
+        yield
+        task.cancel()
+
+    async def _advance(self) -> None:
+        while True:
+            await asyncio.sleep(self.advance_every)
+            stats = self.simulator.advance()
+            self.catalog = Catalog.from_simulator(self.simulator, padding=self.padding)
+            self.logger.info("Advanced the fleet: %s", stats)
+
+    @staticmethod
+    def _json(body: bytes) -> web.Response:
+        return web.Response(body=body, content_type="application/json")
+
+    async def _login(self, _: web.Request) -> web.Response:
+        return web.json_response({})
+
+    async def _profile(self, _: web.Request) -> web.Response:
+        return web.json_response(PROFILE)
+
+    async def _tax_rates(self, _: web.Request) -> web.Response:
+        return web.json_response(TAX_RATES)
+
+    async def _vehicle_clusters(self, _: web.Request) -> web.Response:
+        return self._json(self.catalog.summaries)
+
+    async def _vehicle_variations(self, request: web.Request) -> web.Response:
+        key = (
+            request.query.get("Filters.Make", ""),
+            request.query.get("Filters.Model", ""),
+        )
+        return self._json(self.catalog.variations.get(key, b"[]"))
+
+    async def _vehicle(self, request: web.Request) -> web.Response:
+        vehicle = self.catalog.vehicles.get(request.query.get("VehicleId", ""))
+        if vehicle is None:
+            raise web.HTTPNotFound
+        return self._json(vehicle)
+
+    async def _stats(self, _: web.Request) -> web.Response:
+        return web.json_response(
+            {"requests": dict(self.requests), "errors": dict(self.errors)}
+        )
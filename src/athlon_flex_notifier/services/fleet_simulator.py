@@ -0,0 +1,238 @@
+import random
+from dataclasses import dataclass, field
+
+from athlon_flex_client.models.vehicle import Vehicle as VehicleBase
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+from athlon_flex_client.models.vehicle_cluster import VehicleClusters
+
+COLORS = ["Zwart", "Wit", "Grijs", "Blauw", "Rood", "Zilver"]
+BODY_TYPES = ["Hatchback", "Sedan", "Stationwagen", "SUV"]
+FUEL_TYPES = {1: "Benzine", 2: "Diesel", 3: "Hybride", 4: "Elektrisch"}
+
+
+@dataclass
+class ChurnStats:
+    """Changes applied by one FleetSimulator.advance."""
+
+    repriced: int = 0
+    reoptioned: int = 0
+    detailed: int = 0
+    leased: int = 0
+    added: int = 0
+
+
+@dataclass
+class _Cluster:
+    make: str
+    model: str
+    external_type_id: str
+    external_fuel_type_id: int
+    vehicles: dict[str, VehicleBase] = field(default_factory=dict)
+
+
+class FleetSimulator:
+    """Generate API responses of a synthetic fleet, that changes between snapshots.
+
+    The fleet has clusters clusters of vehicles_per_cluster vehicles, each with
+    options_per_vehicle options out of a shared pool. The responses have the shape of
+    the AthlonFlexClient responses with DetailLevel.INCLUDE_VEHICLE_DETAILS.
+
+    advance changes the fleet like the showroom changes between refreshes. Each
+    vehicle changes with probability churn:
+    - 60%: its pricing changes
+    - 15%: its options change
+    - 10%: its details change (the registered mileage)
+    - 15%: it is leased, and leaves the showroom. A new vehicle arrives in a random
+        cluster, such that the size of the fleet is stable.
+
+    The fleet is generated from seed: the same arguments give the same snapshots.
+    """
+
+    clusters: list[_Cluster]
+    options: list[VehicleBase.Option]
+    options_per_vehicle: int
+    churn: float
+    random: random.Random
+    next_vehicle: int
+
+    def __init__(
+        self,
+        clusters: int = 50,
+        vehicles_per_cluster: int = 20,
+        options_per_vehicle: int = 5,
+        churn: float = 0.05,
+        seed: int = 0,
+    ) -> None:
+        self.random = random.Random(seed)  # noqa: S311
+        self.options_per_vehicle = options_per_vehicle
+        self.churn = churn
+        self.next_vehicle = 0
+        self.options = [
+            VehicleBase.Option(
+                id=f"option-{index}",
+                externalId=f"OPT{index:04d}",
+                optionName=f"Optie {index}",
+                included=False,
+            )
+            for index in range(max(10, options_per_vehicle * 4))
+        ]
+        self.clusters = [
+            _Cluster(
+                make=f"Make{index // 5}",
+                model=f"Model{index}",
+                external_type_id=f"type-{index}",
+                external_fuel_type_id=self.random.choice(list(FUEL_TYPES)),
+            )
+            for index in range(clusters)
+        ]
+        for cluster in self.clusters:
+            for _ in range(vehicles_per_cluster):
+                self._add_vehicle(cluster)
+
+    @property
+    def vehicle_count(self) -> int:
+        return sum(len(cluster.vehicles) for cluster in self.clusters)
+
+    def vehicle_clusters(self, *, include_vehicles: bool = True) -> VehicleClusters:
+        """Get the current fleet as API response.
+
+        Clusters without vehicles are not included, like in the showroom. If not
+        include_vehicles, only the cluster summaries are included
+        (DetailLevel.CLUSTER_ONLY).
+        """
+        return VehicleClusters(
+            vehicle_clusters=[
+                self.vehicle_cluster(index, include_vehicles=include_vehicles)
+                for index, cluster in enumerate(self.clusters)
+                if cluster.vehicles
+            ]
+        )
+
+    def vehicle_cluster(
+        self, index: int, *, include_vehicles: bool = True
+    ) -> VehicleClusterBase:
+        """Get one cluster as API response, with a summary of its vehicles."""
+        cluster = self.clusters[index]
+        vehicles = list(cluster.vehicles.values())
+        cheapest = min(vehicles, key=lambda vehicle: vehicle.priceInEuroPerMonth)
+        base_cluster = VehicleClusterBase(
+            firstVehicleId=cheapest.id,
+            externalTypeId=cluster.external_type_id,
+            make=cluster.make,
+            model=cluster.model,
+            latestModelYear=max(vehicle.modelYear for vehicle in vehicles),
+            vehicleCount=len(vehicles),
+            minPriceInEuroPerMonth=cheapest.priceInEuroPerMonth,
+            fiscalValueInEuro=cheapest.fiscalValueInEuro,
+            additionPercentage=cheapest.additionPercentage,
+            externalFuelTypeId=cluster.external_fuel_type_id,
+            maxCO2Emission=max(int(vehicle.details.emission) for vehicle in vehicles),
+            imageUri=f"https://flex.athlon.com/images/{cluster.external_type_id}.png",
+        )
+        if include_vehicles:
+            base_cluster.vehicles = [vehicle.model_copy() for vehicle in vehicles]
+        return base_cluster
+
+    def advance(self) -> ChurnStats:
+        """Apply churn to the fleet, see the class docstring."""
+        stats = ChurnStats()
+        for cluster in self.clusters:
+            for vehicle_id, vehicle in list(cluster.vehicles.items()):
+                if self.random.random() >= self.churn:
+                    continue
+                change = self.random.random()
+                if change < 0.6:  # noqa: PLR2004
+                    cluster.vehicles[vehicle_id] = self._repriced(vehicle)
+                    stats.repriced += 1
+                elif change < 0.75:  # noqa: PLR2004
+                    cluster.vehicles[vehicle_id] = vehicle.model_copy(
+                        update={"options": self._random_options()}
+                    )
+                    stats.reoptioned += 1
+                elif change < 0.85:  # noqa: PLR2004
+                    details = vehicle.details.model_copy(
+                        update={
+                            "registeredMileage": vehicle.details.registeredMileage
+                            + self.random.randint(10, 500)
+                        }
+                    )
+                    cluster.vehicles[vehicle_id] = vehicle.model_copy(
+                        update={"details": details}
+                    )
+                    stats.detailed += 1
+                else:
+                    del cluster.vehicles[vehicle_id]
+                    self._add_vehicle(self.random.choice(self.clusters))
+                    stats.leased += 1
+                    stats.added += 1
+        return stats
+
+    def _add_vehicle(self, cluster: _Cluster) -> None:
+        self.next_vehicle += 1
+        vehicle_id = f"vehicle-{self.next_vehicle}"
+        fuel_type = cluster.external_fuel_type_id
+        base_price = round(self.random.uniform(350, 1100), 2)
+        fiscal_value = round(base_price * self.random.uniform(45, 70), 2)
+        cluster.vehicles[vehicle_id] = VehicleBase(
+            id=vehicle_id,
+            make=cluster.make,
+            model=cluster.model,
+            type=f"{cluster.model} {FUEL_TYPES[fuel_type]}",
+            modelYear=self.random.randint(2020, 2025),
+            paintId=str(self.random.randint(1, 40)),
+            externalPaintId=f"paint-{self.random.randint(1, 40)}",
+            priceInEuroPerMonth=base_price,
+            fiscalValueInEuro=fiscal_value,
+            additionPercentage=self.random.choice([16.0, 22.0]),
+            rangeInKm=self.random.randint(300, 900),
+            externalFuelTypeId=fuel_type,
+            externalTypeId=cluster.external_type_id,
+            imageUri=f"https://flex.athlon.com/images/{vehicle_id}.png",
+            isElectric=FUEL_TYPES[fuel_type] == "Elektrisch",
+            details=VehicleBase.Details(
+                licensePlate=f"{self.next_vehicle:06d}"[-6:],
+                color=self.random.choice(COLORS),
+                officialColor=self.random.choice(COLORS),
+                bodyType=self.random.choice(BODY_TYPES),
+                emission=self.random.uniform(0, 180),
+                registrationDate=f"{self.random.randint(2020, 2025)}-01-01",
+                registeredMileage=float(self.random.randint(0, 90000)),
+                transmissionType=self.random.choice(["Automaat", "Handgeschakeld"]),
+                avgFuelConsumption=self.random.uniform(3, 8),
+                typeSpareWheel="Bandenreparatieset",
+            ),
+            pricing=self._pricing(base_price, fiscal_value),
+            options=self._random_options(),
+        )
+
+    def _repriced(self, vehicle: VehicleBase) -> VehicleBase:
+        base_price = round(
+            vehicle.priceInEuroPerMonth * self.random.uniform(0.95, 1.05), 2
+        )
+        return vehicle.model_copy(
+            update={
+                "priceInEuroPerMonth": base_price,
+                "pricing": self._pricing(base_price, vehicle.fiscalValueInEuro),
+            }
+        )
+
+    def _pricing(self, base_price: float, fiscal_value: float) -> VehicleBase.Pricing:
+        fuel_price_per_km = round(self.random.uniform(0.05, 0.2), 3)
+        return VehicleBase.Pricing(
+            fiscalValueInEuro=fiscal_value,
+            basePricePerMonthInEuro=base_price,
+            calculatedPricePerMonthInEuro=round(base_price * 1.1, 2),
+            pricePerKm=round(self.random.uniform(0.1, 0.3), 3),
+            fuelPricePerKm=fuel_price_per_km,
+            contributionInEuro=round(self.random.uniform(0, 150), 2),
+            expectedFuelCostPerMonthInEuro=round(fuel_price_per_km * 1500, 2),
+            netCostPerMonthInEuro=round(base_price * 0.6, 2),
+        )
+
+    def _random_options(self) -> list[VehicleBase.Option]:
+        return [
+            option.model_copy(update={"included": self.random.random() < 0.3})  # noqa: PLR2004
+            for option in self.random.sample(self.options, self.options_per_vehicle)
+        ]
@@ -0,0 +1,250 @@
+from dataclasses import dataclass
+from logging import Logger
+from typing import ClassVar
+
+from kink import inject
+from sqlalchemy import (
+    Column,
+    Connection,
+    Engine,
+    Integer,
+    Select,
+    Text,
+    and_,
+    bindparam,
+    cast,
+    delete,
+    false,
+    func,
+    not_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from athlon_flex_notifier.models.tables.base_table import BaseTable
+from athlon_flex_notifier.models.tables.vehicle import Vehicle
+from athlon_flex_notifier.models.tables.vehicle_pricing import VehiclePricing
+from athlon_flex_notifier.utils import time_it
+
+
+@dataclass
+class CompactionReport:
+    """Result of a HistoryCompactor run."""
+
+    entities: int = 0
+    runs_merged: int = 0
+    rows_reclaimed: int = 0
+
+
+@inject
+class HistoryCompactor:
+    """Merge redundant SCD2 versions of entities.
+
+    A run is a sequence of versions of an entity, of which each version starts at
+    the active_to of the previous one, and of which all scd2 attributes are equal,
+    except the volatile_attribute_keys of the entity. A run is merged into its last
+    version: its active_from is set to the active_from of the first version, and the
+    other versions are deleted.
+
+    The last version keeps its attributes and hashes, such that the Upserter
+    compares against the same current row. Rows that refer to a deleted version by
+    a foreign key to its id, such as vehicle.vehicle_cluster_id, are re-pointed to
+    the kept version in the same transaction. Entities that refer to a vehicle by
+    vehicle_key_hash, like its pricing and option set, outlive its versions and are
+    therefor unaffected. vw_vehicle_availability only depends on
+    the start and end of contiguous vehicle versions, which do not change.
+
+    Each of entities is compacted in batches of batch_size key hashes, each in its
+    own transaction. Before committing a batch, vw_vehicle_availability is compared
+    for the vehicles of the batch: the key_hash of a vehicle, or the
+    vehicle_key_hash of an entity that belongs to a vehicle. If it changed, the
+    batch is rolled back and an error is raised.
+    """
+
+    ENTITIES: ClassVar[tuple[type[BaseTable], ...]] = (Vehicle, VehiclePricing)
+
+    logger: Logger
+    database: Engine
+    batch_size: int
+    entities: tuple[type[BaseTable], ...]
+
+    @inject
+    def __init__(
+        self,
+        logger: Logger,
+        database: Engine,
+        batch_size: int = 500,
+        entities: tuple[type[BaseTable], ...] | None = None,
+    ) -> None:
+        self.logger = logger
+        self.database = database
+        self.batch_size = batch_size
+        self.entities = entities if entities is not None else self.ENTITIES
+
+    def compact(self) -> dict[str, CompactionReport]:
+        """Compact the history of all entities.
+
+        Returns
+        -------
+        dict[str, CompactionReport], per table the number of rows that were deleted
+
+        """
+        return {entity.__tablename__: self._compact(entity) for entity in self.entities}
+
+    def _compact(self, entity: type[BaseTable]) -> CompactionReport:
+        report = CompactionReport()
+        after = ""
+        with time_it(f"Compacting {entity.__tablename__} history"):
+            while key_hashes := self._next_batch(entity, after):
+                with self.database.begin() as connection:
+                    self._compact_batch(connection, entity, key_hashes, report)
+                report.entities += len(key_hashes)
+                after = key_hashes[-1]
+        self.logger.info(
+            "Compacted %s %s entities: merged %s runs, reclaimed %s rows",
+            report.entities,
+            entity.__tablename__,
+            report.runs_merged,
+            report.rows_reclaimed,
+        )
+        return report
+
+    def _next_batch(self, entity: type[BaseTable], after: str) -> list[str]:
+        """Get the next key hashes after after, that have multiple versions."""
+        with self.database.connect() as connection:
+            return list(
+                connection.execute(
+                    select(entity.key_hash)
+                    .where(entity.key_hash > after)
+                    .group_by(entity.key_hash)
+                    .having(func.count() > 1)
+                    .order_by(entity.key_hash)
+                    .limit(self.batch_size)
+                ).scalars()
+            )
+
+    def _compact_batch(
+        self,
+        connection: Connection,
+        entity: type[BaseTable],
+        key_hashes: list[str],
+        report: CompactionReport,
+    ) -> None:
+        runs = connection.execute(self._runs_statement(entity, key_hashes)).all()
+        if not runs:
+            return
+        vehicle_key_hashes = self._vehicle_key_hashes(connection, entity, key_hashes)
+        availabilities = self._availabilities(connection, vehicle_key_hashes)
+        removed = [id_ for run in runs for id_ in run.ids[1:]]
+        for column in self._references(entity):
+            connection.execute(
+                update(column.table)
+                .where(column == bindparam("removed_"))
+                .values({column.name: bindparam("kept_")}),
+                [
+                    {"removed_": id_, "kept_": run.ids[0]}
+                    for run in runs
+                    for id_ in run.ids[1:]
+                ],
+            )
+        connection.execute(
+            update(entity)
+            .where(entity.id == bindparam("id_"))
+            .values(active_from=bindparam("active_from_")),
+            [{"id_": run.ids[0], "active_from_": run.active_from} for run in runs],
+        )
+        report.rows_reclaimed += connection.execute(
+            delete(entity).where(entity.id.in_(removed))
+        ).rowcount
+        if self._availabilities(connection, vehicle_key_hashes) != availabilities:
+            msg = "Compaction changed vw_vehicle_availability, rolled back batch"
+            raise RuntimeError(msg)
+        report.runs_merged += len(runs)
+
+    @staticmethod
+    def _references(entity: type[BaseTable]) -> list[Column]:
+        """Get the columns that refer to the id of entity by a foreign key."""
+        return [
+            foreign_key.parent
+            for table in entity.metadata.sorted_tables
+            for foreign_key in table.foreign_keys
+            if foreign_key.references(entity.__table__)
+        ]
+
+    @staticmethod
+    def _vehicle_key_hashes(
+        connection: Connection, entity: type[BaseTable], key_hashes: list[str]
+    ) -> list[str]:
+        """Get the key hashes of the vehicles of entities, by their key hashes."""
+        column = entity.__table__.c.get("vehicle_key_hash")
+        if column is None:
+            return key_hashes
+        return list(
+            connection.execute(
+                select(column).where(entity.key_hash.in_(key_hashes)).distinct()
+            ).scalars()
+        )
+
+    @staticmethod
+    def _availabilities(connection: Connection, key_hashes: list[str]) -> list:
+        return connection.execute(
+            text(
+                "SELECT * FROM vw_vehicle_availability "
+                "WHERE vehicle_key_hash IN :key_hashes "
+                "ORDER BY vehicle_key_hash, available_since"
+            ).bindparams(bindparam("key_hashes", expanding=True)),
+            {"key_hashes": key_hashes},
+        ).all()
+
+    @staticmethod
+    def _runs_statement(entity: type[BaseTable], key_hashes: list[str]) -> Select:
+        """Get the runs of multiple versions, with the ids of the versions.
+
+        ids are ordered by active_from descending: the first id is the version that
+        is kept.
+        """
+        compared = sorted(
+            entity.scd2_attribute_keys() - set(entity.volatile_attribute_keys())
+        )
+        attributes_hash = func.md5(
+            cast(tuple_(*[entity.__table__.c[key] for key in compared]), Text)
+        )
+        window = {"partition_by": entity.key_hash, "order_by": entity.active_from}
+        versions = (
+            select(
+                entity.id,
+                entity.key_hash,
+                entity.active_from,
+                func.coalesce(
+                    and_(
+                        func.lag(entity.active_to).over(**window) == entity.active_from,
+                        func.lag(attributes_hash).over(**window) == attributes_hash,
+                    ),
+                    false(),
+                ).label("continues_previous"),
+            )
+            .where(entity.key_hash.in_(key_hashes))
+            .subquery()
+        )
+        runs = select(
+            versions,
+            func.sum(cast(not_(versions.c.continues_previous), Integer))
+            .over(
+                partition_by=versions.c.key_hash,
+                order_by=versions.c.active_from,
+            )
+            .label("run"),
+        ).subquery()
+        return (
+            select(
+                func.min(runs.c.active_from).label("active_from"),
+                func.array_agg(
+                    aggregate_order_by(runs.c.id, runs.c.active_from.desc())
+                ).label("ids"),
+            )
+            .group_by(runs.c.key_hash, runs.c.run)
+            .having(func.count() > 1)
+        )
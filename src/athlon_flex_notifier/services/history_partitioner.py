@@ -0,0 +1,245 @@
+import os
+import re
+from datetime import datetime, timezone
+from logging import Logger
+
+from kink import di, inject
+from sqlalchemy import Connection, Engine, text
+
+from athlon_flex_notifier.utils import now, time_it
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+@inject
+class HistoryPartitioner:
+    """Maintain the partitions of the SCD2 tables that are partitioned by active_to.
+
+    Current rows (active_to IS NULL) are stored in the default partition
+    <table>_current, closed rows in monthly partitions <table>_y<year>m<month>. When
+    the Upserter closes a row, Postgres moves it to the partition of its active_to.
+    The default partition therefor only contains current rows, and the statements
+    on current rows only scan this small partition.
+
+    Maintenance:
+    - Create the partitions of the coming months_ahead months. A row closed in a
+        month without partition stays in the default partition. Creating its
+        partition later moves it there.
+    - If retention_months is set, detach the partitions of closed rows that are
+        older, and archive them: move them to archive_schema, or drop them if
+        archive_schema is None. Archived history is not visible in the tables and
+        in vw_vehicle_availability anymore. Versions that continue an archived
+        version keep its start, see archive_partition.
+    """
+
+    TABLES = ("vehicle", "vehicle_pricing", "vehicle_option_set")
+
+    logger: Logger
+    database: Engine
+    months_ahead: int
+    retention_months: int | None
+    archive_schema: str | None
+
+    @inject
+    def __init__(
+        self,
+        logger: Logger,
+        database: Engine,
+        months_ahead: int = 2,
+        retention_months: int | None = None,
+        archive_schema: str | None = "history_archive",
+    ) -> None:
+        self.logger = logger
+        self.database = database
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.archive_schema = archive_schema
+
+    def maintain(self) -> None:
+        """Create upcoming partitions, and archive partitions beyond retention."""
+        this_month = (
+            now()
+            .astimezone(timezone.utc)
+            .replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        )
+        with time_it("Maintaining history partitions"):
+            for table in self.TABLES:
+                months = {
+                    _add_months(this_month, offset)
+                    for offset in range(self.months_ahead + 1)
+                } | self._closed_months_in_default(table)
+                for month in sorted(months - self.partitions(table).keys()):
+                    self.create_partition(table, month)
+                if self.retention_months is not None:
+                    cutoff = _add_months(this_month, -self.retention_months)
+                    for month, partition in sorted(self.partitions(table).items()):
+                        if month < cutoff:
+                            self.archive_partition(table, partition)
+
+    def partitions(self, table: str) -> dict[datetime, str]:
+        """Get the monthly partitions of a table, by the start of their month."""
+        pattern = re.compile(rf"^{table}_y(\d{{4}})m(\d{{2}})$")
+        with self.database.connect() as connection:
+            names = connection.execute(
+                text(
+                    "SELECT child.relname FROM pg_inherits "
+                    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                    "WHERE parent.relname = :table"
+                ),
+                {"table": table},
+            ).scalars()
+            return {
+                datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc): name
+                for name in names
+                if (match := pattern.match(name))
+            }
+
+    def create_partition(self, table: str, month: datetime) -> None:
+        """Create the partition of a month, moving its rows from the default partition.
+
+        A partition can not be created while the default partition contains rows in
+        its range. The partition is therefor created as a separate table, the rows are
+        moved into it, and it is attached, in one transaction. The check constraint
+        prevents a scan of the new partition while attaching. Generated columns
+        (active_period) are computed again by the new partition, so they are not
+        copied.
+        """
+        partition = f"{table}_y{month:%Y}m{month:%m}"
+        bounds = {"start": month, "end": _add_months(month, 1)}
+        # DDL does not support bind parameters
+        start, end = (f"'{bound.isoformat()}'" for bound in bounds.values())
+        with self.database.begin() as connection:
+            connection.execute(
+                text(
+                    f"CREATE TABLE {partition} "
+                    f"(LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED)"
+                )
+            )
+            connection.execute(
+                text(
+                    f"ALTER TABLE {partition} ADD CONSTRAINT {partition}_bounds CHECK "
+                    f"(active_to IS NOT NULL AND active_to >= {start} "
+                    f"AND active_to < {end})"
+                )
+            )
+            columns = ", ".join(self._stored_columns(connection, table))
+            moved = connection.execute(
+                text(
+                    f"WITH moved AS (DELETE FROM {table}_current "  # noqa: S608
+                    "WHERE active_to >= :start AND active_to < :end "
+                    f"RETURNING {columns}) "
+                    f"INSERT INTO {partition} ({columns}) SELECT {columns} FROM moved"
+                ),
+                bounds,
+            ).rowcount
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {partition} "
+                    f"FOR VALUES FROM ({start}) TO ({end})"
+                )
+            )
+            connection.execute(
+                text(f"ALTER TABLE {partition} DROP CONSTRAINT {partition}_bounds")
+            )
+        self.logger.info(
+            "Created partition %s, moved %s rows from %s_current",
+            partition,
+            moved,
+            table,
+        )
+
+    def archive_partition(self, table: str, partition: str) -> None:
+        """Detach a partition, and move it to archive_schema, or drop it.
+
+        vw_vehicle_availability takes available_since from the first version of
+        each run of consecutive versions, and the notifications are keyed by it.
+        After detaching, the versions that are archived are therefor collapsed into
+        the first version that is kept: it gets the active_from of the first
+        version of its run. Availabilities that continue after the partition keep
+        their available_since, and are not notified again. Partitions must be
+        archived oldest first, such that earlier runs are already collapsed.
+        """
+        with self.database.begin() as connection:
+            connection.execute(
+                text(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+            )
+            collapsed = connection.execute(
+                text(
+                    "WITH gaps AS ("  # noqa: S608
+                    "SELECT key_hash, active_from, active_to, "
+                    "LAG(active_to, 1, active_from) OVER versions < active_from "
+                    f"AS has_gap FROM {partition} "
+                    "WINDOW versions AS (PARTITION BY key_hash ORDER BY active_from)"
+                    "), runs AS ("
+                    "SELECT key_hash, active_from, active_to, "
+                    "SUM(has_gap::int) OVER versions AS run FROM gaps "
+                    "WINDOW versions AS (PARTITION BY key_hash ORDER BY active_from)"
+                    "), starts AS ("
+                    "SELECT key_hash, active_to, "
+                    "MIN(active_from) OVER (PARTITION BY key_hash, run) AS run_start "
+                    "FROM runs) "
+                    f"UPDATE {table} AS kept SET active_from = starts.run_start "
+                    "FROM starts WHERE kept.key_hash = starts.key_hash "
+                    "AND kept.active_from = starts.active_to"
+                )
+            ).rowcount
+            if self.archive_schema is None:
+                connection.execute(text(f"DROP TABLE {partition}"))
+            else:
+                connection.execute(
+                    text(f"CREATE SCHEMA IF NOT EXISTS {self.archive_schema}")
+                )
+                connection.execute(
+                    text(f"ALTER TABLE {partition} SET SCHEMA {self.archive_schema}")
+                )
+        self.logger.info(
+            "%s partition %s, collapsed it into %s kept versions",
+            "Dropped" if self.archive_schema is None else "Archived",
+            partition,
+            collapsed,
+        )
+
+    @staticmethod
+    def _stored_columns(connection: Connection, table: str) -> list[str]:
+        """Get the quoted names of the columns of a table that are not generated."""
+        return [
+            f'"{column}"'
+            for column in connection.execute(
+                text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table "
+                    "AND is_generated = 'NEVER' "
+                    "ORDER BY ordinal_position"
+                ),
+                {"table": table},
+            ).scalars()
+        ]
+
+    def _closed_months_in_default(self, table: str) -> set[datetime]:
+        """Get the months of closed rows in the default partition."""
+        with self.database.connect() as connection:
+            return {
+                month.astimezone(timezone.utc)
+                for month in connection.execute(
+                    text(
+                        "SELECT DISTINCT date_trunc('month', active_to, 'UTC') "  # noqa: S608
+                        f"FROM {table}_current WHERE active_to IS NOT NULL"
+                    )
+                ).scalars()
+            }
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di.factories[HistoryPartitioner] = lambda _: HistoryPartitioner(
+    months_ahead=int(os.getenv("HISTORY_PARTITIONS_AHEAD", "2")),
+    retention_months=(
+        int(os.environ["HISTORY_RETENTION_MONTHS"])
+        if os.getenv("HISTORY_RETENTION_MONTHS")
+        else None
+    ),
+    archive_schema=os.getenv("HISTORY_ARCHIVE_SCHEMA", "history_archive") or None,
+)
@@ -0,0 +1,152 @@
+import contextvars
+import queue
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from logging import Logger
+from types import TracebackType
+from typing import Any
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Statistics of one stage of a Pipeline."""
+
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+    max_queue_depth: int = 0
+
+
+class Pipeline:
+    """Run items through stages, each stage in its own thread.
+
+    Stages are connected by bounded queues. Items are added using put, which blocks
+    while the queue of the first stage is full. A slow stage therefor slows down the
+    stages before it (back-pressure), instead of accumulating items in memory.
+
+    Each stage is a function that takes an item, and returns the item for the next
+    stage. If it returns None, the item is dropped. The output of the last stage is
+    discarded.
+
+    If a stage raises, the pipeline stops: remaining items are drained without
+    processing, put raises, and the error is raised when the pipeline exits.
+
+    Usage:
+        with Pipeline(logger, [("map", map_), ("write", write)]) as pipeline:
+            for item in items:
+                pipeline.put(item)
+
+    On exit, the throughput and maximum queue depth of each stage are logged.
+    """
+
+    logger: Logger
+    stages: list[tuple[str, Callable[[Any], Any]]]
+    queues: list[queue.Queue]
+    stats: list[StageStats]
+    producer: StageStats
+    threads: list[threading.Thread]
+    error: BaseException | None
+    started_at: float
+
+    def __init__(
+        self,
+        logger: Logger,
+        stages: list[tuple[str, Callable[[Any], Any]]],
+        maxsize: int = 8,
+        producer_name: str = "produce",
+    ) -> None:
+        self.logger = logger
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+        self.stats = [StageStats(name) for name, _ in stages]
+        self.producer = StageStats(producer_name)
+        self.threads = []
+        self.error = None
+
+    def __enter__(self) -> "Pipeline":
+        self.started_at = time.perf_counter()
+        for index, (name, _) in enumerate(self.stages):
+            # Copy the context, such that stages can use the flow logger
+            thread = threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._run, index),
+                name=f"pipeline-{name}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def put(self, item: Any) -> None:  # noqa: ANN401
+        """Add an item to the first stage. Blocks while its queue is full."""
+        if self.error is not None:
+            msg = "Pipeline stopped, because a stage failed"
+            raise RuntimeError(msg) from self.error
+        self._put(0, item)
+        self.producer.items += 1
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.queues[0].put(_DONE)
+        for thread in self.threads:
+            thread.join()
+        self._log_stats()
+        if self.error is not None and exc_type is None:
+            raise self.error
+
+    def _run(self, index: int) -> None:
+        """Process the items of the queue of a stage, until _DONE is received."""
+        name, function = self.stages[index]
+        stats = self.stats[index]
+        is_last = index == len(self.stages) - 1
+        while (item := self.queues[index].get()) is not _DONE:
+            if self.error is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                self.logger.exception("Pipeline stage %s failed", name)
+                self.error = e
+                continue
+            finally:
+                stats.busy_seconds += time.perf_counter() - start
+            stats.items += 1
+            if result is not None and not is_last:
+                self._put(index + 1, result)
+        if not is_last:
+            self.queues[index + 1].put(_DONE)
+
+    def _put(self, index: int, item: Any) -> None:  # noqa: ANN401
+        self.queues[index].put(item)
+        stats = self.stats[index]
+        stats.max_queue_depth = max(stats.max_queue_depth, self.queues[index].qsize())
+
+    def _log_stats(self) -> None:
+        elapsed = time.perf_counter() - self.started_at
+        self.logger.info(
+            "Stage %s: %s items in %.2f seconds (%.2f items/s)",
+            self.producer.name,
+            self.producer.items,
+            elapsed,
+            self.producer.items / elapsed if elapsed else 0.0,
+        )
+        for stats in self.stats:
+            self.logger.info(
+                "Stage %s: %s items, busy %.2f seconds (%.2f items/s), "
+                "max queue depth %s/%s",
+                stats.name,
+                stats.items,
+                stats.busy_seconds,
+                stats.items / stats.busy_seconds if stats.busy_seconds else 0.0,
+                stats.max_queue_depth,
+                self.queues[0].maxsize,
+            )
@@ -0,0 +1,255 @@
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from logging import Logger
+from statistics import mean
+from zoneinfo import ZoneInfo
+
+from kink import di, inject
+from prefect.client.orchestration import get_client
+from prefect.client.schemas.schedules import CronSchedule
+from prefect.utilities.asyncutils import run_coro_as_sync
+from sqlalchemy import Date, Engine, cast, extract, func, select, union_all
+
+from athlon_flex_notifier.models.tables.vehicle import Vehicle
+from athlon_flex_notifier.models.tables.vehicle_option_set import VehicleOptionSet
+from athlon_flex_notifier.models.tables.vehicle_pricing import VehiclePricing
+from athlon_flex_notifier.utils import now, time_it
+
+MINUTES_PER_DAY = 24 * 60
+# Intervals are rounded down to one of these, such that runs align across hours
+ROUNDED_INTERVALS = (1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60, 120, 180, 240, 360)
+
+
+@inject
+class RefreshScheduler:
+    """Adapt the schedule of refresh to the rate at which vehicles change.
+
+    Learns from the SCD2 history how many vehicles changed in each hour of the day,
+    over the last lookback_days full days. A vehicle changed if a version of it, of
+    its pricing or of its option set was created: it is new, or its details, prices
+    or options changed. A vehicle is counted once per hour, also if several of its
+    versions were created in that hour, like the vehicle, pricing and option set of
+    a new vehicle. The rate of an hour is the mean over these days,
+    without the busiest tenth of the days, such that one-off bulk loads (like the
+    initial load, or a replay) do not count.
+
+    The interval of an hour is chosen such that a refresh is expected to find
+    changes_per_refresh changes, bounded by min_interval and max_interval minutes.
+    Busy hours are therefor refreshed often, and quiet hours rarely. Without history,
+    refresh runs every default_interval minutes.
+    """
+
+    DEPLOYMENT = "refresh/refresh"
+
+    logger: Logger
+    database: Engine
+    min_interval: int
+    max_interval: int
+    default_interval: int
+    changes_per_refresh: float
+    lookback_days: int
+    timezone: str
+
+    @inject
+    def __init__(  # noqa: PLR0913
+        self,
+        logger: Logger,
+        database: Engine,
+        min_interval: int = 5,
+        max_interval: int = 60,
+        default_interval: int = 10,
+        changes_per_refresh: float = 1.0,
+        lookback_days: int = 28,
+        timezone: str = "Europe/Amsterdam",
+    ) -> None:
+        self.logger = logger
+        self.database = database
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.changes_per_refresh = changes_per_refresh
+        self.lookback_days = lookback_days
+        self.timezone = timezone
+
+    def change_rates(self) -> dict[int, float] | None:
+        """Get the number of changed vehicles per hour, by hour of the day.
+
+        Returns
+        -------
+        dict[int, float], the changes per hour by hour of the day, or None if there
+            is no full day of history
+
+        """
+        today = now().astimezone(ZoneInfo(self.timezone)).date()
+        start = today - timedelta(days=self.lookback_days)
+        versions = union_all(
+            *[
+                select(key_hash.label("vehicle_key_hash"), entity.active_from)
+                .where(entity.active_from >= self._midnight(start))
+                .where(entity.active_from < self._midnight(today))
+                for entity, key_hash in [
+                    (Vehicle, Vehicle.key_hash),
+                    (VehiclePricing, VehiclePricing.vehicle_key_hash),
+                    (VehicleOptionSet, VehicleOptionSet.vehicle_key_hash),
+                ]
+            ]
+        ).subquery()
+        local = func.timezone(self.timezone, versions.c.active_from)
+        day = cast(local, Date)
+        with self.database.connect() as connection:
+            first = connection.execute(select(func.min(Vehicle.active_from))).scalar()
+            rows = connection.execute(
+                select(
+                    day,
+                    extract("hour", local),
+                    func.count(versions.c.vehicle_key_hash.distinct()),
+                ).group_by(day, extract("hour", local))
+            ).all()
+        if first is None:
+            return None
+        first_day = first.astimezone(ZoneInfo(self.timezone)).date()
+        if first_day >= today:
+            return None
+        days = (today - max(first_day, start)).days
+        counts: dict[int, dict[date, int]] = defaultdict(dict)
+        for row_day, hour, count in rows:
+            counts[int(hour)][row_day] = count
+        return {
+            hour: self._trimmed_mean(list(counts[hour].values()), days)
+            for hour in range(24)
+        }
+
+    def intervals(self, rates: dict[int, float] | None) -> dict[int, int]:
+        """Get the refresh interval in minutes, by hour of the day."""
+        if rates is None:
+            return dict.fromkeys(range(24), self.default_interval)
+        intervals = {}
+        for hour, rate in rates.items():
+            interval = (
+                60 * self.changes_per_refresh / rate if rate > 0 else self.max_interval
+            )
+            rounded = max(
+                (rounded for rounded in ROUNDED_INTERVALS if rounded <= interval),
+                default=ROUNDED_INTERVALS[0],
+            )
+            intervals[hour] = min(max(rounded, self.min_interval), self.max_interval)
+        return intervals
+
+    def schedules(self, intervals: dict[int, int]) -> list[CronSchedule]:
+        """Get the cron schedules that run refresh at intervals.
+
+        The runs are planned from midnight: each run is followed by the next after
+        the interval of its hour, or at the start of an hour with a shorter interval
+        if that comes first. Hours with the same minutes share a schedule.
+        """
+        minutes_by_hour: dict[int, list[int]] = defaultdict(list)
+        minute = 0
+        while minute < MINUTES_PER_DAY:
+            minutes_by_hour[minute // 60].append(minute % 60)
+            interval = intervals[minute // 60]
+            minute = next(
+                (
+                    hour * 60
+                    for hour in range(minute // 60 + 1, 24)
+                    if hour * 60 < minute + interval and intervals[hour] < interval
+                ),
+                minute + interval,
+            )
+        hours_by_minutes: dict[tuple[int, ...], list[int]] = defaultdict(list)
+        for hour, minutes in sorted(minutes_by_hour.items()):
+            hours_by_minutes[tuple(minutes)].append(hour)
+        return [
+            CronSchedule(
+                cron=f"{_cron_field(minutes, 60)} {_cron_field(hours, 24)} * * *",
+                timezone=self.timezone,
+            )
+            for minutes, hours in hours_by_minutes.items()
+        ]
+
+    def plan(self) -> tuple[dict[int, float] | None, dict[int, int]]:
+        """Learn the change rates, and the intervals of refresh.
+
+        Returns
+        -------
+        dict[int, float] | None, see change_rates
+        dict[int, int], see intervals
+
+        """
+        with time_it("Learning refresh intervals"):
+            rates = self.change_rates()
+        intervals = self.intervals(rates)
+        self.logger.info(
+            "Refresh intervals by hour: %s",
+            ", ".join(f"{hour}h: {interval}m" for hour, interval in intervals.items()),
+        )
+        return rates, intervals
+
+    def apply(self, schedules: list[CronSchedule]) -> None:
+        """Replace the schedules of the refresh deployment."""
+        run_coro_as_sync(self._apply(schedules))
+        self.logger.info("Applied %s refresh schedules", len(schedules))
+
+    def report(self, rates: dict[int, float] | None, intervals: dict[int, int]) -> str:
+        """Render the rates, intervals and schedules as markdown."""
+        lines = [
+            "# Refresh schedule",
+            "",
+            "No history: the default interval is used."
+            if rates is None
+            else f"Learned from the last {self.lookback_days} days.",
+            "",
+            "| Hour | Changes per hour | Interval (minutes) |",
+            "| ---: | ---: | ---: |",
+            *(
+                f"| {hour} | {'-' if rates is None else f'{rates[hour]:.2f}'} | "
+                f"{interval} |"
+                for hour, interval in intervals.items()
+            ),
+            "",
+            "## Schedules",
+            "",
+            *(f"- `{schedule.cron}`" for schedule in self.schedules(intervals)),
+        ]
+        return "\n".join(lines)
+
+    async def _apply(self, schedules: list[CronSchedule]) -> None:
+        async with get_client() as client:
+            deployment = await client.read_deployment_by_name(self.DEPLOYMENT)
+            for schedule in deployment.schedules:
+                await client.delete_deployment_schedule(deployment.id, schedule.id)
+            await client.create_deployment_schedules(
+                deployment.id, [(schedule, True) for schedule in schedules]
+            )
+
+    def _midnight(self, day: date) -> datetime:
+        return datetime.combine(
+            day, datetime.min.time(), tzinfo=ZoneInfo(self.timezone)
+        )
+
+    @staticmethod
+    def _trimmed_mean(counts: list[int], days: int) -> float:
+        """Get the mean of counts over days, without the busiest tenth of the days.
+
+        Days without changes are not in counts.
+        """
+        counts = sorted(counts + [0] * (days - len(counts)))
+        trim = days // 10
+        return mean(counts[: days - trim]) if days else 0.0
+
+
+def _cron_field(values: list[int] | tuple[int, ...], size: int) -> str:
+    """Render values of a cron field, as */step if they are evenly spaced from 0."""
+    step = values[1] - values[0] if len(values) > 1 else 0
+    if step and tuple(values) == tuple(range(0, size, step)):
+        return "*" if step == 1 else f"*/{step}"
+    return ",".join(str(value) for value in values)
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di.factories[RefreshScheduler] = lambda _: RefreshScheduler(
+    min_interval=int(os.getenv("REFRESH_MIN_INTERVAL", "5")),
+    max_interval=int(os.getenv("REFRESH_MAX_INTERVAL", "60")),
+    changes_per_refresh=float(os.getenv("REFRESH_CHANGES_PER_RUN", "1")),
+    lookback_days=int(os.getenv("REFRESH_SCHEDULE_LOOKBACK_DAYS", "28")),
+)
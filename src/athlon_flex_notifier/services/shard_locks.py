@@ -0,0 +1,82 @@
+import zlib
+from collections.abc import Generator
+from contextlib import contextmanager
+
+from kink import inject
+from sqlalchemy import Connection, Engine, func, select
+from sqlmodel import Session
+
+
+def namespace_of(name: str) -> int:
+    """Get the first integer of advisory locks of name, the second being the key."""
+    return zlib.crc32(f"athlon_flex_notifier.{name}".encode()) & 0x7FFFFFFF
+
+
+def shard_of(key: str, shards: int) -> int:
+    """Get the shard of key: a stable hash of key, modulo shards."""
+    return zlib.crc32(key.encode()) % shards
+
+
+@inject
+class ShardLocks:
+    """Claim shards of work across processes, with Postgres advisory locks.
+
+    A shard is claimed with a session-level advisory lock, which is held by a
+    connection of database until it is released. If the process dies, Postgres
+    closes the connection and thereby releases its locks, such that a shard is never
+    claimed forever. Negative keys are reserved for locks that are not shards, such
+    as COORDINATOR.
+
+    Keys are scoped to namespace, such that unrelated locks (like those of refresh
+    and notify) never collide.
+    """
+
+    COORDINATOR = -1
+
+    database: Engine
+    namespace: int
+
+    @inject
+    def __init__(self, database: Engine, namespace: str = "refresh") -> None:
+        self.database = database
+        self.namespace = namespace_of(namespace)
+
+    @contextmanager
+    def claim(self, key: int) -> Generator[bool]:
+        """Try to claim key, without waiting. Yields whether it was claimed.
+
+        The claim is released at the end of the block.
+        """
+        with self.database.connect() as connection:
+            claimed = connection.execute(
+                select(func.pg_try_advisory_lock(self.namespace, key))
+            ).scalar()
+            try:
+                yield claimed
+            finally:
+                if claimed:
+                    connection.execute(
+                        select(func.pg_advisory_unlock(self.namespace, key))
+                    )
+
+    def claim_for_transaction(self, connection: Connection | Session, key: int) -> bool:
+        """Try to claim key until the transaction of connection ends, without waiting.
+
+        Returns
+        -------
+        bool, whether it was claimed
+
+        """
+        return connection.execute(
+            select(func.pg_try_advisory_xact_lock(self.namespace, key))
+        ).scalar()
+
+    @contextmanager
+    def hold(self, key: int) -> Generator[None]:
+        """Claim key, waiting until it is released by others."""
+        with self.database.connect() as connection:
+            connection.execute(select(func.pg_advisory_lock(self.namespace, key)))
+            try:
+                yield
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(self.namespace, key)))
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+from typing import TypeVar
+
+import zstandard
+from kink import di, inject
+from pydantic import BaseModel
+
+M = TypeVar("M", bound=BaseModel)
+
+
+@dataclass
+class Snapshot:
+    """One archived refresh.
+
+    Attributes:
+        taken_at: datetime
+            When the refresh started.
+        summary: str
+            Content hash of the cluster summaries.
+        clusters: list[str]
+            Content hashes of the clusters including vehicles that were loaded.
+        partial: bool
+            True if not all clusters of the summary were loaded, for example in an
+            incremental refresh. The other clusters did not change.
+
+    """
+
+    taken_at: datetime
+    summary: str
+    clusters: list[str]
+    partial: bool
+
+
+@inject
+class SnapshotArchive:
+    """Archive of the API responses of the refresh, compressed and deduplicated.
+
+    Each response is stored as a zstd compressed blob of its JSON, named by the
+    sha256 of the JSON. A response that did not change since a previous refresh is
+    therefor stored only once. The hash is also used as RefreshFingerprint.
+    Each refresh is recorded as a Snapshot, referring to the blobs of its responses.
+
+    Layout of directory:
+        blobs/<first 2 chars of hash>/<hash>.json.zst
+        snapshots/<taken_at>.json
+
+    If directory is None, the archive is disabled: responses are hashed, but
+    nothing is stored.
+    """
+
+    BLOB_SUFFIX = ".json.zst"
+
+    logger: Logger
+    directory: Path | None
+    level: int
+
+    @inject
+    def __init__(
+        self, logger: Logger, directory: Path | None = None, level: int = 10
+    ) -> None:
+        self.logger = logger
+        self.directory = directory
+        self.level = level
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def put(self, response: BaseModel) -> str:
+        """Store a response, unless a response with the same content is stored.
+
+        Thread safe: blobs are written to a temporary file, and moved in place.
+
+        Returns
+        -------
+        str, the content hash of the response
+
+        """
+        data = response.model_dump_json().encode()
+        content_hash = hashlib.sha256(data).hexdigest()
+        if not self.enabled:
+            return content_hash
+        path = self._blob_path(content_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            compressed = zstandard.ZstdCompressor(level=self.level).compress(data)
+            self._write_atomic(path, compressed)
+        return content_hash
+
+    def get(self, content_hash: str, model: type[M]) -> M:
+        """Load a response by its content hash."""
+        compressed = self._blob_path(content_hash).read_bytes()
+        return model.model_validate_json(
+            zstandard.ZstdDecompressor().decompress(compressed)
+        )
+
+    def record(self, snapshot: Snapshot) -> None:
+        """Record a refresh. All its responses must be stored using put."""
+        if not self.enabled:
+            return
+        path = (
+            self.directory
+            / "snapshots"
+            / f"{snapshot.taken_at.strftime('%Y%m%dT%H%M%S%fZ')}.json"
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(
+            path,
+            json.dumps(
+                {
+                    "taken_at": snapshot.taken_at.isoformat(),
+                    "summary": snapshot.summary,
+                    "clusters": snapshot.clusters,
+                    "partial": snapshot.partial,
+                }
+            ).encode(),
+        )
+        self.logger.info(
+            "Archived snapshot %s with %s clusters", path.name, len(snapshot.clusters)
+        )
+
+    def snapshots(
+        self, since: datetime | None = None, until: datetime | None = None
+    ) -> Iterator[Snapshot]:
+        """Iterate the recorded snapshots in chronological order.
+
+        since and until are inclusive, and must be timezone aware.
+        """
+        if not self.enabled:
+            return
+        for path in sorted((self.directory / "snapshots").glob("*.json")):
+            data = json.loads(path.read_text())
+            snapshot = Snapshot(
+                taken_at=datetime.fromisoformat(data["taken_at"]),
+                summary=data["summary"],
+                clusters=data["clusters"],
+                partial=data["partial"],
+            )
+            if since is not None and snapshot.taken_at < since:
+                continue
+            if until is not None and snapshot.taken_at > until:
+                return
+            yield snapshot
+
+    def _blob_path(self, content_hash: str) -> Path:
+        return (
+            self.directory
+            / "blobs"
+            / content_hash[:2]
+            / (content_hash + self.BLOB_SUFFIX)
+        )
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes) -> None:
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, suffix=".tmp", delete=False
+        ) as file:
+            file.write(data)
+        Path(file.name).replace(path)
+        path.chmod(0o644)
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di.factories[SnapshotArchive] = lambda _: SnapshotArchive(
+    directory=(
+        Path(os.environ["SNAPSHOT_ARCHIVE_DIR"])
+        if os.getenv("SNAPSHOT_ARCHIVE_DIR")
+        else None
+    ),
+)
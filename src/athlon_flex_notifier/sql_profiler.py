@@ -0,0 +1,224 @@
+"""Profile the SQL statements sent to Postgres, grouped by their shape."""
+
+import os
+import re
+import threading
+import time
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from kink import di
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+# Normalization of statements to their shape, applied in order
+_BIND_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):[A-Za-z_]\w*|\?")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES_LIST = re.compile(r"VALUES\s*\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+# Frames of these packages are skipped to find the caller of a statement
+_PACKAGE = Path(__file__).parent
+_SKIPPED = (str(Path(__file__)), f"{_PACKAGE / 'metrics.py'}")
+
+
+def normalize(statement: str) -> str:
+    """Get the shape of a statement: the SQL without literals and parameters.
+
+    Parameters and literals are replaced by ?. Lists of parameters, like those of an
+    expanding IN, are collapsed to (...), such that the shape does not depend on the
+    length of the list.
+    """
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _BIND_PARAMETER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PARAMETER_LIST.sub("(...)", shape)
+    shape = _VALUES_LIST.sub("VALUES (...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+@dataclass
+class StatementStats:
+    """Executions of statements of the same shape."""
+
+    shape: str
+    count: int = 0
+    executemany: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    callers: Counter[str] = field(default_factory=Counter)
+
+    @property
+    def is_select(self) -> bool:
+        return self.shape.upper().startswith(("SELECT", "WITH"))
+
+
+class SqlProfiler:
+    """Count and time the statements of an engine, grouped by their shape.
+
+    Opt-in, since finding the caller of each statement is not free: instrument
+    must be called on the engine to profile (see bootstrap._create_engine).
+
+    A SELECT shape executed at least n_plus_one_threshold times in a run is
+    flagged as probable N+1: a query per item of a list, instead of a single query
+    for the list. Its callers point to the code that issues it. reset starts a
+    new run, report renders the current run.
+    """
+
+    enabled: bool
+    n_plus_one_threshold: int
+    statements: dict[str, StatementStats]
+
+    def __init__(
+        self, *, enabled: bool = False, n_plus_one_threshold: int = 10
+    ) -> None:
+        self.enabled = enabled
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, engine: "Engine") -> None:
+        """Profile all statements executed through engine."""
+        # Imported here, such that importing the profiler does not import SQLAlchemy
+        from sqlalchemy import event
+
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def reset(self) -> None:
+        """Forget all statements, to start profiling a new run."""
+        with self._lock:
+            self.statements = {}
+
+    @property
+    def total_count(self) -> int:
+        return sum(stats.count for stats in self.statements.values())
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(stats.total_seconds for stats in self.statements.values())
+
+    def probable_n_plus_one(self) -> list[StatementStats]:
+        """Get the SELECT shapes executed at least n_plus_one_threshold times."""
+        return sorted(
+            (
+                stats
+                for stats in self.statements.values()
+                if stats.is_select and stats.count >= self.n_plus_one_threshold
+            ),
+            key=lambda stats: stats.count,
+            reverse=True,
+        )
+
+    def report(self, title: str, top: int = 20) -> str:
+        """Render the profile of the run as markdown.
+
+        Lists the probable N+1 shapes with their callers, and the top shapes by
+        total duration.
+        """
+        with self._lock:
+            statements = sorted(
+                self.statements.values(),
+                key=lambda stats: stats.total_seconds,
+                reverse=True,
+            )
+        n_plus_one = self.probable_n_plus_one()
+        lines = [
+            f"# SQL profile of {title}",
+            "",
+            f"{self.total_count} statements of {len(statements)} shapes, "
+            f"{self.total_seconds:.3f} seconds in Postgres.",
+            "",
+            f"## Probable N+1 (SELECT executed at least {self.n_plus_one_threshold} "
+            "times)",
+            "",
+        ]
+        if not n_plus_one:
+            lines.append("None.")
+        for stats in n_plus_one:
+            callers = ", ".join(
+                f"`{caller}` ({count}x)"
+                for caller, count in stats.callers.most_common(3)
+            )
+            lines.extend(
+                [
+                    f"- {stats.count}x, {stats.total_seconds:.3f} s, from {callers}:",
+                    f"  `{_shorten(stats.shape, 300)}`",
+                ]
+            )
+        lines.extend(
+            [
+                "",
+                f"## Top {top} shapes by duration",
+                "",
+                "| Count | Executemany | Total (s) | Max (s) | Statement |",
+                "| ---: | ---: | ---: | ---: | --- |",
+            ]
+        )
+        lines.extend(
+            f"| {stats.count} | {stats.executemany} | {stats.total_seconds:.3f} | "
+            f"{stats.max_seconds:.3f} | `{_shorten(stats.shape, 150)}` |"
+            for stats in statements[:top]
+        )
+        return "\n".join(lines)
+
+    def _before_cursor_execute(  # noqa: PLR0913
+        self,
+        connection: Any,  # noqa: ANN401
+        cursor: Any,  # noqa: ANN401, ARG002
+        statement: str,  # noqa: ARG002
+        parameters: Any,  # noqa: ANN401, ARG002
+        context: Any,  # noqa: ANN401, ARG002
+        executemany: bool,  # noqa: ARG002, FBT001
+    ) -> None:
+        connection.info.setdefault("sql_profiler_started_at", []).append(
+            time.perf_counter()
+        )
+
+    def _after_cursor_execute(  # noqa: PLR0913
+        self,
+        connection: Any,  # noqa: ANN401
+        cursor: Any,  # noqa: ANN401, ARG002
+        statement: str,
+        parameters: Any,  # noqa: ANN401, ARG002
+        context: Any,  # noqa: ANN401, ARG002
+        executemany: bool,  # noqa: FBT001
+    ) -> None:
+        started_at = connection.info["sql_profiler_started_at"].pop()
+        duration = time.perf_counter() - started_at
+        shape = normalize(statement)
+        caller = _caller()
+        with self._lock:
+            stats = self.statements.setdefault(shape, StatementStats(shape=shape))
+            stats.count += 1
+            stats.executemany += executemany
+            stats.total_seconds += duration
+            stats.max_seconds = max(stats.max_seconds, duration)
+            stats.callers[caller] += 1
+
+
+def _caller() -> str:
+    """Get the innermost frame of this package, outside the profiler, as file:line."""
+    for frame, line in traceback.walk_stack(None):
+        filename = frame.f_code.co_filename
+        if filename.startswith(str(_PACKAGE)) and filename not in _SKIPPED:
+            relative = Path(filename).relative_to(_PACKAGE)
+            return f"{relative}:{line} {frame.f_code.co_name}"
+    return "unknown"
+
+
+def _shorten(text: str, length: int) -> str:
+    return text if len(text) <= length else f"{text[: length - 3]}..."
+
+
+# Registered here instead of in bootstrap, see bootstrap.bootstrap_di
+di[SqlProfiler] = lambda _: SqlProfiler(
+    enabled=os.getenv("SQL_PROFILE", "false") == "true",
+    n_plus_one_threshold=int(os.getenv("SQL_PROFILE_N_PLUS_ONE_THRESHOLD", "10")),
+)
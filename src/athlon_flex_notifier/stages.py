@@ -0,0 +1,88 @@
+"""Stages of a flow run, as Prefect tasks of which the results are persisted.
+
+A stage is identified by its name and a key, that describes its input. Within a
+flow run, a stage with the same name and key runs once: its result is persisted,
+and returned on later calls. A retry of the flow run therefor resumes at the first
+stage that did not complete, instead of starting over.
+
+The cache is scoped to the flow run on purpose. Whether the input of a stage
+changed since a previous run depends on the database, not only on the input: an
+upsert of the same vehicles must be repeated if they changed in between. Skipping
+unchanged input across runs is done with the RefreshFingerprint instead.
+"""
+
+import hashlib
+import time
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, TypeVar
+from uuid import UUID
+
+from prefect import task
+from prefect.context import TaskRunContext
+from prefect.settings import get_current_settings
+
+T = TypeVar("T")
+
+KEY_PREFIX = "stage-"
+
+
+def stage_key(context: TaskRunContext, parameters: dict[str, Any]) -> str | None:
+    """Get the cache key of a stage: its flow run, name and key.
+
+    Returns None outside a flow run, which disables caching.
+    """
+    flow_run_id = context.task_run.flow_run_id
+    if flow_run_id is None:
+        return None
+    digest = hashlib.sha256(f"{parameters['name']}\0{parameters['key']}".encode())
+    return f"{KEY_PREFIX}{flow_run_id}-{digest.hexdigest()}"
+
+
+@task(cache_key_fn=stage_key, persist_result=True, task_run_name="{name}")
+def run_stage(name: str, key: str, function: Callable[[], T]) -> T:  # noqa: ARG001
+    """Run function as stage name with input key, or get its persisted result.
+
+    function must be a closure over the input described by key. Its result must be
+    picklable.
+    """
+    return function()
+
+
+@task(cache_key_fn=stage_key, persist_result=True, task_run_name="{name}")
+async def run_stage_async(
+    name: str,  # noqa: ARG001
+    key: str,  # noqa: ARG001
+    function: Callable[[], Awaitable[T]],
+) -> T:
+    """Run coroutine function as stage, see run_stage."""
+    return await function()
+
+
+def clear_stages(
+    flow_run_id: UUID | None = None, older_than: timedelta = timedelta(days=1)
+) -> int:
+    """Delete the persisted results of the stages of a flow run.
+
+    Also deletes the results of all stages older than older_than, left behind by
+    flow runs that failed.
+
+    Returns
+    -------
+    int, the number of deleted results
+
+    """
+    storage = Path(get_current_settings().results.local_storage_path).expanduser()
+    if not storage.exists():
+        return 0
+    deleted = 0
+    expired_before = time.time() - older_than.total_seconds()
+    for path in storage.glob(f"{KEY_PREFIX}*"):
+        if (
+            flow_run_id is not None
+            and path.name.startswith(f"{KEY_PREFIX}{flow_run_id}-")
+        ) or path.stat().st_mtime < expired_before:
+            path.unlink(missing_ok=True)
+            deleted += 1
+    return deleted
@@ -1,15 +1,18 @@
 import contextlib
+from collections.abc import Generator
+from dataclasses import dataclass
 from datetime import datetime
 from logging import Logger
 from typing import TYPE_CHECKING, Any, TypeVar
 
 from kink import inject
-from sqlalchemy import Engine, and_, bindparam, select, update
+from sqlalchemy import ColumnElement, Engine, and_, bindparam, select, true, update
 from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import Session
 
+from athlon_flex_notifier.metrics import COUNT_BUCKETS, Metrics
 from athlon_flex_notifier.models.tables.base_table import LoadType
-from athlon_flex_notifier.utils import now
+from athlon_flex_notifier.utils import now, time_it
 
 if TYPE_CHECKING:
     from athlon_flex_notifier.models.tables.base_table import BaseTable
@@ -27,40 +30,93 @@ class Upserter:
     entity_class: T
     session: Session | None = None
     timestamp: datetime
+    created_rows: list[dict[str, Any]]
+    scope: ColumnElement[bool] | None = None
+    fixed_timestamp: datetime | None = None
+
+    @contextlib.contextmanager
+    def replaying(self, timestamp: datetime) -> Generator:
+        """Upsert as if it is timestamp, without calling on_upsert of the entities.
+
+        Used to replay archived API responses: rows get the original timestamps,
+        and no notifications are enqueued for history.
+        """
+        self.fixed_timestamp = timestamp
+        try:
+            yield
+        finally:
+            self.fixed_timestamp = None
 
     @inject
-    def upsert(
-        self, entities: list[T], database: Engine, logger: Logger
+    def upsert(  # noqa: PLR0913
+        self,
+        entities: list[T],
+        database: Engine,
+        logger: Logger,
+        metrics: Metrics,
+        *,
+        scope: ColumnElement[bool] | None = None,
+        entity_class: type[T] | None = None,
     ) -> dict[str, T]:
         """Upsert multiple entities into the database.
 
         - Update records in-place if scd1 attributes are updated
         - Update records by closing and creating new rows if scd2 attributes are updated
 
+        If scope is provided, the load is partial. Only meaningful for FULL_LOAD
+        entities: entities then contains all entities matching the scope, instead of
+        all entities. Only active rows within the scope are closed if they are not in
+        entities, other rows are left untouched. Example: the vehicles of a subset of
+        the clusters. A partial load can be empty, which closes all active rows in the
+        scope. entity_class must then be provided, since it cannot be derived from
+        entities.
+
+        The upsert and its phases are recorded as spans in metrics, and the number of
+        upserted and created rows as metrics per entity.
+
         Returns
         -------
         dict[str, T], maps key_hash the upserted entity
 
         """
-        self.timestamp = now()
+        self.timestamp = self.fixed_timestamp or now()
         self.logger = logger
+        self.scope = scope
+        self.created_rows = []
         self.data = [
             {**entity.model_dump(), "active_from": self.timestamp}
             for entity in entities
         ]
-        if not self.data:
+        if not self.data and (scope is None or entity_class is None):
             self.logger.error("No data to upsert")
             return {}
-        if len(entities):
-            self.entity_class = type(entities[0])
+        self.entity_class = entity_class or type(entities[0])
+        entity = self.entity_class.__tablename__
         if not self.session:
             self.session = Session(database, expire_on_commit=False)
-        self.scd1()
-        self.scd2()
-        self.session.commit()
-        self.session.close()
-        # Reload from DB, to ensure all attributes are up-to-date
-        result = self.entity_class.get(key_hashes=self.key_hashes)
+        with metrics.span("upsert", entity=entity, rows=len(self.data)):
+            if self.data:
+                with metrics.span("upsert.scd1", entity=entity):
+                    self.scd1()
+                with metrics.span("upsert.scd2", entity=entity):
+                    self.scd2()
+                if self.fixed_timestamp is None:
+                    with metrics.span("upsert.on_upsert", entity=entity):
+                        self.entity_class.on_upsert(self.session, self.created_rows)
+            else:
+                with metrics.span("upsert.close_deleted", entity=entity):
+                    self.close_active_rows_of_deleted_entities()
+            with metrics.span("upsert.commit", entity=entity):
+                self.session.commit()
+                self.session.close()
+            # Reload from DB, to ensure all attributes are up-to-date
+            with metrics.span("upsert.reload", entity=entity):
+                result = self.entity_class.get(key_hashes=self.key_hashes)
+        metrics.increment("upserted_rows_total", len(self.data), entity=entity)
+        metrics.increment("created_rows_total", len(self.created_rows), entity=entity)
+        metrics.observe(
+            "upsert_batch_rows", len(self.data), buckets=COUNT_BUCKETS, entity=entity
+        )
         if len(result) != len(self.data):
             msg = f"Found {len(result)} entities after upsert, expecteded {len(self.data)}"  # noqa: E501
             raise RuntimeError(msg)
@@ -140,7 +196,8 @@ class Upserter:
     def close_active_rows_of_deleted_entities(self) -> None:
         """Close active rows that have been deleted.
 
-        A row is deleted if the key_hash is not in the new data.
+        A row is deleted if the key_hash is not in the new data. For partial loads,
+        only rows within the scope can be deleted.
         Do not set is_current=False. It is still the current row.
         """
         new_key_hashes = [row["key_hash"] for row in self.data]
@@ -150,6 +207,7 @@ class Upserter:
                 and_(
                     self.entity_class.key_hash.not_in(new_key_hashes),
                     self.entity_class.active_to.is_(None),
+                    self.scope if self.scope is not None else true(),
                 )
             )
             .values(active_to=self.timestamp)
@@ -161,14 +219,25 @@ class Upserter:
 
         # A: Any key_hashes that did already exist will not be included in this list,
         because active_to is not None. Therefor, we will insert records for updated
-        entites as well as new entities.
+        entites as well as new entities. Only key_hashes of the batch are loaded, such
+        that small (partial) batches do not load all key_hashes of the table.
+
+        Keep track of the rows of new entities in created_rows. Entities of which a
+        row was closed by close_active_rows_of_updated_entities are updates, all
+        others are new or re-appeared after being deleted.
         """
-        existing_active_key_hashes = [
+        self.created_rows = []
+        existing_active_key_hashes = {
             item[0]
             for item in self.session.exec(
-                select(self.entity_class.key_hash).distinct()  # A
+                select(self.entity_class.key_hash)
+                .where(
+                    self.entity_class.key_hash.in_(self.key_hashes),
+                    self.entity_class.active_to.is_(None),  # A
+                )
+                .distinct()
             ).all()
-        ]
+        }
         new_and_updated_entities = [
             row
             for row in self.data
@@ -178,9 +247,52 @@ class Upserter:
             return
         statement = insert(self.entity_class).values(new_and_updated_entities)
         self.session.exec(statement)
+        updated_key_hashes = set(self.updated_key_hashes)
+        self.created_rows = [
+            row
+            for row in new_and_updated_entities
+            if row["key_hash"] not in updated_key_hashes
+        ]
+
+    @property
+    def updated_key_hashes(self) -> list[str]:
+        """Key hashes of the entities that received a new SCD2 version in this batch."""
+        return [
+            item[0]
+            for item in self.session.exec(
+                select(self.entity_class.key_hash).where(
+                    and_(
+                        self.entity_class.active_to == self.timestamp,
+                        self.entity_class.is_current.is_(False),
+                    )
+                )
+            ).all()
+        ]
 
     def __del__(self) -> None:
         """Automatically close the session when the object is garbage collected."""
         if self.session:
             with contextlib.suppress(Exception):
                 self.session.close()
+
+
+@dataclass
+class UpsertBatch:
+    """Entities to upsert in one call of Upserter.upsert, as a named stage.
+
+    See VehicleCluster.upsert_batches. The name is used for time_it, and as name
+    of the stage in the refresh flow, see stages.run_stage.
+    """
+
+    name: str
+    entities: list["BaseTable"]
+    entity_class: type["BaseTable"]
+    scope: ColumnElement[bool] | None = None
+
+    @inject
+    def upsert(self, upserter: Upserter) -> None:
+        """Upsert the entities, see Upserter.upsert."""
+        with time_it(self.name):
+            upserter.upsert(
+                self.entities, scope=self.scope, entity_class=self.entity_class
+            )
@@ -1,5 +1,6 @@
 """General utility functions."""
 
+import asyncio
 import time
 from collections.abc import Generator
 from contextlib import contextmanager
@@ -8,6 +9,9 @@ from logging import Logger
 
 from kink import inject
 
+from athlon_flex_notifier.flow_profiler import FlowProfiler
+from athlon_flex_notifier.metrics import Metrics, Span
+
 
 def now() -> datetime:
     """Get now in UTC."""
@@ -16,9 +20,53 @@ def now() -> datetime:
 
 @contextmanager
 @inject
-def time_it(name: str, logger: Logger) -> Generator:
-    """Context manager to use with the 'with' statement to time a block of code."""
-    start = time.time()
-    yield
-    elapsed = round(time.time() - start, 4)
-    logger.debug("%s took %s seconds", name, elapsed)
+def time_it(
+    name: str, logger: Logger, metrics: Metrics, profiler: FlowProfiler
+) -> Generator[Span]:
+    """Context manager to use with the 'with' statement to time a block of code.
+
+    The block is recorded as span name in Metrics, which also records its duration
+    and the number of statements it executed. name must therefor not contain
+    variable data: set that as attributes of the yielded span instead. If the
+    FlowProfiler is profiling, memory is snapshotted at the start and end.
+    """
+    profiler.mark(f"{name}: start")
+    with metrics.span(name) as span:
+        yield span
+    profiler.mark(f"{name}: end")
+    logger.debug("%s took %s seconds", name, round(span.duration, 4))
+
+
+class TokenBucket:
+    """Token bucket rate limiter, to use in asyncio code.
+
+    Tokens are added at a rate of rate per second, up to capacity. Each acquire
+    takes one token, waiting until one is available. This allows bursts of at most
+    capacity, and an average rate of rate per second.
+    """
+
+    rate: float
+    capacity: int
+    tokens: float
+    updated_at: float
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available, and take it."""
+        async with self._lock:
+            while True:
+                current = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (current - self.updated_at) * self.rate
+                )
+                self.updated_at = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from collections.abc import Awaitable, Callable, Generator
+from dataclasses import dataclass, field
+from datetime import datetime
+from uuid import UUID
+
+import pytest
+from aiohttp import web
+from prefect.testing.utilities import prefect_test_harness
+from sqlalchemy import Connection, Engine, create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from athlon_flex_notifier.bootstrap import database_url
+from athlon_flex_notifier.services.fake_athlon_api import Catalog, FakeAthlonApi
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+
+
+@pytest.fixture(scope="session")
+def prefect_server() -> Generator[None]:
+    """Run flows and tasks against a temporary Prefect server."""
+    with prefect_test_harness():
+        yield
+
+
+@pytest.fixture(scope="session")
+def database() -> Generator[Engine]:
+    """Connect to the Postgres configured through the POSTGRES_* variables.
+
+    The migrations must be applied. Tests using the database are skipped if it is
+    not configured or not reachable.
+    """
+    if os.getenv("POSTGRES_HOST") is None:
+        pytest.skip("Postgres is not configured, set the POSTGRES_* variables")
+    engine = create_engine(database_url())
+    try:
+        engine.connect().close()
+    except OperationalError as error:
+        pytest.skip(f"Postgres is not reachable: {error.orig}")
+    yield engine
+    engine.dispose()
+
+
+TABLES = [
+    "vehicle_cluster",
+    "vehicle",
+    "vehicle_pricing",
+    "option_catalog",
+    "vehicle_option_set",
+    "notification",
+    "notification_outbox",
+    "digest_item",
+    "refresh_fingerprint",
+]
+
+
+@pytest.fixture
+def empty_database(database: Engine) -> Engine:
+    """Truncate all tables, for tests of code that commits.
+
+    Never point the POSTGRES_* variables at a database with data you want to keep.
+    """
+    with database.begin() as connection:
+        connection.execute(text(f"TRUNCATE {', '.join(TABLES)} CASCADE"))
+    return database
+
+
+def insert_cluster(
+    connection: Connection,
+    active_from: datetime,
+    active_to: datetime | None = None,
+    vehicle_count: int = 1,
+) -> UUID:
+    """Insert a version of cluster Make Model, which has key hash c.
+
+    Returns
+    -------
+    UUID, the id of the version
+
+    """
+    return connection.execute(
+        text(
+            """
+            INSERT INTO vehicle_cluster (
+                id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+                active_to, is_current, first_vehicle_id, external_type_id, make,
+                model, latest_model_year, vehicle_count, min_price_in_euro_per_month,
+                fiscal_value_in_euro, addition_percentage, external_fuel_type_id,
+                max_co2_emission, image_uri
+            )
+            VALUES (
+                gen_random_uuid(), 'c', 'a', 'a', :active_from, :active_to,
+                :active_to IS NULL, '1', 'x', 'Make', 'Model', 2024, :vehicle_count,
+                1, 1, 1, 1, 1, 'u'
+            )
+            RETURNING id
+            """
+        ),
+        {
+            "active_from": active_from,
+            "active_to": active_to,
+            "vehicle_count": vehicle_count,
+        },
+    ).scalar_one()
+
+
+def insert_vehicle(
+    connection: Connection,
+    key_hash: str,
+    active_from: datetime,
+    active_to: datetime | None,
+    cluster_id: UUID,
+) -> UUID:
+    """Insert a version of a vehicle of cluster_id, with minimal attributes.
+
+    Returns
+    -------
+    UUID, the id of the version
+
+    """
+    return connection.execute(
+        text(
+            """
+            INSERT INTO vehicle (
+                id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+                active_to, is_current, athlon_id, make, model, type, model_year,
+                range_in_km, external_fuel_type_id, external_type_id, uri,
+                vehicle_cluster_id
+            )
+            VALUES (
+                gen_random_uuid(), :key_hash, 'a', 'a', :active_from, :active_to,
+                :active_to IS NULL, :key_hash, 'Make', 'Model', 't', 2024, 1, 1, 'x',
+                'u', :cluster_id
+            )
+            RETURNING id
+            """
+        ),
+        {
+            "key_hash": key_hash,
+            "active_from": active_from,
+            "active_to": active_to,
+            "cluster_id": cluster_id,
+        },
+    ).scalar_one()
+
+
+@dataclass
+class FakeServer:
+    """A FakeAthlonApi served on a free local port.
+
+    Attributes:
+        url: str
+            The base URL, to use as ATHLON_BASE_URL.
+        requests: list[tuple[float, str, str | None]]
+            The time.monotonic at which each request arrived, its path, and the
+            model it filtered on.
+
+    """
+
+    url: str
+    requests: list[tuple[float, str, str | None]] = field(default_factory=list)
+
+    def requests_to(self, path: str, model: str | None = None) -> list[float]:
+        """Get the arrival times of the requests to path, filtering on model."""
+        return [
+            at
+            for at, request_path, request_model in self.requests
+            if request_path.endswith(path) and (model is None or request_model == model)
+        ]
+
+
+@pytest.fixture
+def serve_fake_api() -> Generator[Callable[..., FakeServer]]:
+    """Serve a FakeAthlonApi of a FleetSimulator, in a background event loop.
+
+    Besides the latency of every request, latency_by_model delays the requests of
+    the vehicles of a model, and failures_by_model lets that many of those requests
+    fail with 503 Service Unavailable.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    runners: list[web.AppRunner] = []
+
+    def serve(
+        simulator: FleetSimulator,
+        latency: float = 0.0,
+        latency_by_model: dict[str, float] | None = None,
+        failures_by_model: dict[str, int] | None = None,
+    ) -> FakeServer:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = FakeServer(url=f"http://127.0.0.1:{port}/api/v1")
+        failures = dict(failures_by_model or {})
+
+        @web.middleware
+        async def per_model(
+            request: web.Request,
+            handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+        ) -> web.StreamResponse:
+            model = request.query.get("Filters.Model")
+            server.requests.append((time.monotonic(), request.path, model))
+            await asyncio.sleep((latency_by_model or {}).get(model, 0.0))
+            if failures.get(model, 0) > 0:
+                failures[model] -= 1
+                raise web.HTTPServiceUnavailable
+            return await handler(request)
+
+        app = FakeAthlonApi(
+            catalog=Catalog.from_simulator(simulator),
+            logger=logging.getLogger(__name__),
+            latency=latency,
+        ).app()
+        app.middlewares.append(per_model)
+        runner = web.AppRunner(app)
+        runners.append(runner)
+
+        async def start() -> None:
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+
+        asyncio.run_coroutine_threadsafe(start(), loop).result()
+        return server
+
+    yield serve
+    for runner in runners:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
@@ -0,0 +1,288 @@
+"""Check that the hot queries do not scan the history of the SCD2 tables.
+
+The tables are seeded with clusters, vehicles, pricing, options and notifications
+including history, and each hot query is EXPLAINed. A plan must not contain a
+sequential scan over one of the SCD2 tables. Everything runs in a single
+transaction, which is rolled back: the database is left untouched.
+
+Sequential scans are disabled for the EXPLAINs (enable_seqscan = off). Postgres
+then only plans a sequential scan if no index supports the query, which makes the
+check independent of the amount of seeded data and of the table statistics.
+
+Requires a running Postgres with all migrations applied, see the database fixture.
+Add new hot queries to hot_queries.
+"""
+
+import json
+import re
+from collections.abc import Generator
+from datetime import datetime, timezone
+from typing import Any
+
+import pytest
+from sqlalchemy import (
+    Connection,
+    Engine,
+    Executable,
+    and_,
+    func,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects import postgresql
+
+from athlon_flex_notifier.models.tables import (
+    Notification,
+    NotificationOutbox,
+    OptionCatalog,
+    Vehicle,
+    VehicleCluster,
+    VehicleOptionSet,
+    VehiclePricing,
+)
+
+HISTORY_TABLES = {
+    "vehicle_cluster",
+    "vehicle",
+    "vehicle_pricing",
+    "option_catalog",
+    "vehicle_option_set",
+    "notification",
+}
+# Partitions of vehicle and option, see HistoryPartitioner
+PARTITION_SUFFIX = re.compile(r"_(current|y\d{4}m\d{2})$")
+
+SEED_SIZES = {"clusters": 50, "vehicles": 2000, "options": 5, "versions": 5}
+SEED = [
+    """
+    INSERT INTO vehicle_cluster (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        active_to, is_current, first_vehicle_id, external_type_id, make, model,
+        latest_model_year, vehicle_count, min_price_in_euro_per_month,
+        fiscal_value_in_euro, addition_percentage, external_fuel_type_id,
+        max_co2_emission, image_uri
+    )
+    SELECT
+        gen_random_uuid(), 'seed-c' || c, 'a', 'v' || v,
+        now() - ((v + 1) || ' hours')::interval,
+        CASE WHEN v = 0 THEN NULL ELSE now() - (v || ' hours')::interval END,
+        v = 0, '1', 'x', 'make' || c, 'model' || c, 2024, 1, 1, 1, 1, 1, 1, 'u'
+    FROM generate_series(1, :clusters) c, generate_series(0, :versions - 1) v
+    """,
+    """
+    INSERT INTO vehicle (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        active_to, is_current, athlon_id, make, model, type, model_year, range_in_km,
+        external_fuel_type_id, external_type_id, uri, vehicle_cluster_id
+    )
+    SELECT
+        gen_random_uuid(), 'seed-v' || n, 'a', 'v' || v,
+        now() - ((v + 1) || ' hours')::interval,
+        CASE WHEN v = 0 THEN NULL ELSE now() - (v || ' hours')::interval END,
+        v = 0, 'seed-' || n, vc.make, vc.model, 't', 2024, 1, 1, 'x', 'u', vc.id
+    FROM generate_series(1, :vehicles) n
+    CROSS JOIN generate_series(0, :versions - 1) v
+    JOIN vehicle_cluster vc
+        ON vc.key_hash = 'seed-c' || (n % :clusters + 1) AND vc.active_to IS NULL
+    """,
+    """
+    INSERT INTO vehicle_pricing (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        active_to, is_current, vehicle_key_hash, net_cost_in_euro_per_month
+    )
+    SELECT
+        gen_random_uuid(), 'seed-p' || ve.key_hash, 'a', 'v' || ve.active_from,
+        ve.active_from, ve.active_to, ve.is_current, ve.key_hash, 100
+    FROM vehicle ve
+    WHERE ve.key_hash LIKE 'seed-v%'
+    """,
+    """
+    INSERT INTO option_catalog (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        is_current, athlon_id, "externalId", "optionName"
+    )
+    SELECT
+        gen_random_uuid(), 'seed-o' || o, 'a', 'a', now(), true, 'seed-' || o, 'x',
+        'option'
+    FROM generate_series(1, :options) o
+    """,
+    """
+    INSERT INTO vehicle_option_set (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        active_to, is_current, vehicle_key_hash, option_ids, included_option_ids
+    )
+    SELECT
+        gen_random_uuid(), 'seed-s' || ve.key_hash, 'a', 'v' || ve.active_from,
+        ve.active_from, ve.active_to, ve.is_current, ve.key_hash,
+        ARRAY(SELECT 'seed-' || o FROM generate_series(1, :options) o),
+        ARRAY['seed-1']
+    FROM vehicle ve
+    WHERE ve.key_hash LIKE 'seed-v%'
+    """,
+    """
+    INSERT INTO notification (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        is_current, vehicle_key_hash, available_since
+    )
+    SELECT
+        gen_random_uuid(), 'seed-n' || n, 'a', 'a', now(), true, 'seed-v' || n,
+        now() - (n || ' minutes')::interval
+    FROM generate_series(1, :vehicles) n
+    """,
+    "ANALYZE vehicle_cluster, vehicle, vehicle_pricing, option_catalog, "
+    "vehicle_option_set, notification, notification_outbox",
+]
+
+
+def hot_queries() -> dict[str, Executable]:
+    """Get the hot queries, as executed by the Upserter and the notifications."""
+    key_hashes = [f"seed-v{n}" for n in range(1, 200)]
+    cluster_key_hashes = ["seed-c1", "seed-c2"]
+    timestamp = datetime.now(timezone.utc)
+    vehicles_scope, pricing_scope, option_sets_scope = VehicleCluster.scopes(
+        VehicleCluster.key_hash.in_(cluster_key_hashes)
+    )
+    queries = {}
+    for entity in [
+        VehicleCluster,
+        Vehicle,
+        VehiclePricing,
+        OptionCatalog,
+        VehicleOptionSet,
+        Notification,
+    ]:
+        name = entity.__tablename__
+        queries[f"{name}: Upserter.scd1"] = (
+            update(entity)
+            .where(
+                and_(
+                    entity.key_hash == "seed-v1",
+                    entity.attribute_hash_scd1 != "b",
+                    entity.active_to.is_(None),
+                )
+            )
+            .values(attribute_hash_scd1="b")
+        )
+        queries[f"{name}: Upserter.close_active_rows_of_updated_entities"] = (
+            update(entity)
+            .where(
+                and_(
+                    entity.key_hash == "seed-v1",
+                    entity.attribute_hash_scd2 != "b",
+                    entity.active_to.is_(None),
+                )
+            )
+            .values(active_to=timestamp, is_current=False)
+        )
+        queries[f"{name}: Upserter.create_rows_for_updated_and_new_entities"] = (
+            select(entity.key_hash)
+            .where(entity.key_hash.in_(key_hashes), entity.active_to.is_(None))
+            .distinct()
+        )
+        queries[f"{name}: Upserter.updated_key_hashes"] = select(entity.key_hash).where(
+            entity.active_to == timestamp, entity.is_current.is_(False)
+        )
+        queries[f"{name}: BaseTable.as_of"] = select(entity).where(
+            entity.active_at(timestamp)
+        )
+    for entity, scope in [
+        (Vehicle, vehicles_scope),
+        (VehiclePricing, pricing_scope),
+        (VehicleOptionSet, option_sets_scope),
+    ]:
+        queries[
+            f"{entity.__tablename__}: Upserter.close_active_rows_of_deleted_entities"
+        ] = (
+            update(entity)
+            .where(
+                and_(
+                    entity.key_hash.not_in(key_hashes),
+                    entity.active_to.is_(None),
+                    scope,
+                )
+            )
+            .values(active_to=timestamp)
+        )
+    queries["vehicle_cluster: VehicleCluster.changed_key_hashes"] = select(
+        VehicleCluster.key_hash,
+        VehicleCluster.attribute_hash_scd1,
+        VehicleCluster.attribute_hash_scd2,
+    ).where(VehicleCluster.active_to.is_(None))
+    queries["notification: availability lookup"] = select(Notification).where(
+        Notification.vehicle_key_hash == "seed-v1",
+        Notification.available_since == timestamp,
+    )
+    queries["notification_outbox: NotificationOutbox.claim_pending"] = (
+        select(NotificationOutbox)
+        .where(NotificationOutbox.processed_at.is_(None))
+        .where(NotificationOutbox.attempts < NotificationOutbox.MAX_ATTEMPTS)
+        .where(
+            or_(
+                NotificationOutbox.claimed_at.is_(None),
+                NotificationOutbox.claimed_at
+                < func.now() - NotificationOutbox.CLAIM_TIMEOUT,
+            )
+        )
+        .order_by(NotificationOutbox.created_at)
+        .limit(50)
+    )
+    return queries
+
+
+def sequential_scans(plan: dict[str, Any]) -> list[str]:
+    """Get the tables of HISTORY_TABLES that are scanned sequentially in a plan.
+
+    Partitions are reported by their own name.
+    """
+    tables = []
+    relation = plan.get("Relation Name", "")
+    if (
+        plan.get("Node Type") == "Seq Scan"
+        and PARTITION_SUFFIX.sub("", relation) in HISTORY_TABLES
+    ):
+        tables.append(relation)
+    for child in plan.get("Plans", []):
+        tables.extend(sequential_scans(child))
+    return tables
+
+
+def explain(connection: Connection, statement: Executable) -> dict[str, Any]:
+    """Get the plan of a statement, without executing it."""
+    sql = statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    # Not text(), since literal timestamps contain colons
+    result = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar_one()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]["Plan"]
+
+
+@pytest.fixture(scope="module")
+def seeded(database: Engine) -> Generator[Connection]:
+    """Seed the tables within a transaction, and roll it back afterwards."""
+    with database.connect() as connection:
+        for statement in SEED:
+            connection.execute(
+                text(statement).bindparams(
+                    **{
+                        key: value
+                        for key, value in SEED_SIZES.items()
+                        if f":{key}" in statement
+                    }
+                )
+            )
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        yield connection
+        connection.rollback()
+
+
+HOT_QUERIES = hot_queries()
+
+
+@pytest.mark.parametrize("statement", list(HOT_QUERIES.values()), ids=list(HOT_QUERIES))
+def test_hot_query_does_not_scan_history(
+    seeded: Connection, statement: Executable
+) -> None:
+    assert sequential_scans(explain(seeded, statement)) == []
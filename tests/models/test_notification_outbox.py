@@ -0,0 +1,127 @@
+"""Test enqueueing availabilities in the outbox, and claiming them.
+
+Requires a running Postgres with all migrations applied, see the database fixture.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import Engine, select, update
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables import NotificationOutbox, Vehicle
+
+AVAILABLE_SINCE = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+def created_row(key_hash: str) -> dict[str, Any]:
+    """Get a vehicle row, as created by the Upserter."""
+    return {
+        "key_hash": key_hash,
+        "make": "Make",
+        "model": "Model",
+        "active_from": AVAILABLE_SINCE,
+    }
+
+
+def outbox(database: Engine) -> list[NotificationOutbox]:
+    with Session(database) as session:
+        statement = select(NotificationOutbox).order_by(
+            NotificationOutbox.vehicle_key_hash
+        )
+        return [item[0] for item in session.exec(statement).all()]
+
+
+def enqueue(database: Engine, key_hashes: list[str]) -> None:
+    with Session(database) as session:
+        Vehicle.on_upsert(session, [created_row(key_hash) for key_hash in key_hashes])
+        session.commit()
+
+
+def test_on_upsert_enqueues_created_vehicles(empty_database: Engine) -> None:
+    enqueue(empty_database, ["v1", "v2"])
+
+    messages = outbox(empty_database)
+    assert [message.vehicle_key_hash for message in messages] == ["v1", "v2"]
+    assert all(message.available_since == AVAILABLE_SINCE for message in messages)
+    assert all(message.processed_at is None for message in messages)
+
+
+def test_availability_is_enqueued_once(empty_database: Engine) -> None:
+    enqueue(empty_database, ["v1"])
+    enqueue(empty_database, ["v1", "v2"])
+
+    assert [message.vehicle_key_hash for message in outbox(empty_database)] == [
+        "v1",
+        "v2",
+    ]
+
+
+def test_on_upsert_is_rolled_back_with_the_upsert(empty_database: Engine) -> None:
+    with Session(empty_database) as session:
+        Vehicle.on_upsert(session, [created_row("v1")])
+        session.rollback()
+
+    assert outbox(empty_database) == []
+
+
+def test_claimed_rows_are_skipped_until_released(empty_database: Engine) -> None:
+    enqueue(empty_database, ["v1", "v2"])
+
+    with Session(empty_database) as session:
+        claimed = NotificationOutbox.claim_pending(session, 1)
+        ids = [message.id for message in claimed]
+        session.commit()
+    with Session(empty_database) as session:
+        other = NotificationOutbox.claim_pending(session, 10)
+        other_ids = [message.id for message in other]
+        session.commit()
+
+    assert len(ids) == 1
+    assert len(other_ids) == 1
+    assert set(ids).isdisjoint(other_ids)
+    with Session(empty_database) as session:
+        assert NotificationOutbox.claim_pending(session, 10) == []
+        NotificationOutbox.release(session, ids)
+        NotificationOutbox.mark_processed(session, other_ids)
+        session.commit()
+    with Session(empty_database) as session:
+        reclaimed = NotificationOutbox.claim_pending(session, 10)
+        assert [message.id for message in reclaimed] == ids
+        session.commit()
+    assert {message.id: message.attempts for message in outbox(empty_database)} == {
+        ids[0]: 2,
+        other_ids[0]: 1,
+    }
+
+
+def test_abandoned_claims_are_claimed_again(empty_database: Engine) -> None:
+    enqueue(empty_database, ["v1"])
+    with Session(empty_database) as session:
+        NotificationOutbox.claim_pending(session, 10)
+        session.commit()
+
+    with Session(empty_database) as session:
+        session.exec(
+            update(NotificationOutbox).values(
+                claimed_at=datetime.now(timezone.utc)
+                - NotificationOutbox.CLAIM_TIMEOUT
+                - timedelta(minutes=1)
+            )
+        )
+        session.commit()
+    with Session(empty_database) as session:
+        assert len(NotificationOutbox.claim_pending(session, 10)) == 1
+
+
+def test_dead_letters_are_not_claimed(empty_database: Engine) -> None:
+    enqueue(empty_database, ["v1"])
+    with Session(empty_database) as session:
+        session.exec(
+            update(NotificationOutbox).values(attempts=NotificationOutbox.MAX_ATTEMPTS)
+        )
+        session.commit()
+
+    with Session(empty_database) as session:
+        assert NotificationOutbox.claim_pending(session, 10) == []
+        assert NotificationOutbox.count_dead_letters(session) == 1
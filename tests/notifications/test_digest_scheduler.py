@@ -0,0 +1,188 @@
+"""Test the windows, rate limits and locks of the DigestScheduler.
+
+The tests that send digests require a running Postgres with all migrations applied,
+see the database fixture.
+"""
+
+import logging
+import smtplib
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from kink import di
+from sqlalchemy import Engine, select, update
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables.digest_item import DigestItem
+from athlon_flex_notifier.notifications.digest_scheduler import DigestScheduler
+from athlon_flex_notifier.notifications.email_notifier import EmailNotifier
+from athlon_flex_notifier.notifications.subscriber import Subscriber
+from athlon_flex_notifier.services.shard_locks import ShardLocks, shard_of
+
+AVAILABLE_SINCE = datetime(2026, 10, 1, tzinfo=timezone.utc)
+HOURLY = Subscriber(
+    email="hourly@example.com", window=timedelta(hours=1), max_per_day=12
+)
+
+
+@pytest.fixture
+def sent(monkeypatch: pytest.MonkeyPatch) -> list[tuple[list[str], list[str]]]:
+    """Record the recipients and vehicle key hashes of each digest, without SMTP."""
+    sent = []
+
+    def send(notifier: EmailNotifier, _: smtplib.SMTP, recipients: list[str]) -> None:
+        sent.append(
+            (
+                recipients,
+                [
+                    availability.vehicle_key_hash
+                    for availability in notifier.availabilities_to_notify
+                ],
+            )
+        )
+
+    monkeypatch.setitem(di.factories, smtplib.SMTP, lambda _: MagicMock())
+    monkeypatch.setattr(EmailNotifier, "send", send)
+    return sent
+
+
+def scheduler(database: Engine, *subscribers: Subscriber) -> DigestScheduler:
+    return DigestScheduler(
+        logger=logging.getLogger(__name__),
+        database=database,
+        subscribers=list(subscribers),
+    )
+
+
+def enqueue(
+    database: Engine, subscribers: list[Subscriber], key_hashes: list[str]
+) -> None:
+    with Session(database) as session:
+        DigestItem.enqueue(
+            session,
+            [subscriber.email for subscriber in subscribers],
+            [
+                {
+                    "vehicle_key_hash": key_hash,
+                    "make": "Make",
+                    "model": "Model",
+                    "available_since": AVAILABLE_SINCE,
+                }
+                for key_hash in key_hashes
+            ],
+        )
+        session.commit()
+
+
+def pending(database: Engine, subscriber: Subscriber) -> list[str]:
+    with Session(database) as session:
+        statement = (
+            select(DigestItem.vehicle_key_hash)
+            .where(DigestItem.subscriber == subscriber.email)
+            .where(DigestItem.sent_at.is_(None))
+            .order_by(DigestItem.vehicle_key_hash)
+        )
+        return [item[0] for item in session.exec(statement).all()]
+
+
+def age_digests(database: Engine, by: timedelta) -> None:
+    """Move the digests that were sent back in time."""
+    with Session(database) as session:
+        session.exec(
+            update(DigestItem)
+            .where(DigestItem.sent_at.is_not(None))
+            .values(sent_at=DigestItem.sent_at - by)
+        )
+        session.commit()
+
+
+def item(key_hash: str) -> DigestItem:
+    return DigestItem(
+        subscriber="",
+        vehicle_key_hash=key_hash,
+        make="Make",
+        model="Model",
+        available_since=AVAILABLE_SINCE,
+    )
+
+
+def test_subscribers_with_the_same_items_share_a_digest() -> None:
+    due = {
+        "a@example.com": [item("v1"), item("v2")],
+        # Claimed in another order
+        "b@example.com": [item("v2"), item("v1")],
+        "c@example.com": [item("v1")],
+    }
+
+    digests = DigestScheduler._coalesce(due)  # noqa: SLF001
+
+    assert [recipients for recipients, _ in digests] == [
+        ["a@example.com", "b@example.com"],
+        ["c@example.com"],
+    ]
+    assert [len(items) for _, items in digests] == [2, 1]
+
+
+def test_items_within_the_window_are_coalesced(
+    empty_database: Engine, sent: list[tuple[list[str], list[str]]]
+) -> None:
+    enqueue(empty_database, [HOURLY], ["v1"])
+    assert scheduler(empty_database, HOURLY).send() == 1
+
+    enqueue(empty_database, [HOURLY], ["v2"])
+    enqueue(empty_database, [HOURLY], ["v3"])
+    assert scheduler(empty_database, HOURLY).send() == 0
+    assert pending(empty_database, HOURLY) == ["v2", "v3"]
+
+    age_digests(empty_database, HOURLY.window)
+    assert scheduler(empty_database, HOURLY).send() == 1
+
+    assert sent == [([HOURLY.email], ["v1"]), ([HOURLY.email], ["v2", "v3"])]
+    assert pending(empty_database, HOURLY) == []
+
+
+def test_rate_limit_spans_24_hours(
+    empty_database: Engine, sent: list[tuple[list[str], list[str]]]
+) -> None:
+    subscriber = Subscriber(
+        email="limited@example.com", window=timedelta(0), max_per_day=2
+    )
+    for key_hash in ["v1", "v2", "v3"]:
+        enqueue(empty_database, [subscriber], [key_hash])
+        scheduler(empty_database, subscriber).send()
+
+    assert [key_hashes for _, key_hashes in sent] == [["v1"], ["v2"]]
+    assert pending(empty_database, subscriber) == ["v3"]
+
+    # Both digests are no longer within the last 24 hours
+    age_digests(empty_database, timedelta(days=1))
+    assert scheduler(empty_database, subscriber).send() == 1
+    assert pending(empty_database, subscriber) == []
+
+
+def test_nothing_is_sent_without_pending_items(
+    empty_database: Engine, sent: list[tuple[list[str], list[str]]]
+) -> None:
+    assert scheduler(empty_database, HOURLY).send() == 0
+    assert sent == []
+
+
+def test_subscriber_claimed_by_a_concurrent_run_is_skipped(
+    empty_database: Engine, sent: list[tuple[list[str], list[str]]]
+) -> None:
+    other = Subscriber(email="other@example.com", window=HOURLY.window, max_per_day=12)
+    enqueue(empty_database, [HOURLY, other], ["v1"])
+
+    with Session(empty_database) as concurrent:
+        assert ShardLocks(namespace="digest").claim_for_transaction(
+            concurrent, shard_of(HOURLY.email, 2**31)
+        )
+        assert scheduler(empty_database, HOURLY, other).send() == 1
+        concurrent.rollback()
+
+    assert sent == [([other.email], ["v1"])]
+    assert pending(empty_database, HOURLY) == ["v1"]
+    # Once the concurrent run ends, the digest is sent by the next run
+    assert scheduler(empty_database, HOURLY, other).send() == 1
+    assert pending(empty_database, HOURLY) == []
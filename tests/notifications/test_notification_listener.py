@@ -0,0 +1,113 @@
+"""Test that the listener is woken up by the NOTIFY of committed outbox rows.
+
+Requires a running Postgres with all migrations applied, see the database fixture.
+"""
+
+import logging
+import select
+import threading
+from collections.abc import Generator
+from datetime import datetime, timezone
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+from psycopg2.extensions import connection as Psycopg2Connection  # noqa: N812
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from athlon_flex_notifier.models.tables import NotificationOutbox
+from athlon_flex_notifier.notifications.notification_listener import (
+    NotificationListener,
+)
+
+
+def enqueue(database: Engine, key_hashes: list[str]) -> None:
+    with Session(database) as session:
+        NotificationOutbox.enqueue(session, rows(key_hashes))
+        session.commit()
+
+
+def rows(key_hashes: list[str]) -> list[dict[str, Any]]:
+    return [
+        {
+            "vehicle_key_hash": key_hash,
+            "make": "Make",
+            "model": "Model",
+            "available_since": datetime(2026, 10, 1, tzinfo=timezone.utc),
+        }
+        for key_hash in key_hashes
+    ]
+
+
+@pytest.fixture
+def listening(empty_database: Engine) -> Generator[Psycopg2Connection]:
+    """Get a DBAPI connection that listens on NotificationOutbox.CHANNEL."""
+    connection = empty_database.raw_connection()
+    dbapi_connection = connection.dbapi_connection
+    dbapi_connection.set_session(autocommit=True)
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {NotificationOutbox.CHANNEL}")
+    yield dbapi_connection
+    connection.close()
+
+
+def listener(database: Engine, drainer: Mock | None = None) -> NotificationListener:
+    return NotificationListener(
+        logger=logging.getLogger(__name__),
+        database=database,
+        drainer=drainer or Mock(),
+        scheduler=Mock(),
+    )
+
+
+def test_events_are_published_on_commit(
+    empty_database: Engine, listening: Psycopg2Connection
+) -> None:
+    with Session(empty_database) as session:
+        NotificationOutbox.enqueue(session, rows(["v1"]))
+        session.flush()
+        listening.poll()
+        assert listening.notifies == []
+        session.commit()
+
+    select.select([listening], [], [], 5)
+    listening.poll()
+    assert len(listening.notifies) == 1
+
+
+def test_events_are_coalesced(
+    empty_database: Engine, listening: Psycopg2Connection
+) -> None:
+    enqueue(empty_database, ["v1"])
+    later = threading.Timer(0.2, enqueue, (empty_database, ["v2", "v3"]))
+    later.start()
+
+    key_hashes = listener(empty_database)._wait_for_events(listening, 1.0)  # noqa: SLF001
+
+    later.join()
+    assert key_hashes == {"v1", "v2", "v3"}
+
+
+def test_re_enqueued_rows_are_not_published(
+    empty_database: Engine, listening: Psycopg2Connection
+) -> None:
+    enqueue(empty_database, ["v1"])
+    select.select([listening], [], [], 5)
+    listening.poll()
+    listening.notifies.clear()
+
+    enqueue(empty_database, ["v1"])
+
+    select.select([listening], [], [], 0.5)
+    listening.poll()
+    assert listening.notifies == []
+
+
+def test_drain_failures_are_retried_later(empty_database: Engine) -> None:
+    drainer = Mock()
+    drainer.drain.side_effect = RuntimeError("SMTP is down")
+
+    listener(empty_database, drainer)._drain(None)  # noqa: SLF001
+
+    drainer.drain.assert_called_once_with(filters=None)
@@ -0,0 +1,129 @@
+import logging
+import time
+from collections.abc import Callable
+from itertools import pairwise
+
+import pytest
+from athlon_flex_client import AthlonFlexClient
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+
+from athlon_flex_notifier.services.cluster_detail_fetcher import (
+    ClusterDetailFetcher,
+    _athlon_client_class,
+)
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+from tests.conftest import FakeServer
+
+pytestmark = pytest.mark.usefixtures("prefect_server")
+
+
+def client_of(server: FakeServer, monkeypatch: pytest.MonkeyPatch) -> AthlonFlexClient:
+    monkeypatch.setenv("ATHLON_BASE_URL", server.url)
+    return _athlon_client_class()(email="driver@example.com", password="secret")
+
+
+def fetch(
+    fetcher: ClusterDetailFetcher, simulator: FleetSimulator
+) -> tuple[list[VehicleClusterBase], list[VehicleClusterBase], float]:
+    """Fetch all clusters of simulator.
+
+    Returns
+    -------
+    list[VehicleClusterBase], the consumed clusters
+    list[VehicleClusterBase], the failed clusters
+    float, the duration in seconds
+
+    """
+    clusters = simulator.vehicle_clusters(include_vehicles=False).vehicle_clusters
+    consumed = []
+    started_at = time.monotonic()
+    failed = fetcher.fetch(clusters, consumer=consumed.append)
+    return consumed, failed, time.monotonic() - started_at
+
+
+def test_duration_tracks_slowest_cluster(
+    serve_fake_api: Callable[..., FakeServer], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    simulator = FleetSimulator(clusters=16, vehicles_per_cluster=3, seed=1)
+
+    def fetch_from(server: FakeServer) -> tuple[list[VehicleClusterBase], float]:
+        fetcher = ClusterDetailFetcher(
+            client=client_of(server, monkeypatch),
+            logger=logging.getLogger(__name__),
+            max_concurrency=16,
+            requests_per_second=1000,
+        )
+        consumed, failed, duration = fetch(fetcher, simulator)
+        assert failed == []
+        return consumed, duration
+
+    # The overhead of the stages (Prefect task runs) does not depend on the latency
+    _, overhead = fetch_from(serve_fake_api(simulator))
+    consumed, duration = fetch_from(
+        serve_fake_api(simulator, latency=0.5, latency_by_model={"Model0": 3.0})
+    )
+
+    assert len(consumed) == 16
+    assert all(len(cluster.vehicles) == 3 for cluster in consumed)
+    # Each cluster loads its vehicles, and then their details: two rounds of latency
+    slowest = 3.0 + 2 * 0.5
+    total = slowest + 15 * 2 * 0.5
+    assert slowest <= duration < overhead + slowest + 1.5
+    assert duration < total / 2
+
+
+def test_requests_are_rate_limited(
+    serve_fake_api: Callable[..., FakeServer], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    simulator = FleetSimulator(clusters=6, vehicles_per_cluster=4, seed=2)
+    server = serve_fake_api(simulator)
+    rate, capacity = 20, 4
+    fetcher = ClusterDetailFetcher(
+        client=client_of(server, monkeypatch),
+        logger=logging.getLogger(__name__),
+        max_concurrency=capacity,
+        requests_per_second=rate,
+    )
+
+    consumed, failed, duration = fetch(fetcher, simulator)
+
+    assert failed == []
+    assert len(consumed) == 6
+    arrivals = sorted(
+        server.requests_to("/VehicleVariation") + server.requests_to("/Vehicle")
+    )
+    assert len(arrivals) == 6 + 6 * 4
+    assert duration >= (len(arrivals) - capacity) / rate * 0.9
+    # No window holds more requests than the burst plus the refill during it
+    window = 0.5
+    for start in arrivals:
+        in_window = [at for at in arrivals if start <= at < start + window]
+        assert len(in_window) <= capacity + rate * window + 1
+
+
+def test_failing_cluster_is_retried_with_backoff(
+    serve_fake_api: Callable[..., FakeServer], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    simulator = FleetSimulator(clusters=3, vehicles_per_cluster=2, seed=3)
+    server = serve_fake_api(simulator, failures_by_model={"Model0": 2, "Model1": 100})
+    backoff = 0.1
+    fetcher = ClusterDetailFetcher(
+        client=client_of(server, monkeypatch),
+        logger=logging.getLogger(__name__),
+        requests_per_second=1000,
+        max_retries=3,
+        backoff_seconds=backoff,
+    )
+
+    consumed, failed, _ = fetch(fetcher, simulator)
+
+    assert [cluster.model for cluster in failed] == ["Model1"]
+    assert sorted(cluster.model for cluster in consumed) == ["Model0", "Model2"]
+    assert len(server.requests_to("/VehicleVariation", "Model0")) == 3
+    attempts = server.requests_to("/VehicleVariation", "Model1")
+    assert len(attempts) == 1 + 3
+    delays = [later - earlier for earlier, later in pairwise(attempts)]
+    for attempt, delay in enumerate(delays):
+        assert delay >= backoff * 2**attempt * 0.9
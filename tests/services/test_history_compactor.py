@@ -0,0 +1,153 @@
+"""Test merging redundant SCD2 versions.
+
+Requires a running Postgres with all migrations applied and vw_vehicle_availability
+created, see the database fixture.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Engine, text
+
+from athlon_flex_notifier.models.tables import (
+    Vehicle,
+    VehicleCluster,
+    VehiclePricing,
+)
+from athlon_flex_notifier.models.tables.base_table import BaseTable
+from athlon_flex_notifier.services.history_compactor import (
+    CompactionReport,
+    HistoryCompactor,
+)
+from tests.conftest import insert_cluster, insert_vehicle
+
+T0, T1, T2, T3 = (
+    datetime(2026, 9, 1, tzinfo=timezone.utc) + timedelta(days=day) for day in range(4)
+)
+
+INSERT_PRICING = """
+    INSERT INTO vehicle_pricing (
+        id, key_hash, attribute_hash_scd1, attribute_hash_scd2, active_from,
+        active_to, is_current, vehicle_key_hash, base_price_in_euro_per_month,
+        net_cost_in_euro_per_month
+    )
+    VALUES (
+        gen_random_uuid(), :vehicle_key_hash, 'a', 'a', :active_from, :active_to,
+        :active_to IS NULL, :vehicle_key_hash, :base_price, :net_cost
+    )
+"""
+
+
+def compactor(database: Engine, *entities: type[BaseTable]) -> HistoryCompactor:
+    return HistoryCompactor(
+        logger=logging.getLogger(__name__),
+        database=database,
+        batch_size=1,
+        entities=entities,
+    )
+
+
+def versions(database: Engine, table: str) -> list[tuple]:
+    """Get the key hash, active_from and active_to of the versions in a table."""
+    with database.connect() as connection:
+        return list(
+            connection.execute(
+                text(
+                    "SELECT key_hash, active_from, active_to "  # noqa: S608
+                    f"FROM {table} ORDER BY key_hash, active_from"
+                )
+            ).all()
+        )
+
+
+def availabilities(database: Engine) -> list[tuple]:
+    with database.connect() as connection:
+        return list(
+            connection.execute(
+                text(
+                    "SELECT vehicle_key_hash, available_since, available_until "
+                    "FROM vw_vehicle_availability "
+                    "ORDER BY vehicle_key_hash, available_since"
+                )
+            ).all()
+        )
+
+
+def test_contiguous_equal_versions_are_merged(empty_database: Engine) -> None:
+    with empty_database.begin() as connection:
+        cluster_id = insert_cluster(connection, T0)
+        for active_from, active_to in [(T0, T1), (T1, T2), (T2, None)]:
+            insert_vehicle(connection, "v1", active_from, active_to, cluster_id)
+        # Deleted at T1, and available again since T2
+        for active_from, active_to in [(T0, T1), (T2, None)]:
+            insert_vehicle(connection, "v2", active_from, active_to, cluster_id)
+    before = availabilities(empty_database)
+
+    report = compactor(empty_database, Vehicle).compact()
+
+    assert report == {
+        "vehicle": CompactionReport(entities=2, runs_merged=1, rows_reclaimed=2)
+    }
+    assert versions(empty_database, "vehicle") == [
+        ("v1", T0, None),
+        ("v2", T0, T1),
+        ("v2", T2, None),
+    ]
+    assert availabilities(empty_database) == before
+
+
+def test_versions_that_differ_in_volatile_attributes_are_merged(
+    empty_database: Engine,
+) -> None:
+    with empty_database.begin() as connection:
+        for active_from, active_to, base_price, net_cost in [
+            (T0, T1, 100, 90),
+            (T1, T2, 100, 95),
+            # The base price is not volatile: starts a new run
+            (T2, T3, 110, 95),
+            (T3, None, 110, 90),
+        ]:
+            connection.execute(
+                text(INSERT_PRICING),
+                {
+                    "vehicle_key_hash": "v1",
+                    "active_from": active_from,
+                    "active_to": active_to,
+                    "base_price": base_price,
+                    "net_cost": net_cost,
+                },
+            )
+
+    compactor(empty_database, VehiclePricing).compact()
+
+    with empty_database.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT active_from, active_to, base_price_in_euro_per_month, "
+                "net_cost_in_euro_per_month FROM vehicle_pricing ORDER BY active_from"
+            )
+        ).all()
+    # Each run is merged into its last version
+    assert [tuple(row) for row in rows] == [(T0, T2, 100, 95), (T2, None, 110, 90)]
+
+
+def test_references_to_deleted_versions_are_re_pointed(
+    empty_database: Engine,
+) -> None:
+    with empty_database.begin() as connection:
+        # Versions that only differ in scd1 attributes, for example after a replay
+        first_id = insert_cluster(connection, T0, T1, vehicle_count=1)
+        kept_id = insert_cluster(connection, T1, None, vehicle_count=2)
+        insert_vehicle(connection, "v1", T0, None, first_id)
+        insert_vehicle(connection, "v2", T1, None, kept_id)
+
+    compactor(empty_database, VehicleCluster).compact()
+
+    with empty_database.connect() as connection:
+        cluster_ids = connection.execute(text("SELECT id FROM vehicle_cluster")).all()
+        vehicle_cluster_ids = connection.execute(
+            text("SELECT DISTINCT vehicle_cluster_id FROM vehicle")
+        ).all()
+    assert [row[0] for row in cluster_ids] == [kept_id]
+    assert [row[0] for row in vehicle_cluster_ids] == [kept_id]
+    assert versions(empty_database, "vehicle_cluster") == [("c", T0, None)]
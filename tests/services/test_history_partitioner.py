@@ -0,0 +1,113 @@
+"""Test creating and archiving the monthly partitions of the vehicle history.
+
+Requires a running Postgres with all migrations applied and vw_vehicle_availability
+created, see the database fixture.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from kink import di
+from sqlalchemy import Engine, text
+
+from athlon_flex_notifier.models.tables import Notification
+from athlon_flex_notifier.models.views.vehicle_availability import VehicleAvailability
+from athlon_flex_notifier.services.history_partitioner import (
+    HistoryPartitioner,
+    _add_months,
+)
+from athlon_flex_notifier.upserter import Upserter
+from tests.conftest import insert_cluster, insert_vehicle
+
+THIS_MONTH = datetime.now(timezone.utc).replace(
+    day=1, hour=0, minute=0, second=0, microsecond=0
+)
+# Beyond a retention of 1 month
+OLD_MONTH = _add_months(THIS_MONTH, -3)
+T0, T1, T2 = (OLD_MONTH + timedelta(days=day) for day in (1, 10, 20))
+
+
+def partitioner(database: Engine, retention_months: int | None) -> HistoryPartitioner:
+    return HistoryPartitioner(
+        logger=logging.getLogger(__name__),
+        database=database,
+        months_ahead=1,
+        retention_months=retention_months,
+        archive_schema=None,
+    )
+
+
+def insert_versions(
+    database: Engine, versions: dict[str, list[tuple[datetime, datetime | None]]]
+) -> None:
+    """Insert the versions of each vehicle, given by their active_from and active_to."""
+    with database.begin() as connection:
+        cluster_id = insert_cluster(connection, T0)
+        for key_hash, periods in versions.items():
+            for active_from, active_to in periods:
+                insert_vehicle(connection, key_hash, active_from, active_to, cluster_id)
+
+
+def count(database: Engine, table: str) -> int:
+    with database.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar_one()  # noqa: S608
+
+
+def available_since(database: Engine) -> dict[str, datetime]:
+    """Get the start of the current availability of each vehicle."""
+    with database.connect() as connection:
+        return dict(
+            connection.execute(
+                text(
+                    "SELECT vehicle_key_hash, available_since "
+                    "FROM vw_vehicle_availability WHERE available_until IS NULL"
+                )
+            ).all()
+        )
+
+
+def test_closed_rows_are_moved_to_their_partition(empty_database: Engine) -> None:
+    insert_versions(empty_database, {"v1": [(T0, T1), (T1, None)]})
+
+    partitioner(empty_database, retention_months=None).maintain()
+
+    partitions = partitioner(empty_database, None).partitions("vehicle")
+    assert {OLD_MONTH, THIS_MONTH, _add_months(THIS_MONTH, 1)} <= partitions.keys()
+    assert count(empty_database, "vehicle_current") == 1
+    assert count(empty_database, partitions[OLD_MONTH]) == 1
+
+
+def test_archiving_keeps_current_availabilities(empty_database: Engine) -> None:
+    insert_versions(
+        empty_database,
+        {
+            # Available since T0, with two versions in the archived month
+            "v1": [(T0, T1), (T1, T2), (T2, None)],
+            # Deleted at T1, and available again since T2
+            "v2": [(T0, T1), (T2, None)],
+            # Deleted at T1
+            "v3": [(T0, T1)],
+        },
+    )
+    di[Upserter].upsert(
+        [
+            Notification.create_from_availability(availability)
+            for availability in VehicleAvailability.all()
+        ]
+    )
+    assert available_since(empty_database) == {"v1": T0, "v2": T2}
+    assert VehicleAvailability.to_notify() == []
+
+    partitioner(empty_database, retention_months=1).maintain()
+
+    assert OLD_MONTH not in partitioner(empty_database, 1).partitions("vehicle")
+    assert count(empty_database, "vehicle") == 2
+    assert available_since(empty_database) == {"v1": T0, "v2": T2}
+    assert VehicleAvailability.to_notify() == []
+
+
+def test_months_are_added_across_years() -> None:
+    december = datetime(2025, 12, 1, tzinfo=timezone.utc)
+
+    assert _add_months(december, 1) == datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert _add_months(december, -12) == datetime(2024, 12, 1, tzinfo=timezone.utc)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from athlon_flex_notifier.services.pipeline import Pipeline
+
+LOGGER = logging.getLogger(__name__)
+
+
+def run(pipeline: Pipeline, items: range) -> None:
+    with pipeline:
+        for item in items:
+            pipeline.put(item)
+
+
+def test_items_flow_through_stages_in_order() -> None:
+    written = []
+
+    with Pipeline(
+        LOGGER,
+        [
+            ("double", lambda item: item * 2),
+            ("drop_tens", lambda item: None if item % 10 == 0 else item),
+            ("write", written.append),
+        ],
+    ) as pipeline:
+        for item in range(10):
+            pipeline.put(item)
+
+    assert written == [2, 4, 6, 8, 12, 14, 16, 18]
+    assert [stats.items for stats in pipeline.stats] == [10, 10, 8]
+    assert pipeline.producer.items == 10
+
+
+def test_slow_stage_blocks_put() -> None:
+    release = threading.Event()
+    written = []
+
+    def write(item: int) -> None:
+        release.wait()
+        written.append(item)
+
+    pipeline = Pipeline(
+        LOGGER, [("map", lambda item: item), ("write", write)], maxsize=2
+    )
+
+    producer = threading.Thread(target=run, args=(pipeline, range(20)))
+    producer.start()
+    time.sleep(0.5)
+
+    # Each stage holds one item, and each queue at most maxsize
+    assert producer.is_alive()
+    assert pipeline.producer.items <= 2 * (1 + 2)
+    assert all(stats.max_queue_depth <= 2 for stats in pipeline.stats)
+    release.set()
+    producer.join(timeout=5)
+    assert written == list(range(20))
+
+
+def test_stage_error_is_raised_on_exit() -> None:
+    queued = threading.Event()
+    processed = []
+
+    def write(item: int) -> None:
+        queued.wait()
+        if item == 0:
+            msg = "Failed to write"
+            raise ValueError(msg)
+        processed.append(item)
+
+    def queue_all(pipeline: Pipeline) -> None:
+        with pipeline:
+            for item in range(5):
+                pipeline.put(item)
+            queued.set()
+
+    with pytest.raises(ValueError, match="Failed to write"):
+        queue_all(Pipeline(LOGGER, [("write", write)]))
+
+    # Items after the failure are drained without processing
+    assert processed == []
+
+
+def test_put_raises_after_stage_error() -> None:
+    failed = threading.Event()
+
+    def write(_: int) -> None:
+        failed.set()
+        msg = "Failed to write"
+        raise ValueError(msg)
+
+    def put_after_failure(pipeline: Pipeline) -> None:
+        with pipeline:
+            pipeline.put(0)
+            failed.wait(timeout=5)
+            while pipeline.error is None:
+                time.sleep(0.01)
+            pipeline.put(1)
+
+    with pytest.raises(RuntimeError, match="a stage failed") as error:
+        put_after_failure(Pipeline(LOGGER, [("write", write)]))
+
+    # The error of the body is not replaced by the error of the stage
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_error_in_body_stops_the_stages() -> None:
+    processed = []
+    pipeline = Pipeline(LOGGER, [("write", processed.append)])
+
+    def fail_after_put() -> None:
+        with pipeline:
+            pipeline.put(0)
+            raise KeyError
+
+    with pytest.raises(KeyError):
+        fail_after_put()
+
+    assert processed == [0]
+    assert not any(thread.is_alive() for thread in pipeline.threads)
@@ -0,0 +1,109 @@
+import logging
+from unittest.mock import Mock
+
+import pytest
+
+from athlon_flex_notifier.services.refresh_scheduler import (
+    RefreshScheduler,
+    _cron_field,
+)
+
+
+@pytest.fixture
+def scheduler() -> RefreshScheduler:
+    return RefreshScheduler(
+        logger=logging.getLogger(__name__),
+        database=Mock(),
+        min_interval=5,
+        max_interval=60,
+        default_interval=10,
+        changes_per_refresh=1.0,
+        timezone="Europe/Amsterdam",
+    )
+
+
+def test_default_interval_without_history(scheduler: RefreshScheduler) -> None:
+    assert scheduler.intervals(None) == dict.fromkeys(range(24), 10)
+
+
+@pytest.mark.parametrize(
+    ("rate", "interval"),
+    [
+        # One change every 5 minutes
+        (12.0, 5),
+        # Rounded down to an interval that aligns across hours
+        (7.0, 6),
+        (2.5, 20),
+        # Bounded by min_interval and max_interval
+        (100.0, 5),
+        (0.5, 60),
+        (0.0, 60),
+    ],
+)
+def test_interval_follows_rate(
+    scheduler: RefreshScheduler, rate: float, interval: int
+) -> None:
+    assert scheduler.intervals({0: rate}) == {0: interval}
+
+
+def test_constant_interval_is_one_schedule(scheduler: RefreshScheduler) -> None:
+    schedules = scheduler.schedules(dict.fromkeys(range(24), 10))
+
+    assert [schedule.cron for schedule in schedules] == ["*/10 * * * *"]
+    assert schedules[0].timezone == "Europe/Amsterdam"
+
+
+def test_hours_with_the_same_minutes_share_a_schedule(
+    scheduler: RefreshScheduler,
+) -> None:
+    intervals = {hour: 60 if hour < 12 else 15 for hour in range(24)}
+
+    schedules = scheduler.schedules(intervals)
+
+    assert [schedule.cron for schedule in schedules] == [
+        "0 0,1,2,3,4,5,6,7,8,9,10,11 * * *",
+        "*/15 12,13,14,15,16,17,18,19,20,21,22,23 * * *",
+    ]
+
+
+def test_shorter_interval_starts_at_its_hour(scheduler: RefreshScheduler) -> None:
+    intervals = {hour: 45 if hour == 0 else 10 for hour in range(24)}
+
+    crons = [schedule.cron for schedule in scheduler.schedules(intervals)]
+
+    # The run after 0:45 is at 1:00, not at 1:30
+    assert crons == [
+        "*/45 0 * * *",
+        "*/10 " + ",".join(str(hour) for hour in range(1, 24)) + " * * *",
+    ]
+
+
+@pytest.mark.parametrize(
+    ("values", "size", "field"),
+    [
+        ([0, 15, 30, 45], 60, "*/15"),
+        (list(range(24)), 24, "*"),
+        ([0, 12], 24, "*/12"),
+        ([0], 60, "0"),
+        ([5, 35], 60, "5,35"),
+        # Evenly spaced, but not up to the end of the range
+        ([0, 15, 30], 60, "0,15,30"),
+    ],
+)
+def test_cron_field(values: list[int], size: int, field: str) -> None:
+    assert _cron_field(values, size) == field
+
+
+@pytest.mark.parametrize(
+    ("counts", "days", "mean"),
+    [
+        ([1, 2, 3], 3, 2.0),
+        # Days without changes count as 0
+        ([6], 3, 2.0),
+        # The busiest tenth of the days is left out
+        ([100], 10, 0.0),
+        ([], 0, 0.0),
+    ],
+)
+def test_trimmed_mean(counts: list[int], days: int, mean: float) -> None:
+    assert RefreshScheduler._trimmed_mean(counts, days) == mean  # noqa: SLF001
@@ -0,0 +1,139 @@
+"""Test that the Refresher skips clusters by their fingerprint.
+
+The tests of _write_cluster require a running Postgres with all migrations applied,
+see the database fixture.
+"""
+
+import logging
+from collections.abc import Iterator
+from unittest.mock import Mock
+from uuid import uuid4
+
+import pytest
+from athlon_flex_client.models.vehicle_cluster import (
+    VehicleCluster as VehicleClusterBase,
+)
+
+from athlon_flex_notifier.metrics import Metrics
+from athlon_flex_notifier.models.tables import RefreshFingerprint, VehicleCluster
+from athlon_flex_notifier.refresher import MappedCluster, Refresher
+from athlon_flex_notifier.services.fleet_simulator import FleetSimulator
+from athlon_flex_notifier.services.snapshot_archive import SnapshotArchive
+
+
+@pytest.fixture
+def base_cluster() -> VehicleClusterBase:
+    simulator = FleetSimulator(clusters=1, vehicles_per_cluster=3, seed=1)
+    return simulator.vehicle_clusters().vehicle_clusters[0]
+
+
+@pytest.fixture
+def refresher(base_cluster: VehicleClusterBase) -> Refresher:
+    """Get a Refresher, as prepared by refresh to map base_cluster."""
+    refresher = Refresher(
+        client=Mock(),
+        logger=logging.getLogger(__name__),
+        fetcher=Mock(),
+        upserter=Mock(),
+        archive=SnapshotArchive(logger=logging.getLogger(__name__)),
+        locks=Mock(),
+        metrics=Metrics(),
+    )
+    key_hash = VehicleCluster.create_by_api_response(base_cluster).compute_key_hash()
+    refresher.fingerprints = {}
+    refresher.cluster_ids = {key_hash: uuid4()}
+    refresher.skipped_clusters = 0
+    refresher.archived_clusters = []
+    return refresher
+
+
+def key_of(base_cluster: VehicleClusterBase) -> str:
+    return RefreshFingerprint.cluster_key(base_cluster.make, base_cluster.model)
+
+
+def test_changed_cluster_is_mapped(
+    refresher: Refresher, base_cluster: VehicleClusterBase
+) -> None:
+    refresher.fingerprints = {key_of(base_cluster): "stale"}
+
+    mapped = refresher._map_cluster(base_cluster)  # noqa: SLF001
+
+    assert mapped is not None
+    assert mapped.key == key_of(base_cluster)
+    assert mapped.fingerprint == refresher.archive.put(base_cluster)
+    assert len(mapped.vehicles) == 3
+    assert refresher.skipped_clusters == 0
+    assert refresher.archived_clusters == [mapped.fingerprint]
+
+
+def test_unchanged_cluster_is_skipped(
+    refresher: Refresher, base_cluster: VehicleClusterBase
+) -> None:
+    fingerprint = refresher.archive.put(base_cluster)
+    refresher.fingerprints = {key_of(base_cluster): fingerprint}
+
+    assert refresher._map_cluster(base_cluster) is None  # noqa: SLF001
+    assert refresher.skipped_clusters == 1
+    # Skipped clusters are archived as well, such that the snapshot is complete
+    assert refresher.archived_clusters == [fingerprint]
+
+
+def test_fingerprint_depends_on_vehicles(
+    refresher: Refresher, base_cluster: VehicleClusterBase
+) -> None:
+    fingerprint = refresher.archive.put(base_cluster)
+    changed = base_cluster.model_copy(update={"vehicles": base_cluster.vehicles[:2]})
+    refresher.fingerprints = {key_of(base_cluster): fingerprint}
+
+    assert refresher._map_cluster(changed) is not None  # noqa: SLF001
+
+
+@pytest.mark.usefixtures("empty_database")
+def test_store_load_and_invalidate() -> None:
+    RefreshFingerprint.store({"a": "1", "b": "2"})
+    RefreshFingerprint.store({"a": "3"})
+    assert RefreshFingerprint.load() == {"a": "3", "b": "2"}
+
+    RefreshFingerprint.invalidate(["a", "unknown"])
+    RefreshFingerprint.invalidate([])
+
+    assert RefreshFingerprint.load() == {"b": "2"}
+
+
+def mapped_cluster() -> MappedCluster:
+    return MappedCluster(
+        key="cluster:Make:Model", fingerprint="new", key_hash="k", vehicles={}
+    )
+
+
+@pytest.mark.usefixtures("empty_database")
+def test_fingerprint_is_stored_after_the_cluster(
+    refresher: Refresher, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    RefreshFingerprint.store({"cluster:Make:Model": "old"})
+    monkeypatch.setattr(VehicleCluster, "upsert_batches", Mock(return_value=[]))
+
+    refresher._write_cluster(mapped_cluster())  # noqa: SLF001
+
+    assert RefreshFingerprint.load() == {"cluster:Make:Model": "new"}
+
+
+@pytest.mark.usefixtures("empty_database")
+def test_fingerprint_is_invalidated_if_storing_fails(
+    refresher: Refresher, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def failing_batches(*_: object, **__: object) -> Iterator:
+        # The fingerprint must already be invalidated when the first batch is stored
+        assert RefreshFingerprint.load() == {}
+        msg = "Database is down"
+        raise RuntimeError(msg)
+        yield
+
+    RefreshFingerprint.store({"cluster:Make:Model": "old"})
+    monkeypatch.setattr(VehicleCluster, "upsert_batches", failing_batches)
+
+    with pytest.raises(RuntimeError, match="Database is down"):
+        refresher._write_cluster(mapped_cluster())  # noqa: SLF001
+
+    # The next refresh does not skip the partially stored cluster
+    assert RefreshFingerprint.load() == {}